@@ -0,0 +1,258 @@
+from datetime import datetime, timedelta
+from time import time
+
+from django.conf import settings
+from django.db import connections, reset_queries, DEFAULT_DB_ALIAS
+from django.core.urlresolvers import clear_url_caches
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
+from geyser.models import Droplet
+from geyser.managers import bulk_insert
+
+
+DROPLETS_PER_PUBLISHABLE = 5
+UNPUBLISHED_EVERY = 7
+FUTURE_EVERY = 53
+PAGE_SIZE = 20
+BATCH_SIZE = 100
+CHUNK_SIZE = 10000
+
+
+class Dataset(object):
+    """
+    A synthetic set of test app objects and droplets used by the benchmarks.
+    
+    Attributes:
+    
+    * `num_droplets`: The number of droplets generated.
+    * `user`: The superuser who published the droplets.
+    * `publishables`: A list of ids of published `TestModel1` objects.
+    * `publications`: A list of `TestModel2` and `TestModel3` objects, to
+      which the publishables are published in turn.
+    * `fresh_publishables`: A list of `TestModel1` objects which have not been
+      published, for benchmarks which publish.
+    * `sample`: A list of up to ten published `TestModel1` objects.
+    * `target`: A `TestModel3` object with no droplets, for benchmarks which
+      publish.
+    * `seconds`: The time taken to generate the dataset.
+    
+    """
+    
+    def __init__(self, num_droplets, num_publications=50, num_fresh=100,
+            using=DEFAULT_DB_ALIAS):
+        from geyser.tests.testapp.models import TestModel1, TestModel2, \
+            TestModel3
+        started = time()
+        self.num_droplets = num_droplets
+        self.user = User.objects.db_manager(using).create_superuser(
+            'benchmark', 'benchmark@example.com', 'benchmark')
+        
+        for Publication in (TestModel2, TestModel3):
+            bulk_insert([Publication(name='publication %s' % i)
+                for i in range(num_publications)], using)
+        self.publications = list(TestModel2.objects.using(using)) + \
+            list(TestModel3.objects.using(using))
+        self.target = TestModel3.objects.using(using).create(name='target')
+        
+        num_publishables = max(1, num_droplets // DROPLETS_PER_PUBLISHABLE)
+        bulk_insert([TestModel1(name='publishable %s' % i, owner=self.user)
+            for i in range(num_publishables)], using)
+        self.publishables = list(TestModel1.objects.using(using)
+            .order_by('id').values_list('id', flat=True))
+        self.sample = list(TestModel1.objects.using(using).filter(
+            pk__in=self.publishables[:10]))
+        self.fresh_publishables = [TestModel1.objects.using(using).create(
+                name='fresh %s' % i, owner=self.user)
+            for i in range(num_fresh)]
+        
+        publishable_type = ContentType.objects.get_for_model(TestModel1)
+        publication_types = dict((Publication,
+                ContentType.objects.get_for_model(Publication))
+            for Publication in (TestModel2, TestModel3))
+        now = datetime.now()
+        droplets = []
+        for i in range(num_droplets):
+            publication = self.publications[i % len(self.publications)]
+            droplets.append(Droplet(
+                publishable_type=publishable_type,
+                publishable_id=self.publishables[
+                    (i // DROPLETS_PER_PUBLISHABLE) % num_publishables],
+                publication_type=publication_types[publication.__class__],
+                publication_id=publication.pk,
+                is_current=bool(i % UNPUBLISHED_EVERY),
+                published=now + timedelta(minutes=(i % FUTURE_EVERY == 0
+                    and 60 or i - num_droplets)),
+                published_by=self.user,
+            ))
+            if len(droplets) == CHUNK_SIZE:
+                bulk_insert(droplets, using)
+                droplets = []
+        bulk_insert(droplets, using)
+        self.seconds = time() - started
+
+
+def measure(function, repeat=3, using=DEFAULT_DB_ALIAS):
+    """
+    Runs a function `repeat + 1` times, passing the run number. The first run
+    counts queries with a debug cursor; the others are timed without it.
+    Returns a dictionary of the query count and the minimum and mean times.
+    
+    """
+    
+    connection = connections[using]
+    original_debug = settings.DEBUG
+    settings.DEBUG = True
+    reset_queries()
+    try:
+        function(0)
+        queries = len(connection.queries)
+    finally:
+        settings.DEBUG = original_debug
+        reset_queries()
+    
+    times = []
+    for i in range(1, repeat + 1):
+        started = time()
+        function(i)
+        times.append(time() - started)
+    return {
+        'queries': queries,
+        'seconds_min': min(times),
+        'seconds_mean': sum(times) / len(times),
+    }
+
+
+def get_cases(dataset):
+    """
+    Returns a list of `(name, function)` pairs for the hot paths to measure.
+    Each function takes the run number, so that benchmarks which publish or
+    unpublish can use different objects on each run.
+    
+    """
+    
+    from geyser.tests.testapp.models import TestModel1
+    
+    publication = dataset.publications[0]
+    publications = dataset.publications[:10]
+    now = datetime.now()
+    fresh = dataset.fresh_publishables
+    batch = lambda i: fresh[(i * 10) % len(fresh):][:10]
+    
+    def listing(**kwargs):
+        return lambda i: list(Droplet.objects.get_list(**kwargs)[:PAGE_SIZE])
+    
+    cases = [
+        ('get_list', listing()),
+        ('get_list publications', listing(publications=publication)),
+        ('get_list many publications', listing(publications=publications)),
+        ('get_list publishable',
+            lambda i: list(Droplet.objects.get_list(
+                publishable=dataset.sample[i % len(dataset.sample)]))),
+        ('get_list publishable_models',
+            listing(publishable_models=TestModel1)),
+        ('get_list publishable_filters',
+            listing(publishable_filters={'name__startswith': 'publishable 1'})),
+        ('get_list year month', listing(year=now.year, month=now.month)),
+        ('get_list include_unpublished include_future',
+            listing(publications=publication, include_unpublished=True,
+                include_future=True)),
+        ('generic iteration',
+            lambda i: list(Droplet.objects.get_list(
+                publications=publication)[:BATCH_SIZE * 10])),
+        ('generic iterator_generic',
+            lambda i: list(Droplet.objects.get_list(
+                publications=publication)[:BATCH_SIZE * 10]
+                .iterator_generic(BATCH_SIZE))),
+        ('publish',
+            lambda i: Droplet.objects.publish(fresh[i], [dataset.target])),
+        ('unpublish',
+            lambda i: Droplet.objects.unpublish(fresh[i], [dataset.target])),
+        ('publish_many',
+            lambda i: Droplet.objects.publish_many(batch(i),
+                publications, published=now)),
+        ('unpublish_many',
+            lambda i: Droplet.objects.unpublish_many(batch(i), publications)),
+    ]
+    return cases
+
+
+def get_view_cases(dataset):
+    """
+    Returns `(name, function)` pairs which request the `PublishObject` view in
+    `geyser.tests.testurls` as the dataset's superuser.
+    
+    """
+    
+    from django.test.client import Client
+    
+    client = Client()
+    client.login(username='benchmark', password='benchmark')
+    publishable = dataset.sample[0]
+    allowed = list(Droplet.objects.get_allowed_publication_keys(
+        publishable, dataset.user).pairs())
+    
+    def post(i):
+        current = set(Droplet.objects.get_list(publishable=publishable,
+            include_future=True).values_list(
+                'publication_type_id', 'publication_id'))
+        data = {
+            'form-TOTAL_FORMS': len(allowed),
+            'form-INITIAL_FORMS': len(allowed),
+        }
+        for (n, (type, publication)) in enumerate(allowed):
+            data['form-%s-type' % n] = type.id
+            data['form-%s-id' % n] = publication.id
+            if (type.id, publication.id) in current:
+                data['form-%s-publish' % n] = 'on'
+        if 'form-0-publish' in data:
+            del data['form-0-publish']
+        else:
+            data['form-0-publish'] = 'on'
+        # toggle the first publication on each run
+        client.post('/t1/%s/' % publishable.pk, data)
+    
+    return [
+        ('PublishObject GET',
+            lambda i: client.get('/t1/%s/' % publishable.pk)),
+        ('PublishObject POST', post),
+    ]
+
+
+def run_benchmark(num_droplets, repeat=3, num_publications=50, views=True,
+        using=DEFAULT_DB_ALIAS):
+    """
+    Generates a dataset with the given number of droplets and measures the
+    hot paths against it. The test app must be installed (see
+    `geyser.tests.base.install_test_app`) and the database should otherwise
+    be empty; the generated objects are left in place.
+    
+    Returns a dictionary which can be serialized as JSON.
+    
+    """
+    
+    # each run of the publish benchmarks needs its own fresh publishable
+    dataset = Dataset(num_droplets, num_publications,
+        num_fresh=max(100, repeat + 1), using=using)
+    cases = get_cases(dataset)
+    original_urlconf = settings.ROOT_URLCONF
+    if views:
+        settings.ROOT_URLCONF = 'geyser.tests.testurls'
+        clear_url_caches()
+        cases.extend(get_view_cases(dataset))
+    try:
+        benchmarks = []
+        for (name, function) in cases:
+            result = measure(function, repeat, using)
+            result['name'] = name
+            benchmarks.append(result)
+    finally:
+        settings.ROOT_URLCONF = original_urlconf
+        clear_url_caches()
+    return {
+        'droplets': num_droplets,
+        'publications': len(dataset.publications),
+        'generate_seconds': dataset.seconds,
+        'benchmarks': benchmarks,
+    }
@@ -0,0 +1,208 @@
+import threading
+from time import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+from geyser.registry import get_registry
+
+
+class ObjectCache(object):
+    """
+    Base class for caches of generically related objects.
+    
+    Objects are keyed by `(content_type_id, pk)`. Subclasses implement
+    `_get_many`, `_set_many` and `_delete`, which may be called from several
+    threads at once; this class keeps the hit and miss counters.
+    
+    """
+    
+    def __init__(self, timeout=300, max_size=1000):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+    
+    def get_many(self, content_type_id, pks):
+        """
+        Returns a dictionary mapping pks to cached objects of the given type.
+        Pks that are not cached are left out.
+        
+        """
+        
+        pks = list(pks)
+        found = self._get_many(content_type_id, pks)
+        self._stats_lock.acquire()
+        try:
+            self.hits += len(found)
+            self.misses += len(pks) - len(found)
+        finally:
+            self._stats_lock.release()
+        return found
+    
+    def set_many(self, content_type_id, objects):
+        """Caches a dictionary of objects (by pk) of the given type."""
+        if objects:
+            self._set_many(content_type_id, objects)
+    
+    def delete(self, content_type_id, pk):
+        self._delete(content_type_id, pk)
+    
+    def reset_stats(self):
+        self._stats_lock.acquire()
+        try:
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self._stats_lock.release()
+
+
+class LocalObjectCache(ObjectCache):
+    """
+    A per-process least-recently-used cache, shared by the threads of the
+    process under a lock.
+    
+    Objects are stored pickled, as by Django's local memory cache, so each
+    get returns fresh instances which one request can change without
+    affecting the others.
+    
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super(LocalObjectCache, self).__init__(*args, **kwargs)
+        self._objects = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _get_many(self, content_type_id, pks):
+        found = {}
+        now = time()
+        self._lock.acquire()
+        try:
+            for pk in pks:
+                key = (content_type_id, pk)
+                try:
+                    (obj, expires) = self._objects.pop(key)
+                except KeyError:
+                    continue
+                if expires is None or expires > now:
+                    self._objects[key] = (obj, expires)
+                    # re-inserting moves the key to the most recently used end
+                    found[pk] = obj
+        finally:
+            self._lock.release()
+        return dict([(pk, pickle.loads(pickled))
+            for (pk, pickled) in found.items()])
+    
+    def _set_many(self, content_type_id, objects):
+        if self.timeout:
+            expires = time() + self.timeout
+        else:
+            expires = None
+        pickled = dict([(pk, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+            for (pk, obj) in objects.items()])
+        self._lock.acquire()
+        try:
+            for (pk, obj) in pickled.items():
+                key = (content_type_id, pk)
+                self._objects.pop(key, None)
+                self._objects[key] = (obj, expires)
+            while len(self._objects) > self.max_size:
+                del self._objects[iter(self._objects).next()]
+        finally:
+            self._lock.release()
+    
+    def _delete(self, content_type_id, pk):
+        self._lock.acquire()
+        try:
+            self._objects.pop((content_type_id, pk), None)
+        finally:
+            self._lock.release()
+
+
+class DjangoObjectCache(ObjectCache):
+    """A cache backed by Django's cache framework, shared between processes."""
+    
+    key_prefix = 'geyser.object'
+    
+    def _key(self, content_type_id, pk):
+        return '%s.%s.%s' % (self.key_prefix, content_type_id, pk)
+    
+    def _get_many(self, content_type_id, pks):
+        from django.core.cache import cache
+        keys = dict((self._key(content_type_id, pk), pk) for pk in pks)
+        cached = cache.get_many(keys.keys())
+        return dict((keys[key], obj) for (key, obj) in cached.items())
+    
+    def _set_many(self, content_type_id, objects):
+        from django.core.cache import cache
+        cache.set_many(dict((self._key(content_type_id, pk), obj)
+            for (pk, obj) in objects.items()), self.timeout)
+    
+    def _delete(self, content_type_id, pk):
+        from django.core.cache import cache
+        cache.delete(self._key(content_type_id, pk))
+
+
+OBJECT_CACHE_BACKENDS = {
+    'local': LocalObjectCache,
+    'django': DjangoObjectCache,
+}
+
+_object_cache = None
+
+
+def get_object_cache():
+    """
+    Returns the object cache configured by the `GEYSER_OBJECT_CACHE` setting,
+    or `None` if caching is disabled.
+    
+    """
+    
+    global _object_cache
+    options = getattr(settings, 'GEYSER_OBJECT_CACHE', None)
+    if not options:
+        return None
+    if _object_cache is None:
+        options = dict(options)
+        Backend = OBJECT_CACHE_BACKENDS[options.pop('backend', 'local')]
+        _object_cache = Backend(**options)
+    return _object_cache
+
+
+def reset_object_cache():
+    """Discards the current object cache so that it is rebuilt from settings."""
+    global _object_cache
+    _object_cache = None
+
+
+def is_cached_model(Model):
+    """
+    Returns whether objects of the given model may be cached, meaning that it
+    is a publishable or publication type in `GEYSER_PUBLISHABLES`.
+    
+    """
+    
+    return get_registry().is_registered(Model)
+
+
+def invalidate_object(sender, **kwargs):
+    object_cache = get_object_cache()
+    if object_cache is not None and is_cached_model(sender):
+        from django.contrib.contenttypes.models import ContentType
+        instance = kwargs['instance']
+        content_type = ContentType.objects.get_for_model(instance)
+        object_cache.delete(content_type.id, instance.pk)
+
+post_save.connect(invalidate_object, dispatch_uid='geyser.cache.save')
+post_delete.connect(invalidate_object, dispatch_uid='geyser.cache.delete')
@@ -0,0 +1,231 @@
+import heapq
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models.query import QuerySet
+from django.contrib.contenttypes.models import ContentType
+
+
+class _Head(object):
+    """The next droplet of one source in a `Feed` merge, newest first."""
+    
+    def __init__(self, droplet, source):
+        self.droplet = droplet
+        self.source = source
+        self.key = (droplet.published, droplet.pk)
+    
+    def __cmp__(self, other):
+        return cmp(other.key, self.key)
+
+
+class Feed(object):
+    """
+    Current droplets from several publications, merged into one stream with
+    the most recently published first.
+    
+    Each source (a publication, or a queryset of droplets) is read a page of
+    `per_source` droplets at a time, using `GenericQuerySet.seek` rather than
+    one large query over all sources, and the pages are merged as they are
+    needed. Iterating over the first items of a feed therefore costs about
+    `per_source` rows per source, however many droplets each has.
+    
+    Droplets which share the same `first` droplet (the same publishable
+    published to several of the sources) are only included once, unless
+    `dedupe` is `False`. Generically related objects are fetched in bulk for
+    every `chunk_size` droplets yielded.
+    
+    Other keyword arguments are passed to `Droplet.objects.get_list` for each
+    publication.
+    
+    Typical usage, to show the latest 50 droplets from a list of blogs::
+    
+        from itertools import islice
+        droplets = list(islice(Droplet.objects.get_feed(blogs), 50))
+    
+    """
+    
+    def __init__(self, sources, per_source=20, chunk_size=100, dedupe=True,
+            **kwargs):
+        self.sources = sources
+        self.per_source = per_source
+        self.chunk_size = chunk_size
+        self.dedupe = dedupe
+        self.filters = kwargs
+    
+    def get_querysets(self):
+        """Returns a queryset of droplets for each source."""
+        from geyser.models import Droplet
+        querysets = []
+        for source in self.sources:
+            if isinstance(source, QuerySet):
+                querysets.append(source)
+            else:
+                filters = dict(self.filters)
+                filters['queries'] = list(filters.get('queries', []))
+                filters['filters'] = dict(filters.get('filters', {}))
+                # get_list adds to these, so each source needs its own copy
+                querysets.append(Droplet.objects.get_list(
+                    publications=source, **filters))
+        return querysets
+    
+    def _stream(self, queryset):
+        """Yields droplets from one queryset, a page at a time."""
+        position = None
+        while True:
+            page = list(queryset.seek(position)[:self.per_source].iterator())
+            for droplet in page:
+                yield droplet
+            if len(page) < self.per_source:
+                return
+            position = (page[-1].published, page[-1].pk)
+    
+    def _merge(self):
+        """Yields droplets from all sources, newest first, without duplicates."""
+        heap = []
+        for queryset in self.get_querysets():
+            source = self._stream(queryset)
+            for droplet in source:
+                heap.append(_Head(droplet, source))
+                break
+        heapq.heapify(heap)
+        
+        seen = set()
+        while heap:
+            head = heap[0]
+            droplet = head.droplet
+            for next_droplet in head.source:
+                heapq.heapreplace(heap, _Head(next_droplet, head.source))
+                break
+            else:
+                heapq.heappop(heap)
+            if self.dedupe:
+                key = droplet.first_id or droplet.pk
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield droplet
+    
+    def __iter__(self):
+        from geyser.models import Droplet
+        attach_to = Droplet.objects.all()
+        chunk = []
+        for droplet in self._merge():
+            chunk.append(droplet)
+            if len(chunk) >= self.chunk_size:
+                for chunk_item in attach_to._attach_generic(chunk):
+                    yield chunk_item
+                chunk = []
+        if chunk:
+            for chunk_item in attach_to._attach_generic(chunk):
+                yield chunk_item
+
+
+class FeedSnapshots(object):
+    """
+    The ids of the latest droplets published to each publication, kept in
+    Django's cache.
+    
+    Each snapshot holds the ids of up to `size` current droplets which have
+    been published, newest first, and the date of the next droplet due to be
+    published in the future, after which it is out of date. A snapshot is
+    discarded whenever droplets on its publication are published, saved or
+    unpublished, rather than changed in place where concurrent updates could
+    overwrite each other, and is rebuilt from the database with two queries
+    when it is next read.
+    
+    """
+    
+    key_prefix = 'geyser.feed'
+    
+    def __init__(self, size=20, timeout=None):
+        self.size = size
+        self.timeout = timeout
+    
+    def _key(self, publication_type_id, publication_id):
+        return '%s.%s.%s' % (self.key_prefix, publication_type_id,
+            publication_id)
+    
+    def _set(self, key, snapshot):
+        from django.core.cache import cache
+        if self.timeout is None:
+            cache.set(key, snapshot)
+        else:
+            cache.set(key, snapshot, self.timeout)
+    
+    def _build(self, publication_type_id, publication_id, now):
+        from geyser.models import Droplet
+        droplets = Droplet.objects.lean().filter(
+            publication_type=publication_type_id,
+            publication_id=publication_id, is_current=True)
+        ids = list(droplets.filter(published__lte=now)
+            .order_by('-published', '-id').values_list('id', flat=True)
+            [:self.size])
+        until = list(droplets.filter(published__gt=now)
+            .order_by('published').values_list('published', flat=True)[:1])
+        snapshot = {
+            'ids': ids,
+            'until': until and until[0] or None,
+        }
+        self._set(self._key(publication_type_id, publication_id), snapshot)
+        return snapshot
+    
+    def get_ids(self, publication, rebuild=False):
+        """
+        Returns the ids of the latest current droplets on a publication. If
+        `rebuild` is true, the snapshot is rebuilt from the database first.
+        
+        """
+        
+        from django.core.cache import cache
+        publication_type = ContentType.objects.get_for_model(publication)
+        key = self._key(publication_type.id, publication.pk)
+        now = datetime.now()
+        snapshot = None
+        if not rebuild:
+            snapshot = cache.get(key)
+        if snapshot is not None and snapshot['until'] is not None and \
+                snapshot['until'] <= now:
+            # a future droplet is now due
+            snapshot = None
+        if snapshot is None:
+            snapshot = self._build(publication_type.id, publication.pk, now)
+        return snapshot['ids']
+    
+    def discard(self, publication_keys):
+        """
+        Discards the snapshots of publications, given
+        `(publication_type_id, publication_id)` pairs, so that they are
+        rebuilt when next read.
+        
+        """
+        
+        from django.core.cache import cache
+        keys = set([self._key(publication_type_id, publication_id)
+            for (publication_type_id, publication_id) in publication_keys])
+        if keys:
+            cache.delete_many(list(keys))
+
+
+_feed_snapshots = None
+
+
+def get_feed_snapshots():
+    """
+    Returns the feed snapshot store configured by the `GEYSER_FEED_SNAPSHOTS`
+    setting, or `None` if snapshots are disabled.
+    
+    """
+    
+    global _feed_snapshots
+    options = getattr(settings, 'GEYSER_FEED_SNAPSHOTS', None)
+    if not options:
+        return None
+    if _feed_snapshots is None:
+        _feed_snapshots = FeedSnapshots(**options)
+    return _feed_snapshots
+
+
+def reset_feed_snapshots():
+    """Discards the current snapshot store so that it is rebuilt from settings."""
+    global _feed_snapshots
+    _feed_snapshots = None
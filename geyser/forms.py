@@ -15,4 +15,64 @@ class PublishDateTimeForm(forms.Form):
         required=False,
         label='Publish when?',
         help_text='Affects new publishings only. Leave blank to publish now.'
-    )
\ No newline at end of file
+    )
+
+
+class PublicationKeysField(forms.Field):
+    """
+    A list of publications given as ``'<content type id>-<id>'`` strings,
+    cleaned to `(content_type_id, id)` pairs.
+    
+    """
+    
+    widget = forms.MultipleHiddenInput
+    
+    def to_python(self, value):
+        if not value:
+            return []
+        keys = []
+        for key in value:
+            try:
+                (type_id, pk) = [int(part) for part in key.split('-')]
+            except ValueError:
+                raise forms.ValidationError(
+                    'Enter publications as "<type id>-<id>".')
+            keys.append((type_id, pk))
+        return keys
+
+
+class PublishChangesForm(forms.Form):
+    """
+    The publications to publish an object to and unpublish it from, used by
+    `PublishObject` when it is paginated. Requires the `AllowedPublications`
+    for the object as the `allowed` keyword argument.
+    
+    """
+    
+    publish = PublicationKeysField(required=False)
+    unpublish = PublicationKeysField(required=False)
+    
+    def __init__(self, *args, **kwargs):
+        self.allowed = kwargs.pop('allowed')
+        super(PublishChangesForm, self).__init__(*args, **kwargs)
+    
+    def _clean_keys(self, name):
+        keys = self.cleaned_data[name]
+        for key in keys:
+            if key not in self.allowed:
+                raise forms.ValidationError(
+                    'You may not publish to %s-%s.' % key)
+        return keys
+    
+    def clean_publish(self):
+        return self._clean_keys('publish')
+    
+    def clean_unpublish(self):
+        return self._clean_keys('unpublish')
+    
+    def clean(self):
+        publish = set(self.cleaned_data.get('publish', []))
+        if publish.intersection(self.cleaned_data.get('unpublish', [])):
+            raise forms.ValidationError(
+                'A publication cannot be both published and unpublished.')
+        return self.cleaned_data
@@ -0,0 +1,77 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils import simplejson
+
+from geyser.benchmark import run_benchmark
+from geyser.tests.base import install_test_app, uninstall_test_app
+
+
+class Command(NoArgsCommand):
+    help = ('Times the Droplet publishing and listing hot paths against '
+        'synthetic datasets in a test database, and prints the results as '
+        'JSON.')
+    option_list = NoArgsCommand.option_list + (
+        make_option('--scales', action='store', dest='scales',
+            default='10000,100000,1000000', help='A comma-separated list of '
+                'numbers of droplets to generate. Defaults to '
+                '"10000,100000,1000000".'),
+        make_option('--publications', action='store', dest='publications',
+            default=50, type='int', help='The number of publications of each '
+                'type. Defaults to 50.'),
+        make_option('--repeat', action='store', dest='repeat', default=3,
+            type='int', help='The number of timed runs of each benchmark. '
+                'Defaults to 3.'),
+        make_option('--no-views', action='store_false', dest='views',
+            default=True, help='Skips the PublishObject view benchmarks.'),
+        make_option('--output', action='store', dest='output', default=None,
+            help='A file to write the results to, instead of printing them.'),
+        make_option('--database', action='store', dest='database',
+            default=DEFAULT_DB_ALIAS, help='Nominates the database whose test '
+                'database is used. Defaults to the "default" database.'),
+        make_option('--noinput', action='store_false', dest='interactive',
+            default=True, help='Tells Django to NOT prompt the user for input '
+                'of any kind, replacing an existing test database.'),
+    )
+    
+    def handle_noargs(self, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError('--scales must be a comma-separated list of '
+                'integers.')
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+        using = options['database']
+        connection = connections[using]
+        
+        results = []
+        for num_droplets in scales:
+            # each scale gets a fresh test database, never the real one
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0,
+                autoclobber=not options['interactive'])
+            original_settings = install_test_app()
+            try:
+                results.append(run_benchmark(num_droplets,
+                    repeat=options['repeat'],
+                    num_publications=options['publications'],
+                    views=options['views'], using=using))
+            finally:
+                uninstall_test_app(original_settings)
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        
+        output = simplejson.dumps({
+            'database': connection.settings_dict['ENGINE'].split('.')[-1],
+            'repeat': options['repeat'],
+            'scales': results,
+        }, indent=2)
+        if options['output']:
+            output_file = open(options['output'], 'w')
+            try:
+                output_file.write(output)
+            finally:
+                output_file.close()
+            return ''
+        return output
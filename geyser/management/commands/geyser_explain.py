@@ -0,0 +1,116 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from geyser.models import Droplet, CurrentDroplet
+from geyser.registry import get_registry
+
+
+def get_query_shapes():
+    """
+    Returns a list of `(name, queryset)` pairs for the canonical queries made
+    by `DropletManager` and the `Droplet` signal handlers. Unsaved instances
+    with a pk of 0 stand in for publishables and publications.
+    
+    """
+    
+    shapes = [('current droplets', Droplet.objects.get_list())]
+    for options in get_registry():
+        publishable = options.model(pk=0)
+        shapes.append(('by publishable model %s' % options.app_model,
+            Droplet.objects.get_list(publishable_models=options.model)))
+        shapes.append(('by publishable %s' % options.app_model,
+            Droplet.objects.get_list(publishable=publishable)))
+        shapes.append(('first droplet of %s' % options.app_model,
+            Droplet.objects.filter(publishable_type=options.content_type,
+                publishable_id=0).order_by('published')))
+        for (publication_str, Publication) in options.publish_to:
+            publication = Publication(pk=0)
+            shapes.append(('by publication %s' % publication_str,
+                Droplet.objects.get_list(publications=publication)))
+            shapes.append(('previous of %s on %s' % (options.app_model,
+                    publication_str),
+                Droplet.objects.get_list(publishable=publishable,
+                    publications=publication)))
+    return shapes
+
+
+def find_sequential_scans(plan, vendor, tables):
+    """
+    Returns the lines of an EXPLAIN plan which show a sequential scan over
+    any of the given tables.
+    
+    """
+    
+    scans = []
+    for row in plan:
+        line = ' '.join([unicode(column) for column in row])
+        for table in tables:
+            if vendor == 'postgresql':
+                if 'Seq Scan on %s' % table in line:
+                    scans.append(line)
+            elif vendor == 'sqlite':
+                words = line.split()
+                if ('SCAN' in words and table in words and
+                        'INDEX' not in words):
+                    scans.append(line)
+            elif vendor == 'mysql':
+                if table in row and 'ALL' in row:
+                    scans.append(line)
+    return scans
+
+
+def explain_query_shapes(using=DEFAULT_DB_ALIAS):
+    """
+    Runs EXPLAIN on each query shape, returning a list of
+    `(name, plan, sequential_scans)` tuples.
+    
+    """
+    
+    connection = connections[using]
+    engine = connection.settings_dict['ENGINE'].split('.')[-1]
+    if engine.startswith('postgresql'):
+        (vendor, explain) = ('postgresql', 'EXPLAIN')
+    elif engine == 'sqlite3':
+        (vendor, explain) = ('sqlite', 'EXPLAIN QUERY PLAN')
+    else:
+        (vendor, explain) = (engine, 'EXPLAIN')
+    tables = [Droplet._meta.db_table, CurrentDroplet._meta.db_table]
+    
+    results = []
+    cursor = connection.cursor()
+    for (name, queryset) in get_query_shapes():
+        (sql, params) = queryset.query.get_compiler(using).as_sql()
+        cursor.execute('%s %s' % (explain, sql), params)
+        plan = cursor.fetchall()
+        results.append((name, plan,
+            find_sequential_scans(plan, vendor, tables)))
+    return results
+
+
+class Command(NoArgsCommand):
+    help = ('Runs EXPLAIN on the canonical Droplet queries and warns about '
+        'sequential scans over the droplet tables.')
+    option_list = NoArgsCommand.option_list + (
+        make_option('--database', action='store', dest='database',
+            default=DEFAULT_DB_ALIAS, help='Nominates a database to check. '
+                'Defaults to the "default" database.'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        output = []
+        warnings = 0
+        results = explain_query_shapes(options['database'])
+        for (name, plan, scans) in results:
+            if scans:
+                warnings += 1
+                output.append('WARNING: sequential scan for %s:' % name)
+                output.extend(['    %s' % line for line in scans])
+            elif verbosity > 1:
+                output.append('OK: %s' % name)
+        if verbosity > 0:
+            output.append('%s query shapes checked, %s with sequential scans.'
+                % (len(results), warnings))
+        return '\n'.join(output)
@@ -0,0 +1,46 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from geyser.models import Droplet
+
+
+class Command(NoArgsCommand):
+    help = ('Finds droplets whose publishable or publication no longer '
+        'exists, and un-publishes or deletes them.')
+    option_list = NoArgsCommand.option_list + (
+        make_option('--unpublish', action='store_true', dest='unpublish',
+            default=False, help='Un-publishes the orphaned droplets, keeping '
+                'them for the record.'),
+        make_option('--delete', action='store_true', dest='delete',
+            default=False, help='Deletes the orphaned droplets.'),
+        make_option('--batch-size', action='store', dest='batch_size',
+            default=1000, type='int', help='The number of droplets to update '
+                'or delete per query. Defaults to 1000.'),
+    )
+    
+    def handle_noargs(self, **options):
+        if options['unpublish'] and options['delete']:
+            raise CommandError('--unpublish and --delete cannot be combined.')
+        verbosity = int(options.get('verbosity', 1))
+        if options['unpublish'] or options['delete']:
+            results = Droplet.objects.remove_orphans(options['delete'],
+                options['batch_size'])
+            action = options['delete'] and 'deleted' or 'un-published'
+        else:
+            # only report what would be done
+            results = [(field_name, content_type, orphans.count())
+                for (field_name, content_type, orphans)
+                in Droplet.objects.get_orphans()]
+            action = 'found'
+        if verbosity > 0:
+            for (field_name, content_type, count) in results:
+                if count:
+                    sys.stdout.write('%s droplets %s with missing %s %s.%s.\n'
+                        % (count, action, field_name, content_type.app_label,
+                            content_type.model))
+            sys.stdout.write('%s droplets %s in total.\n' %
+                (sum([count for (field_name, content_type, count) in results]),
+                    action))
+        return ''
@@ -0,0 +1,44 @@
+import sys
+from optparse import make_option
+from time import sleep
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from geyser.models import Droplet
+
+
+class Command(NoArgsCommand):
+    help = ('Promotes pending droplets whose publish date has arrived, when '
+        'the GEYSER_SCHEDULED_PUBLISHING or GEYSER_ARCHIVE_COUNTS setting is '
+        'True.')
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', dest='batch_size',
+            default=1000, type='int', help='The number of droplets to '
+                'promote per query. Defaults to 1000.'),
+        make_option('--interval', action='store', dest='interval',
+            default=None, type='int', help='Keep running, promoting due '
+                'droplets every this many seconds.'),
+        make_option('--init', action='store_true', dest='init',
+            default=False, help='First mark droplets with a future publish '
+                'date as pending, which is needed once after enabling the '
+                'setting on a database which already has droplets.'),
+    )
+    
+    def handle_noargs(self, **options):
+        if not Droplet.objects.is_pending_kept():
+            raise CommandError('Neither GEYSER_SCHEDULED_PUBLISHING nor '
+                'GEYSER_ARCHIVE_COUNTS is enabled.')
+        verbosity = int(options.get('verbosity', 1))
+        interval = options['interval']
+        if options.get('init'):
+            count = Droplet.objects.mark_pending(options['batch_size'])
+            if verbosity > 0:
+                sys.stdout.write('%s droplets marked pending.\n' % count)
+        while True:
+            count = Droplet.objects.promote_due(options['batch_size'])
+            if verbosity > 0 and (count or interval is None):
+                sys.stdout.write('%s droplets promoted.\n' % count)
+                sys.stdout.flush()
+            if interval is None:
+                return ''
+            sleep(interval)
@@ -1,12 +1,180 @@
-from datetime import datetime
+from datetime import datetime, date, timedelta
 
-from django.db.models import Manager, Q, get_model
+from django.db import connections, router, transaction, IntegrityError
+from django.db.models import Manager, Q, F, Max, Sum, AutoField
+from django.db.models.query import QuerySet
 from django.conf import settings
-from django.core.exceptions import FieldError, ImproperlyConfigured
+from django.core.exceptions import FieldError, ImproperlyConfigured, \
+    ValidationError
+from django.utils.datastructures import SortedDict
 from django.contrib.contenttypes.models import ContentType
 
-from rubberstamp.models import AppPermission, AssignedPermission
+from geyser.feeds import get_feed_snapshots
 from geyser.query import GenericQuerySet
+from geyser.registry import get_registry
+from geyser.routing import writes, get_pinned_db
+from geyser.signals import droplets_promoted
+from geyser.snapshot import get_user, get_permission_targets
+
+
+def bulk_insert(objs, using):
+    """
+    Inserts unsaved model instances (all of the same model) with multi-row
+    INSERT statements. No signals are sent and primary keys are not set on
+    the instances.
+    
+    """
+    
+    if not objs:
+        return
+    connection = connections[using]
+    opts = objs[0]._meta
+    fields = [f for f in opts.local_fields if not isinstance(f, AutoField)]
+    qn = connection.ops.quote_name
+    row_sql = '(%s)' % ', '.join(['%s'] * len(fields))
+    batch_size = max(1, 900 // len(fields))
+    # stay below the limit on query parameters in some backends
+    
+    cursor = connection.cursor()
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        params = []
+        for obj in batch:
+            for field in fields:
+                params.append(field.get_db_prep_save(
+                    field.pre_save(obj, True), connection=connection))
+        cursor.execute('INSERT INTO %s (%s) VALUES %s' % (
+            qn(opts.db_table),
+            ', '.join([qn(f.column) for f in fields]),
+            ', '.join([row_sql] * len(batch))
+        ), params)
+    transaction.commit_unless_managed(using=using)
+
+
+# the most values compared in each unique_for_date query, to stay below
+# SQLite's limit of 999 parameters
+UNIQUE_CHECK_PARAMS = 900
+
+
+def published_range(year, month=None, day=None):
+    """
+    Returns the half-open `(start, end)` range of datetimes covering a year,
+    or a month of a year, or a day of a month. Raises `ValueError` for
+    invalid dates.
+    
+    """
+    
+    year = int(year)
+    if not month:
+        return (datetime(year, 1, 1), datetime(year + 1, 1, 1))
+    month = int(month)
+    if day:
+        start = datetime(year, month, int(day))
+        return (start, start + timedelta(days=1))
+    if month == 12:
+        return (datetime(year, 12, 1), datetime(year + 1, 1, 1))
+    return (datetime(year, month, 1), datetime(year, month + 1, 1))
+
+
+class AllowedPublications(object):
+    """
+    The publications to which an object may be published, kept as keys by
+    content type so that they need not be loaded.
+    
+    Supports membership tests (`publication in allowed`) with publication
+    instances or `(content_type_id, pk)` pairs. Iterating loads the allowed
+    publications, one query per publication type.
+    
+    """
+    
+    def __init__(self, allowed_to):
+        self.allowed_to = allowed_to
+        self._ids_by_type_id = dict((publication_type.id, publications)
+            for (publication_type, publications) in allowed_to.items())
+    
+    def _key(self, publication):
+        if isinstance(publication, tuple):
+            return publication
+        publication_type = ContentType.objects.get_for_model(publication)
+        return (publication_type.id, publication.pk)
+    
+    def __contains__(self, publication):
+        (type_id, pk) = self._key(publication)
+        if type_id not in self._ids_by_type_id:
+            return False
+        ids = self._ids_by_type_id[type_id]
+        return ids is None or pk in ids
+    
+    def __iter__(self):
+        for (publication_type, publication) in self.pairs():
+            yield publication
+    
+    def pairs(self):
+        """Yields `(content_type, publication)` pairs, loading them by type."""
+        for publication_type in self.allowed_to:
+            for publication in self.queryset(publication_type):
+                yield (publication_type, publication)
+    
+    def queryset(self, publication_type):
+        """
+        Returns the allowed publications of one content type. Publications
+        allowed individually are returned as a list, since they are already
+        loaded.
+        
+        """
+        
+        publications = self.allowed_to.get(publication_type, {})
+        if publications is None:
+            return publication_type.model_class().objects.all()
+        return publications.values()
+    
+    def load(self, keys):
+        """
+        Returns the allowed publications among the given `(content_type_id,
+        pk)` pairs, with one query per publication type which is allowed
+        entirely. Pairs which are not allowed are ignored.
+        
+        """
+        
+        ids_by_type_id = {}
+        for key in keys:
+            if key in self:
+                ids_by_type_id.setdefault(key[0], set()).add(key[1])
+        loaded = []
+        for (publication_type, publications) in self.allowed_to.items():
+            ids = ids_by_type_id.get(publication_type.id)
+            if not ids:
+                continue
+            if publications is None:
+                Model = publication_type.model_class()
+                loaded.extend(Model.objects.in_bulk(list(ids)).values())
+            else:
+                loaded.extend(publications[pk] for pk in ids)
+        return loaded
+    
+    def filter(self, publications):
+        """Returns a list of the given publications which are allowed."""
+        if not hasattr(publications, '__iter__'):
+            publications = [publications]
+        return [p for p in publications if p in self]
+    
+    def as_q(self, prefix='publication'):
+        """
+        Returns a `Q` object matching `Droplet`s (or other models with
+        `<prefix>_type` and `<prefix>_id` fields) to allowed publications.
+        
+        """
+        
+        q = Q(pk__isnull=True)
+        for (publication_type, publications) in self.allowed_to.items():
+            type_q = Q(**{'%s_type' % prefix: publication_type})
+            if publications is not None:
+                if not publications:
+                    continue
+                type_q = type_q & Q(**{
+                    '%s_id__in' % prefix: publications.keys()})
+            q = q | type_q
+        return q
 
 
 class DropletManager(Manager):
@@ -17,9 +185,25 @@ class DropletManager(Manager):
     """
     
     def get_query_set(self):
-        """Returns a `GenericQuerySet` with related fields pre-selected."""
-        return GenericQuerySet(self.model, using=self.db) \
-            .select_related('first').select_related_generic()
+        """
+        Returns a `GenericQuerySet` with related fields pre-selected. Unless a
+        database was chosen for the manager, reads go to the one chosen by
+        the routers, or to the one for writing while reads are pinned (see
+        `geyser.routing`).
+        
+        """
+        
+        return self.lean().select_related('first').select_related_generic()
+    
+    def lean(self):
+        """
+        Returns a `GenericQuerySet` without related fields pre-selected, for
+        queries which only count, update or read columns of droplets.
+        
+        """
+        
+        using = self._db or get_pinned_db(self.model)
+        return GenericQuerySet(self.model, using=using)
     
     def get_list(self, **kwargs):
         """
@@ -44,6 +228,15 @@ class DropletManager(Manager):
           `Droplet`s that have been unpublished. Default is `False`.
         * `include_future`: Boolean, whether to include `Droplet`s with a
           publish date in the future. Default is `False`.
+        * `lean`: Boolean, whether to start from `lean()` rather than a
+          queryset with related fields pre-selected. Default is `False`.
+        
+        If the `GEYSER_CURRENT_INDEX` setting is `True`, lookups by
+        `publications` of current droplets use the `CurrentDroplet` index.
+        
+        If the `GEYSER_SCHEDULED_PUBLISHING` setting is `True`, future
+        droplets are excluded by their `is_pending` flag rather than by
+        comparing `published` to the current time.
         
         """
         
@@ -58,6 +251,11 @@ class DropletManager(Manager):
         day = kwargs.get('day')
         include_unpublished = kwargs.get('include_unpublished', False)
         include_future = kwargs.get('include_future', False)
+        lean = kwargs.get('lean', False)
+        
+        from geyser.models import CurrentDroplet
+        scheduling = self.is_scheduling_enabled()
+        pending_kept = self.is_pending_kept()
         
         if publishable:
             queries.append(Q(publishable_id=publishable.id))
@@ -66,12 +264,7 @@ class DropletManager(Manager):
         
         if publishable_filters and publishable_models is None:
             # if publishable filters is given, we must populate the model list
-            publishable_models = []
-            for publishable_app_model in settings.GEYSER_PUBLISHABLES:
-                (app_name, model_name) = publishable_app_model.split('.')
-                publishable_type = ContentType.objects.get(
-                    app_label=app_name, model=model_name)
-                publishable_models.append(publishable_type.model_class())
+            publishable_models = [options.model for options in get_registry()]
         
         if publishable_models is not None:
             if not hasattr(publishable_models, '__iter__'):
@@ -107,21 +300,223 @@ class DropletManager(Manager):
                     publication_id__in=publications_by_type[publication_type]
                 )
                 # add an OR for each type, similar to the publishable query
-            queries.append(publication_q)
+            if not include_unpublished and \
+                    CurrentDroplet.objects.is_enabled() and \
+                    not (include_future and pending_kept):
+                # answer from the compact index of current droplets instead,
+                # which leaves out droplets flagged as pending
+                current = CurrentDroplet.objects.filter(publication_q)
+                if not include_future and not scheduling:
+                    current = current.filter(published__lte=datetime.now())
+                current_q = Q(pk__in=current.values('droplet'))
+                if not include_future and pending_kept and not scheduling:
+                    # without scheduling, pending droplets are listed once
+                    # their date arrives even if they are not promoted yet
+                    current_q = current_q | \
+                        (publication_q & Q(is_pending=True))
+                queries.append(current_q)
+            else:
+                queries.append(publication_q)
         
         if year:
-            queries.append(Q(published__year=year))
-        if month:
-            queries.append(Q(published__month=month))
-        if day:
-            queries.append(Q(published__day=day))
+            # a range on published can use its index, unlike __year etc.
+            try:
+                (start, end) = published_range(year, month, month and day)
+            except ValueError:
+                queries.append(Q(pk__isnull=True))
+            else:
+                queries.append(Q(published__gte=start, published__lt=end))
+                if day and not month:
+                    queries.append(Q(published__day=day))
+        else:
+            if month:
+                queries.append(Q(published__month=month))
+            if day:
+                queries.append(Q(published__day=day))
         if not include_unpublished:
             filters['is_current'] = True
         if not include_future:
-            filters['published__lte'] = datetime.now()
+            if scheduling:
+                filters['is_pending'] = False
+            else:
+                filters['published__lte'] = datetime.now()
         
+        if lean:
+            return self.lean().filter(*queries, **filters)
         return self.filter(*queries, **filters)
     
+    def is_scheduling_enabled(self):
+        return getattr(settings, 'GEYSER_SCHEDULED_PUBLISHING', False)
+    
+    def is_pending_kept(self):
+        """
+        Returns whether droplets are flagged as pending until their publish
+        date, which is needed for scheduled publishing and archive counts.
+        
+        """
+        
+        from geyser.models import ArchiveCount
+        return self.is_scheduling_enabled() or \
+            ArchiveCount.objects.is_enabled()
+    
+    @writes
+    def promote_due(self, batch_size=1000):
+        """
+        Clears the `is_pending` flag of droplets whose publish date has
+        arrived, updating at most `batch_size` droplets per query, and sends
+        the `droplets_promoted` signal for each batch. Returns the number of
+        droplets promoted.
+        
+        This only needs to be run when the `GEYSER_SCHEDULED_PUBLISHING` or
+        `GEYSER_ARCHIVE_COUNTS` setting is `True`, usually by the
+        ``geyser_promote`` command.
+        
+        """
+        
+        from geyser.models import CurrentDroplet, ArchiveCount
+        index = CurrentDroplet.objects.is_enabled()
+        archive = ArchiveCount.objects.is_enabled()
+        now = datetime.now()
+        count = 0
+        while True:
+            pks = list(self.lean().filter(is_pending=True, published__lte=now)
+                .order_by('published').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            count += self.lean().filter(pk__in=pks).update(is_pending=False)
+            if index or archive:
+                promoted = list(self.lean().filter(pk__in=pks, is_current=True))
+                if index:
+                    CurrentDroplet.objects.add_many(promoted)
+                if archive:
+                    ArchiveCount.objects.add_many(promoted)
+            droplets_promoted.send(sender=self.model, pks=pks)
+        return count
+    
+    @writes
+    def mark_pending(self, batch_size=1000):
+        """
+        Sets the `is_pending` flag of droplets whose publish date has not yet
+        arrived, updating at most `batch_size` droplets per query. Returns
+        the number of droplets marked.
+        
+        Droplets only get the flag when saved with the
+        `GEYSER_SCHEDULED_PUBLISHING` or `GEYSER_ARCHIVE_COUNTS` setting
+        enabled, so this must be run once when enabling them on a database
+        which already has droplets, usually with ``geyser_promote --init``.
+        
+        """
+        
+        from geyser.models import CurrentDroplet
+        now = datetime.now()
+        count = 0
+        while True:
+            pks = list(self.lean().filter(is_pending=False, published__gt=now)
+                .values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            if CurrentDroplet.objects.is_enabled():
+                CurrentDroplet.objects.filter(droplet__in=pks).delete()
+            count += self.lean().filter(pk__in=pks).update(is_pending=True)
+        return count
+    
+    def get_page(self, cursor=None, per_page=20, **kwargs):
+        """
+        Returns a page of `get_list` results and the cursor for the next page,
+        as a `(list, cursor)` tuple. Accepts the same keyword arguments as
+        `get_list`. See `GenericQuerySet.keyset_page`.
+        
+        """
+        
+        return self.get_list(**kwargs).keyset_page(cursor, per_page)
+    
+    def get_feed(self, sources, per_source=20, **kwargs):
+        """
+        Returns a `Feed` merging the current droplets of several publications
+        (or querysets of droplets), newest first. Other keyword arguments are
+        passed to the `Feed`; see `geyser.feeds.Feed`.
+        
+        """
+        
+        from geyser.feeds import Feed
+        return Feed(sources, per_source, **kwargs)
+    
+    def get_archive(self, period='month', publications=None,
+            publishable_models=None, year=None, month=None):
+        """
+        Returns a list of `(date, count)` pairs, newest first, giving the
+        number of current droplets published in each year, month or day
+        (depending on `period`) in which any were published. `date` is the
+        first day of the period.
+        
+        `publications` and `publishable_models` restrict the counts as they
+        do for `get_list()`, and `year` and `month` restrict the periods, for
+        instance to count the days of a single month.
+        
+        The counts are read from the `ArchiveCount` table, which must be
+        enabled with the `GEYSER_ARCHIVE_COUNTS` setting. Raises `ValueError`
+        if `period` is not ``'year'``, ``'month'`` or ``'day'``.
+        
+        """
+        
+        from geyser.models import ArchiveCount
+        if not ArchiveCount.objects.is_enabled():
+            raise ImproperlyConfigured('get_archive requires the '
+                'GEYSER_ARCHIVE_COUNTS setting.')
+        periods = dict((name, key) for (key, name)
+            in ArchiveCount.PERIOD_CHOICES)
+        if period not in periods:
+            raise ValueError('Invalid period: %r' % (period,))
+        counts = ArchiveCount.objects.filter(period=periods[period])
+        if publications is not None:
+            if not hasattr(publications, '__iter__'):
+                publications = [publications]
+            publication_q = Q(pk__isnull=True)
+            for publication in publications:
+                publication_q = publication_q | Q(
+                    publication_type=ContentType.objects.get_for_model(publication),
+                    publication_id=publication.pk)
+            counts = counts.filter(publication_q)
+        if publishable_models is not None:
+            if not hasattr(publishable_models, '__iter__'):
+                publishable_models = [publishable_models]
+            counts = counts.filter(publishable_type__in=[
+                ContentType.objects.get_for_model(Model)
+                for Model in publishable_models])
+        if year:
+            (start, end) = published_range(year, month)
+            counts = counts.filter(start__gte=start.date(), start__lt=end.date())
+        totals = counts.values('start').annotate(total=Sum('count')) \
+            .order_by('-start')
+        return [(row['start'], row['total']) for row in totals if row['total']]
+    
+    def get_recent(self, publication):
+        """
+        Returns a list of the latest current droplets published to the given
+        publication, as `get_list(publications=publication)` would order
+        them.
+        
+        If the `GEYSER_FEED_SNAPSHOTS` setting is given, the ids are read from
+        the publication's feed snapshot and the droplets are fetched in bulk.
+        The snapshot is rebuilt if any of them are no longer current.
+        Otherwise the first 20 droplets from `get_list` are returned.
+        
+        """
+        
+        snapshots = get_feed_snapshots()
+        if snapshots is None:
+            return list(self.get_list(publications=publication)[:20])
+        ids = snapshots.get_ids(publication)
+        droplets = dict((droplet.pk, droplet)
+            for droplet in self.filter(pk__in=ids, is_current=True))
+        if len(droplets) < len(ids):
+            # the snapshot is stale, from a rebuild racing with an update or
+            # from droplets unpublished without the manager's methods
+            ids = snapshots.get_ids(publication, rebuild=True)
+            droplets = dict((droplet.pk, droplet)
+                for droplet in self.filter(pk__in=ids, is_current=True))
+        return [droplets[pk] for pk in ids if pk in droplets]
+    
     def get_allowed_publications(self, publishable, as_user=None, filter_from=None):
         """
         Returns a list of publications to which the given publishable object
@@ -130,44 +525,74 @@ class DropletManager(Manager):
         `as_user`, if given, specifies a user whose permissions should be
         considered when determining where the object can be published. If not
         given, the object will be considered allowed to publish to any related
-        publications from the `GEYSER_PUBLISHABLES` setting.
+        publications from the `GEYSER_PUBLISHABLES` setting. A
+        `PermissionSnapshot` of the user can be given instead, here and in the
+        other methods which take `as_user`, to avoid repeated permission
+        queries.
         
         `filter_from`, if given, specifies the "starting list" of publications
         which will be filtered by settings and user permissions.
         
+        This loads every allowed publication if `filter_from` is not given;
+        `get_allowed_publication_keys` avoids loading them at all.
+        
         """
         
-        publishable_str = '%s.%s' % (
-            publishable._meta.app_label, publishable._meta.module_name)
-        if publishable_str not in settings.GEYSER_PUBLISHABLES:
+        allowed = self.get_allowed_publication_keys(publishable, as_user)
+        if allowed is None:
+            return None
+        if filter_from is None:
+            return list(allowed)
+        else:
+            return allowed.filter(filter_from)
+    
+    def get_allowed_publication_keys(self, publishable, as_user=None):
+        """
+        Returns an `AllowedPublications` instance for the publications to
+        which the given publishable object can be published, or `None` if it
+        cannot be published at all. `as_user` works as it does for
+        `get_allowed_publications`.
+        
+        No publications are loaded, except for those to which the user has
+        permission to publish individually.
+        
+        """
+        
+        options = get_registry().get(publishable)
+        if options is None:
             raise ImproperlyConfigured('Publishable type must be in GEYSER_PUBLISHABLES.')
-        if as_user and not as_user.is_superuser and \
-                not as_user.has_perm('geyser.publish.%s' % publishable_str) and \
-                not as_user.has_perm('geyser.publish', obj=publishable):
+        if not self._may_publish(publishable, options, as_user):
             return None
+        return AllowedPublications(self._get_allowed_to(options, as_user))
+    
+    def _may_publish(self, publishable, options, as_user=None):
+        """Returns whether the user may publish the object at all."""
+        return not as_user or as_user.is_superuser or \
+            as_user.has_perm('geyser.publish.%s' % options.app_model) or \
+            as_user.has_perm('geyser.publish', obj=publishable)
+    
+    def _get_allowed_to(self, options, as_user=None):
+        """
+        Returns a sorted dictionary mapping each publication content type for
+        a publishable type (in settings order) to `None` if the user may
+        publish to all of them, or else to a dictionary of the allowed
+        publications by pk.
+        
+        """
         
-        allowed_publications = []
-        to_types = settings.GEYSER_PUBLISHABLES[publishable_str]['publish_to']
-        for publication_str in to_types:
-            (publication_app, publication_model) = publication_str.split('.')
-            Publication = get_model(publication_app, publication_model)
-            
+        allowed_to = SortedDict()
+        for (publication_str, Publication, publication_type) in \
+                options.publish_to_types:
             to_perm = 'geyser.publish_to.%s' % publication_str
             if as_user and not as_user.is_superuser and \
-                    not as_user.has_perm(to_perm):                
-                allowed = AppPermission.objects.get_permission_targets(
-                    'geyser.publish_to.%s' % publication_str, as_user)
-                allowed_publications.extend(allowed)
+                    not as_user.has_perm(to_perm):
+                allowed_to[publication_type] = dict((p.pk, p) for p in
+                    get_permission_targets(to_perm, as_user))
             else:
-                allowed_publications.extend(Publication.objects.all())
-        
-        if filter_from is None:
-            return allowed_publications
-        else:
-            if not hasattr(filter_from, '__iter__'):
-                filter_from = [filter_from]
-            return filter(lambda p: p in allowed_publications, filter_from)
+                allowed_to[publication_type] = None
+        return allowed_to
     
+    @writes
     def publish(self, publishable, publications=None, as_user=None,
             **droplet_dict):
         """
@@ -197,7 +622,7 @@ class DropletManager(Manager):
             publishable, as_user, publications)
         droplet_dict['publishable'] = publishable
         if as_user and 'published_by' not in droplet_dict:
-            droplet_dict['published_by'] = as_user
+            droplet_dict['published_by'] = get_user(as_user)
         
         droplets = []
         if publications:
@@ -207,6 +632,296 @@ class DropletManager(Manager):
         
         return droplets
     
+    @writes
+    def publish_many(self, publishables, publications=None, as_user=None,
+            **droplet_dict):
+        """
+        Publishes many publishable objects at once, with a fixed number of
+        queries per publishable and publication type, besides checking
+        whether `as_user` may publish each object (which is answered without
+        queries by a `PermissionSnapshot`).
+        
+        The arguments work as they do for `publish()`, and the results are
+        the same as publishing each object in turn: previous current droplets
+        are unpublished, each new droplet's `first` is set, and
+        `unique_for_date` fields are validated for first publishings. The
+        `Droplet` save signals are not sent, since the rows are inserted with
+        multi-row INSERT statements.
+        
+        Returns a list of the new `Droplet`s.
+        
+        """
+        
+        from geyser.models import CurrentDroplet, ArchiveCount
+        
+        now = datetime.now()
+        pending_kept = self.is_pending_kept()
+        droplet_dict.setdefault('published', now)
+        if as_user and 'published_by' not in droplet_dict:
+            droplet_dict['published_by'] = get_user(as_user)
+        
+        # which publications a user may publish to doesn't depend on the
+        # object, so they are found once per publishable type
+        groups = SortedDict()
+        for publishable in publishables:
+            publishable_type = ContentType.objects.get_for_model(publishable)
+            if publishable_type not in groups:
+                options = get_registry().get(publishable)
+                if options is None:
+                    raise ImproperlyConfigured(
+                        'Publishable type must be in GEYSER_PUBLISHABLES.')
+                allowed = AllowedPublications(
+                    self._get_allowed_to(options, as_user))
+                if publications is None:
+                    allowed = list(allowed)
+                else:
+                    allowed = allowed.filter(publications)
+                allowed = dict(
+                    ((ContentType.objects.get_for_model(p), p.pk), p)
+                    for p in allowed)
+                groups[publishable_type] = (options, SortedDict(), allowed)
+            (options, by_pk, allowed) = groups[publishable_type]
+            if allowed and publishable.pk not in by_pk and \
+                    self._may_publish(publishable, options, as_user):
+                by_pk[publishable.pk] = publishable
+        groups = SortedDict((publishable_type, (by_pk, allowed))
+            for (publishable_type, (options, by_pk, allowed)) in groups.items()
+            if by_pk)
+        if not groups:
+            return []
+        
+        # find the existing first droplet for each publishable
+        firsts = {}
+        for (publishable_type, (by_pk, allowed)) in groups.items():
+            earliest = self.lean().filter(
+                Q(first=F('pk')) | Q(first__isnull=True),
+                publishable_type=publishable_type,
+                publishable_id__in=by_pk.keys()
+            ).order_by('published').values_list('publishable_id', 'pk')
+            for (publishable_id, pk) in earliest:
+                firsts.setdefault((publishable_type.id, publishable_id), pk)
+        
+        first_droplets = []
+        droplets = []
+        for (publishable_type, (by_pk, allowed)) in groups.items():
+            for publishable in by_pk.values():
+                key = (publishable_type.id, publishable.pk)
+                for publication in allowed.values():
+                    droplet = self.model(publishable=publishable,
+                        publication=publication, **droplet_dict)
+                    if pending_kept:
+                        droplet.is_pending = droplet.published > now
+                    if key in firsts:
+                        droplet.first_id = firsts[key]
+                        droplets.append(droplet)
+                    else:
+                        first_droplets.append(droplet)
+                        firsts[key] = None
+                        # the rest are pointed to this one once it is saved
+        self.validate_unique_for_date(first_droplets)
+        
+        max_pk = self.lean().aggregate(max_pk=Max('pk'))['max_pk'] or 0
+        
+        # unpublish previous droplets, once per publishable and publication
+        # type; the new droplets are then told apart from those inserted by
+        # concurrent publishings by their keys and publish date
+        new_queries = SortedDict()
+        for (publishable_type, (by_pk, allowed)) in groups.items():
+            publication_ids = SortedDict()
+            for (publication_type, publication_id) in allowed:
+                publication_ids.setdefault(publication_type, []).append(
+                    publication_id)
+            publications_q = Q(pk__isnull=True)
+            for (publication_type, ids) in publication_ids.items():
+                previous = self.lean().filter(
+                    publishable_type=publishable_type,
+                    publishable_id__in=by_pk.keys(),
+                    publication_type=publication_type,
+                    publication_id__in=ids,
+                    is_current=True,
+                    published__lte=now
+                )
+                self._set_not_current(previous,
+                    {'is_current': False, 'updated': now})
+                publications_q = publications_q | Q(
+                    publication_type=publication_type, publication_id__in=ids)
+            new_queries[publishable_type] = publications_q & Q(
+                pk__gt=max_pk,
+                publishable_type=publishable_type,
+                publishable_id__in=by_pk.keys(),
+                published=droplet_dict['published'])
+        
+        # insert the first publishings, point them to themselves, and then
+        # insert the rest pointing to them
+        bulk_insert(first_droplets, router.db_for_write(self.model))
+        for (publishable_type, new_q) in new_queries.items():
+            self.lean().filter(new_q, first__isnull=True).update(first=F('pk'))
+            for (publishable_id, pk) in self.lean().filter(new_q,
+                    first=F('pk')).values_list('publishable_id', 'pk'):
+                firsts[(publishable_type.id, publishable_id)] = pk
+        for droplet in droplets:
+            if droplet.first_id is None:
+                droplet.first_id = firsts[
+                    (droplet.publishable_type_id, droplet.publishable_id)]
+        bulk_insert(droplets, router.db_for_write(self.model))
+        
+        new_droplets = list(self.filter(
+            reduce(lambda a, b: a | b, new_queries.values())))
+        if CurrentDroplet.objects.is_enabled():
+            CurrentDroplet.objects.add_many(new_droplets)
+        snapshots = get_feed_snapshots()
+        if snapshots is not None:
+            snapshots.discard([(droplet.publication_type_id,
+                droplet.publication_id) for droplet in new_droplets])
+        if ArchiveCount.objects.is_enabled():
+            ArchiveCount.objects.add_many(new_droplets)
+        return new_droplets
+    
+    def get_unique_conflicts(self, droplets):
+        """
+        Returns a list of `(droplet, field_name)` pairs for the given unsaved
+        first publishings whose publishables would share the value of a
+        `unique_for_date` field with another first publishing on the same
+        date, either in the database or earlier in the list.
+        
+        For each publishable type, the field values are loaded with one
+        query, and the database is checked with one more (per chunk of
+        droplets) which joins first publishings within the half-open range of
+        datetimes spanning the droplets' dates to the publishable table,
+        filtered by the droplets' field values.
+        
+        """
+        
+        by_type = SortedDict()
+        for droplet in droplets:
+            by_type.setdefault(droplet.publishable_type_id, []).append(droplet)
+        
+        conflicts = []
+        seen = set()
+        for (publishable_type_id, type_droplets) in by_type.items():
+            options = get_registry().get_for_content_type(publishable_type_id)
+            if options is None or not options.unique_for_date:
+                continue
+            fields = options.unique_for_date
+            values_by_id = self._get_unique_values(publishable_type_id,
+                fields, type_droplets)
+            chunk_size = max(1, UNIQUE_CHECK_PARAMS // len(fields))
+            for start in range(0, len(type_droplets), chunk_size):
+                chunk = type_droplets[start:start + chunk_size]
+                existing = self._get_unique_keys(publishable_type_id, fields,
+                    chunk, values_by_id)
+                for droplet in chunk:
+                    values = values_by_id[droplet.publishable_id]
+                    for (field_name, value) in zip(fields, values):
+                        if value is None:
+                            continue
+                        key = (publishable_type_id, field_name, value,
+                            droplet.published.date())
+                        if key in seen or key in existing:
+                            conflicts.append((droplet, field_name))
+                        seen.add(key)
+        return conflicts
+    
+    def validate_unique_for_date(self, droplets):
+        """
+        Raises a `ValidationError` if any of the given unsaved first
+        publishings conflict (see `get_unique_conflicts`).
+        
+        """
+        
+        conflicts = self.get_unique_conflicts(droplets)
+        if conflicts:
+            (droplet, field_name) = conflicts[0]
+            raise ValidationError('%s.%s must be unique for date' %
+                (droplet.publishable_type.model, field_name))
+    
+    def _get_unique_values(self, publishable_type_id, fields, droplets):
+        """
+        Returns a dictionary of tuples of the given fields' values by the id
+        of each droplet's publishable, loading those not already cached on
+        the droplets with one query.
+        
+        """
+        
+        Model = ContentType.objects.get_for_id(
+            publishable_type_id).model_class()
+        # the ids rather than the objects of foreign keys, as in the database
+        attnames = [Model._meta.get_field(field_name).attname
+            for field_name in fields]
+        values_by_id = {}
+        missing = set()
+        for droplet in droplets:
+            publishable = getattr(droplet, '_publishable_cache', None)
+            if publishable is None:
+                missing.add(droplet.publishable_id)
+            else:
+                values_by_id[droplet.publishable_id] = tuple([
+                    getattr(publishable, attname) for attname in attnames])
+        if missing:
+            for row in Model._default_manager.filter(pk__in=missing) \
+                    .values_list('pk', *fields):
+                values_by_id[row[0]] = row[1:]
+        return values_by_id
+    
+    def _get_unique_keys(self, publishable_type_id, fields, droplets,
+            values_by_id):
+        """
+        Returns the set of `(publishable_type_id, field_name, value, date)`
+        keys of existing first publishings which may conflict with the given
+        droplets, all of one publishable type.
+        
+        """
+        
+        values = SortedDict([(field_name, set()) for field_name in fields])
+        for droplet in droplets:
+            for (field_name, value) in zip(fields,
+                    values_by_id[droplet.publishable_id]):
+                if value is not None:
+                    values[field_name].add(value)
+        for field_name in fields:
+            if not values[field_name]:
+                del values[field_name]
+        if not values:
+            return set()
+        
+        dates = [droplet.published.date() for droplet in droplets]
+        start = published_range(*min(dates).timetuple()[:3])[0]
+        end = published_range(*max(dates).timetuple()[:3])[1]
+        queryset = self.lean().filter(publishable_type=publishable_type_id,
+            first=F('pk'), published__gte=start, published__lt=end)
+        excluded = [droplet.pk for droplet in droplets if droplet.pk]
+        if excluded:
+            queryset = queryset.exclude(pk__in=excluded)
+        
+        Model = ContentType.objects.get_for_id(publishable_type_id).model_class()
+        qn = connections[queryset.db].ops.quote_name
+        table = qn(Model._meta.db_table)
+        columns = dict([(field_name, '%s.%s' % (table,
+                qn(Model._meta.get_field(field_name).column)))
+            for field_name in values])
+        conditions = []
+        params = []
+        for (field_name, field_values) in values.items():
+            conditions.append('%s IN (%s)' % (columns[field_name],
+                ', '.join(['%s'] * len(field_values))))
+            params.extend(field_values)
+        select = SortedDict([('unique_%s' % field_name, columns[field_name])
+            for field_name in values])
+        rows = queryset.extra(select=select, tables=[Model._meta.db_table],
+            where=[
+                '%s.%s = %s.%s' % (table, qn(Model._meta.pk.column),
+                    qn(self.model._meta.db_table), qn('publishable_id')),
+                '(%s)' % ' OR '.join(conditions),
+            ], params=params).values_list('published', *select.keys())
+        
+        keys = set()
+        for row in rows:
+            for (field_name, value) in zip(values.keys(), row[1:]):
+                keys.add((publishable_type_id, field_name, value,
+                    row[0].date()))
+        return keys
+    
+    @writes
     def unpublish(self, publishable, publications=None, as_user=None):
         """
         Un-publishes the given publishable.
@@ -219,15 +934,368 @@ class DropletManager(Manager):
         
         """
         
-        publications = self.get_allowed_publications(
-            publishable, as_user, publications)
-        droplets = self.get_list(publishable=publishable,
-            publications=publications)
+        allowed = self.get_allowed_publication_keys(publishable, as_user)
+        if allowed is None:
+            return self.none()
+        if publications is None:
+            droplets = self.get_list(publishable=publishable,
+                queries=[allowed.as_q()], lean=True)
+        else:
+            droplets = self.get_list(publishable=publishable,
+                publications=allowed.filter(publications), lean=True)
         
         update_dict = {'is_current': False, 'updated': datetime.now()}
         if as_user:
-            update_dict['updated_by'] = as_user
+            update_dict['updated_by'] = get_user(as_user)
         
-        droplets.update(**update_dict)
+        self._set_not_current(droplets, update_dict)
         
         return droplets
+    
+    @writes
+    def unpublish_many(self, publishables, publications=None, as_user=None):
+        """
+        Un-publishes many publishables at once.
+        
+        `publishables` can be a list of publishable objects (of any types) or
+        a queryset of one publishable model. Permissions are checked once per
+        publishable type, and the droplets are updated with one UPDATE per
+        publishable and publication type. `publications` and `as_user` work
+        as they do for `unpublish()`.
+        
+        Returns the number of droplets which were un-published.
+        
+        """
+        
+        if isinstance(publishables, QuerySet):
+            publishable_ids = {
+                ContentType.objects.get_for_model(publishables.model):
+                    publishables.values_list('pk', flat=True)
+            }
+        else:
+            publishable_ids = {}
+            for publishable in publishables:
+                publishable_type = ContentType.objects.get_for_model(publishable)
+                publishable_ids.setdefault(publishable_type, set()).add(
+                    publishable.pk)
+        
+        publication_ids = None
+        if publications is not None:
+            if not hasattr(publications, '__iter__'):
+                publications = [publications]
+            publication_ids = {}
+            for publication in publications:
+                publication_type = ContentType.objects.get_for_model(publication)
+                publication_ids.setdefault(publication_type, set()).add(
+                    publication.pk)
+        
+        update_dict = {'is_current': False, 'updated': datetime.now()}
+        if as_user:
+            update_dict['updated_by'] = get_user(as_user)
+        
+        count = 0
+        for (publishable_type, ids) in publishable_ids.items():
+            permitted = self._get_permitted_ids(publishable_type, as_user)
+            if permitted is None:
+                continue
+            (allowed_ids, allowed_to) = permitted
+            droplets = self.lean().filter(publishable_type=publishable_type,
+                publishable_id__in=ids, is_current=True,
+                published__lte=update_dict['updated'])
+            if allowed_ids is not None:
+                droplets = droplets.filter(publishable_id__in=allowed_ids)
+            for (publication_type, to_ids) in allowed_to.items():
+                if publication_ids is not None:
+                    if publication_type not in publication_ids:
+                        continue
+                    if to_ids is None:
+                        to_ids = publication_ids[publication_type]
+                    else:
+                        to_ids = set(to_ids) & publication_ids[publication_type]
+                to_droplets = droplets.filter(publication_type=publication_type)
+                if to_ids is not None:
+                    if not to_ids:
+                        continue
+                    to_droplets = to_droplets.filter(publication_id__in=to_ids)
+                count += self._set_not_current(to_droplets, update_dict)
+        
+        return count
+    
+    def _set_not_current(self, droplets, update_dict):
+        """
+        Updates a queryset of current droplets with `update_dict` (which
+        should set `is_current` to `False`), keeping the current droplet
+        index, feed snapshots and archive counts up to date. Returns the
+        number of droplets updated.
+        
+        """
+        
+        from geyser.models import CurrentDroplet, ArchiveCount
+        snapshots = get_feed_snapshots()
+        archive = ArchiveCount.objects.is_enabled()
+        if snapshots is not None or archive:
+            rows = list(droplets.values_list('pk', 'publication_type',
+                'publication_id', 'publishable_type', 'published',
+                'is_pending'))
+            pks = [row[0] for row in rows]
+            if CurrentDroplet.objects.is_enabled():
+                CurrentDroplet.objects.filter(droplet__in=pks).delete()
+            count = self.lean().filter(pk__in=pks).update(**update_dict)
+            if snapshots is not None:
+                snapshots.discard([row[1:3] for row in rows])
+            if archive:
+                # pending droplets are not counted until they are promoted
+                ArchiveCount.objects.record(
+                    [row[1:5] for row in rows if not row[5]], -1)
+            return count
+        if CurrentDroplet.objects.is_enabled():
+            droplets = self.lean().filter(
+                pk__in=CurrentDroplet.objects.remove(droplets))
+        return droplets.update(**update_dict)
+    
+    def get_orphans(self):
+        """
+        Returns a list of `(field_name, content_type, queryset)` tuples, one
+        for each content type of publishable and publication, where the
+        queryset selects the droplets whose publishable or publication (by
+        `field_name`) no longer exists. Each queryset excludes the ids in the
+        related table with a subquery, rather than checking each droplet.
+        
+        """
+        
+        orphans = []
+        for field_name in ('publishable', 'publication'):
+            type_field = '%s_type' % field_name
+            type_ids = self.lean().order_by().values_list(
+                type_field, flat=True).distinct()
+            for type_id in type_ids:
+                content_type = ContentType.objects.get_for_id(type_id)
+                droplets = self.lean().filter(**{type_field: type_id})
+                Model = content_type.model_class()
+                if Model is not None:
+                    droplets = droplets.exclude(**{
+                        '%s_id__in' % field_name:
+                            Model._default_manager.values_list('pk', flat=True)
+                    })
+                orphans.append((field_name, content_type, droplets))
+        return orphans
+    
+    @writes
+    def remove_orphans(self, delete=False, batch_size=1000):
+        """
+        Un-publishes the droplets found by `get_orphans`, or deletes them if
+        `delete` is `True`, at most `batch_size` at a time. Returns a list of
+        `(field_name, content_type, count)` tuples, counting the droplets
+        which were un-published (those which were current) or deleted.
+        
+        Before orphans are deleted, any other droplets whose `first` is one of
+        them are pointed to the earliest remaining droplet of the publishable.
+        
+        """
+        
+        results = []
+        for (field_name, content_type, orphans) in self.get_orphans():
+            pks = list(orphans.values_list('pk', flat=True))
+            now = datetime.now()
+            count = 0
+            for start in range(0, len(pks), batch_size):
+                batch = pks[start:start + batch_size]
+                count += self._set_not_current(self.lean().filter(
+                    pk__in=batch, is_current=True),
+                    {'is_current': False, 'updated': now})
+            if delete:
+                for start in range(0, len(pks), batch_size):
+                    batch = pks[start:start + batch_size]
+                    self._repoint_firsts(batch, orphans)
+                    self.lean().filter(pk__in=batch).delete()
+                count = len(pks)
+            results.append((field_name, content_type, count))
+        return results
+    
+    def _repoint_firsts(self, pks, orphans):
+        """
+        Points droplets whose `first` is one of the given droplets to the
+        earliest droplet of the same publishable which is not in the
+        `orphans` queryset.
+        
+        """
+        
+        stranded = self.lean().filter(first__in=pks) \
+            .exclude(pk__in=orphans.values('pk')).order_by('published', 'pk') \
+            .values_list('publishable_type', 'publishable_id', 'pk')
+        firsts = {}
+        for (publishable_type, publishable_id, pk) in stranded:
+            firsts.setdefault((publishable_type, publishable_id), pk)
+        for ((publishable_type, publishable_id), first) in firsts.items():
+            self.lean().filter(publishable_type=publishable_type,
+                publishable_id=publishable_id, first__in=pks).update(first=first)
+    
+    def _get_permitted_ids(self, publishable_type, as_user=None):
+        """
+        Returns the publishables of a type which the user may publish, and
+        where, without loading any publications.
+        
+        The result is `None` if the user may not publish objects of this type
+        at all, or a pair of a set of allowed publishable ids (`None` if all
+        are allowed) and the result of `_get_allowed_to`.
+        
+        """
+        
+        options = get_registry().get_for_content_type(publishable_type)
+        if options is None:
+            raise ImproperlyConfigured('Publishable type must be in GEYSER_PUBLISHABLES.')
+        publishable_str = options.app_model
+        restricted = as_user and not as_user.is_superuser
+        if restricted and not as_user.is_active:
+            return None
+        
+        allowed_ids = None
+        if restricted and \
+                not as_user.has_perm('geyser.publish.%s' % publishable_str):
+            allowed_ids = set([p.pk for p in get_permission_targets(
+                'geyser.publish.%s' % publishable_str, as_user)])
+            if not allowed_ids:
+                return None
+        
+        return (allowed_ids, self._get_allowed_to(options, as_user))
+
+
+class CurrentDropletManager(Manager):
+    """
+    Manager for the `CurrentDroplet` index, which keeps one row for each
+    current droplet when the `GEYSER_CURRENT_INDEX` setting is `True`.
+    
+    """
+    
+    def is_enabled(self):
+        return getattr(settings, 'GEYSER_CURRENT_INDEX', False)
+    
+    def add(self, droplet):
+        """
+        Adds or updates the index row for a droplet, if it is current and not
+        pending.
+        
+        """
+        
+        if not droplet.is_current or droplet.is_pending:
+            self.filter(droplet=droplet).delete()
+            return
+        values = {
+            'publication_type': droplet.publication_type,
+            'publication_id': droplet.publication_id,
+            'publishable_type': droplet.publishable_type,
+            'publishable_id': droplet.publishable_id,
+            'published': droplet.published,
+        }
+        if not self.filter(droplet=droplet).update(**values):
+            self.create(droplet=droplet, **values)
+    
+    def add_many(self, droplets):
+        """Adds index rows for new current droplets, in bulk."""
+        bulk_insert([self.model(
+            droplet=droplet,
+            publication_type_id=droplet.publication_type_id,
+            publication_id=droplet.publication_id,
+            publishable_type_id=droplet.publishable_type_id,
+            publishable_id=droplet.publishable_id,
+            published=droplet.published
+        ) for droplet in droplets
+            if droplet.is_current and not droplet.is_pending],
+            router.db_for_write(self.model))
+    
+    def remove(self, droplets):
+        """
+        Removes the index rows for a queryset of droplets, returning a list of
+        their pks. This must be called before the droplets are updated to no
+        longer be current, and the update should use the returned pks since
+        the queryset itself may be answered from the index.
+        
+        """
+        
+        pks = list(droplets.values_list('pk', flat=True))
+        self.filter(droplet__in=pks).delete()
+        return pks
+    
+    def rebuild(self):
+        """Rebuilds the whole index from the `Droplet` table."""
+        self.all().delete()
+        Droplet = self.model._meta.get_field('droplet').rel.to
+        for droplet in Droplet.objects.lean().filter(is_current=True,
+                is_pending=False).iterator():
+            self.add(droplet)
+
+
+class ArchiveCountManager(Manager):
+    """
+    Manager for the `ArchiveCount` rollup, which counts current droplets by
+    year, month and day of publishing when the `GEYSER_ARCHIVE_COUNTS`
+    setting is `True`. Droplets with a future publish date are flagged as
+    pending and only counted once `Droplet.objects.promote_due()` promotes
+    them.
+    
+    """
+    
+    def is_enabled(self):
+        return getattr(settings, 'GEYSER_ARCHIVE_COUNTS', False)
+    
+    def record(self, entries, delta):
+        """
+        Adds `delta` to the counts for each of the given
+        `(publication_type_id, publication_id, publishable_type_id, published)`
+        entries, with one query per count changed (or three, if a count is
+        created concurrently).
+        
+        """
+        
+        using = router.db_for_write(self.model)
+        
+        changes = {}
+        for (publication_type_id, publication_id, publishable_type_id,
+                published) in entries:
+            day = published.date()
+            for (period, start) in (('y', date(day.year, 1, 1)),
+                    ('m', date(day.year, day.month, 1)), ('d', day)):
+                key = (publication_type_id, publication_id,
+                    publishable_type_id, period, start)
+                changes[key] = changes.get(key, 0) + delta
+        for (key, change) in changes.items():
+            if not change:
+                continue
+            lookup = dict(zip(('publication_type', 'publication_id',
+                'publishable_type', 'period', 'start'), key))
+            if self.filter(**lookup).update(count=F('count') + change):
+                continue
+            values = dict(lookup)
+            values['publication_type_id'] = values.pop('publication_type')
+            values['publishable_type_id'] = values.pop('publishable_type')
+            sid = transaction.savepoint(using=using)
+            try:
+                self.model(count=change, **values).save(force_insert=True,
+                    using=using)
+                transaction.savepoint_commit(sid, using=using)
+            except IntegrityError:
+                # another droplet in the same period was counted first
+                transaction.savepoint_rollback(sid, using=using)
+                self.filter(**lookup).update(count=F('count') + change)
+    
+    def add_many(self, droplets):
+        """Counts new or promoted droplets, if they are current and due."""
+        self.record([(droplet.publication_type_id, droplet.publication_id,
+                droplet.publishable_type_id, droplet.published)
+            for droplet in droplets
+            if droplet.is_current and not droplet.is_pending], 1)
+    
+    def rebuild(self):
+        """
+        Rebuilds all counts from the `Droplet` table, first flagging droplets
+        with a future publish date as pending.
+        
+        """
+        
+        from geyser.models import Droplet
+        Droplet.objects.mark_pending()
+        self.all().delete()
+        self.record(Droplet.objects.lean().filter(is_current=True,
+                is_pending=False).values_list(
+            'publication_type', 'publication_id', 'publishable_type',
+            'published').iterator(), 1)
@@ -3,13 +3,14 @@ from datetime import datetime
 from django.db import models
 from django.db.models.signals import pre_save, post_save
 from django.conf import settings
-from django.core.exceptions import ValidationError
 
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.contrib.auth.models import User
 
-from geyser.managers import DropletManager
+from geyser.feeds import get_feed_snapshots
+from geyser.managers import DropletManager, CurrentDropletManager, \
+    ArchiveCountManager
 from geyser.bigint import BigAutoField
 
 # Droplet uses a custom Field that South won't recognize unless this is added
@@ -30,6 +31,10 @@ class Droplet(models.Model):
       was published. Can be self.
     * `is_current`: Whether this publishing is current (has not been
       unpublished).
+    * `is_pending`: Whether the publish date has not yet arrived. Only kept
+      when the `GEYSER_SCHEDULED_PUBLISHING` or `GEYSER_ARCHIVE_COUNTS`
+      setting is `True`, in which case it is cleared by
+      `Droplet.objects.promote_due()`.
     * `published`: The datetime that this `Droplet` was created.
     * `update`: The datetime that this `Droplet` was updated (probably means
       it was unpublished).
@@ -54,7 +59,9 @@ class Droplet(models.Model):
         'publication_type', 'publication_id')
     
     is_current = models.BooleanField(default=True, editable=False)
-    published = models.DateTimeField(default=datetime.now, editable=False)
+    is_pending = models.BooleanField(default=False, editable=False)
+    published = models.DateTimeField(default=datetime.now, editable=False,
+        db_index=True)
     updated = models.DateTimeField(auto_now=True, editable=False)
     
     published_by = models.ForeignKey(User, null=True, blank=True,
@@ -72,36 +79,78 @@ class Droplet(models.Model):
             self.publishable_type, self.publication, self.publication_type)
     
     def clean(self):
-        app_model = '%s.%s' % (self.publishable_type.app_label, self.publishable_type.model)
-        try:
-            unique_for_date_fields = settings.GEYSER_PUBLISHABLES[app_model]['unique_for_date']
-        except KeyError:
-            return
-        for field_name in unique_for_date_fields:
-            filter = {field_name: getattr(self.publishable, field_name)}
-            matching = self.publishable.__class__.objects.filter(**filter)
-            matching_ids = matching.values_list('id', flat=True)
-            if self.__class__.objects.filter(
-                publishable_type=self.publishable_type,
-                publishable_id__in=matching_ids,
-                published__year=self.published.year,
-                published__month=self.published.month,
-                published__day=self.published.day,
-                first=models.F('pk') # only worry about "canonical" publishing
-            ).exists():
-                raise ValidationError('%s.%s must be unique for date' %
-                    (self.publishable_type.model, field_name))
+        self.__class__.objects.validate_unique_for_date([self])
+
+
+class CurrentDroplet(models.Model):
+    """
+    A compact, denormalized index of current `Droplet`s.
+    
+    Rows are only kept when the `GEYSER_CURRENT_INDEX` setting is `True`, in
+    which case they are maintained by signals and by the `DropletManager`
+    methods which update droplets. Use `CurrentDroplet.objects.rebuild()` to
+    fill the index after enabling it.
+    
+    """
+    
+    droplet = models.OneToOneField(Droplet, primary_key=True,
+        related_name='current_index')
+    publication_type = models.ForeignKey(ContentType, related_name='+')
+    publication_id = models.PositiveIntegerField()
+    publishable_type = models.ForeignKey(ContentType, related_name='+')
+    publishable_id = models.PositiveIntegerField()
+    published = models.DateTimeField()
+    
+    objects = CurrentDropletManager()
+    
+    class Meta:
+        ordering = ['-published']
+
+
+class ArchiveCount(models.Model):
+    """
+    The number of current `Droplet`s published to a publication, of one
+    publishable type, in a year, month or day.
+    
+    Counts are only kept when the `GEYSER_ARCHIVE_COUNTS` setting is `True`,
+    in which case they are maintained by signals and by the `DropletManager`
+    methods which update droplets. Use `ArchiveCount.objects.rebuild()` to
+    fill the table after enabling it. `Droplet.objects.get_archive()` reads
+    the counts.
+    
+    """
+    
+    PERIOD_CHOICES = (
+        ('y', 'year'),
+        ('m', 'month'),
+        ('d', 'day'),
+    )
+    
+    publication_type = models.ForeignKey(ContentType, related_name='+')
+    publication_id = models.PositiveIntegerField()
+    publishable_type = models.ForeignKey(ContentType, related_name='+')
+    period = models.CharField(max_length=1, choices=PERIOD_CHOICES)
+    start = models.DateField()
+    count = models.IntegerField(default=0)
+    
+    objects = ArchiveCountManager()
+    
+    class Meta:
+        unique_together = ('publication_type', 'publication_id',
+            'publishable_type', 'period', 'start')
 
 
 def add_first(sender, **kwargs):
     instance = kwargs['instance']
-    first_dict = {
-        'publishable_type': instance.publishable_type,
-        'publishable_id': instance.publishable_id
-    }
-    try:
-        instance.first = Droplet.objects.filter(**first_dict).order_by('published')[0]
-    except IndexError:
+    if instance.first_id is not None:
+        return
+    earliest = sender.objects.lean().filter(
+        publishable_type=instance.publishable_type_id,
+        publishable_id=instance.publishable_id
+    ).order_by('published').values_list('pk', flat=True)[:1]
+    if earliest:
+        instance.first_id = earliest[0]
+    else:
         instance.full_clean()
 
 pre_save.connect(add_first, sender=Droplet)
@@ -109,23 +158,61 @@ pre_save.connect(add_first, sender=Droplet)
 
 def add_self_first(sender, **kwargs):
     instance = kwargs['instance']
-    if not instance.first:
-        # this should only happen if this instance is first
+    if instance.first_id is None:
+        # this should only happen if this instance is first; it is pointed to
+        # itself with an UPDATE, since saving it again would resend signals
+        sender.objects.lean().filter(pk=instance.pk).update(first=instance.pk)
         instance.first = instance
-        instance.save()
 
 post_save.connect(add_self_first, sender=Droplet)
 
 
+def set_pending(sender, **kwargs):
+    if sender.objects.is_pending_kept():
+        instance = kwargs['instance']
+        instance.is_pending = instance.published > datetime.now()
+
+pre_save.connect(set_pending, sender=Droplet)
+
+
 def unpublish_previous(sender, **kwargs):
     instance = kwargs['instance']
-    current_list = sender.objects.get_list(
-        publishable=instance.publishable,
-        publications=instance.publication
-    )
-    current_list.update(
-        is_current=False,
-        updated=datetime.now()
-    )
+    current_list = sender.objects.get_list(filters={
+        'publishable_type': instance.publishable_type_id,
+        'publishable_id': instance.publishable_id,
+        'publication_type': instance.publication_type_id,
+        'publication_id': instance.publication_id,
+    }, lean=True)
+    if instance.pk:
+        # saving a droplet again must not unpublish the droplet itself
+        current_list = current_list.exclude(pk=instance.pk)
+    sender.objects._set_not_current(current_list, {
+        'is_current': False,
+        'updated': datetime.now()
+    })
+
+pre_save.connect(unpublish_previous, sender=Droplet)
+
+
+def update_current_index(sender, **kwargs):
+    if CurrentDroplet.objects.is_enabled():
+        CurrentDroplet.objects.add(kwargs['instance'])
+
+post_save.connect(update_current_index, sender=Droplet)
+
+
+def update_feed_snapshots(sender, **kwargs):
+    snapshots = get_feed_snapshots()
+    if snapshots is not None:
+        droplet = kwargs['instance']
+        snapshots.discard([(droplet.publication_type_id,
+            droplet.publication_id)])
+
+post_save.connect(update_feed_snapshots, sender=Droplet)
+
+
+def update_archive_counts(sender, **kwargs):
+    if kwargs['created'] and ArchiveCount.objects.is_enabled():
+        ArchiveCount.objects.add_many([kwargs['instance']])
 
-pre_save.connect(unpublish_previous, sender=Droplet)
\ No newline at end of file
+post_save.connect(update_archive_counts, sender=Droplet)
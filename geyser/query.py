@@ -1,7 +1,143 @@
+import sys
+import threading
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from Queue import Queue
+from time import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
 from django.db.models.query import QuerySet
+from django.core.exceptions import FieldError
 
 from django.contrib.contenttypes.generic import GenericForeignKey
 
+from geyser.cache import get_object_cache, is_cached_model
+from geyser.registry import get_registry, _app_model
+from geyser.routing import get_read_db
+from geyser.signals import dangling_references
+
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S'
+DANGLING_POLICIES = ('raise', 'skip', 'none')
+
+
+def encode_cursor(value, pk):
+    """
+    Returns an opaque cursor string for a `(datetime, pk)` position, as used
+    by `GenericQuerySet.keyset_page`.
+    
+    """
+    
+    position = '%s%06d:%s' % (value.strftime(CURSOR_FORMAT),
+        value.microsecond, pk)
+    return urlsafe_b64encode(position)
+
+
+def decode_cursor(cursor):
+    """
+    Returns the `(datetime, pk)` position encoded in a cursor. Raises
+    `ValueError` if the cursor is not valid.
+    
+    """
+    
+    try:
+        (stamp, pk) = urlsafe_b64decode(str(cursor)).split(':')
+        value = datetime.strptime(stamp[:-6], CURSOR_FORMAT).replace(
+            microsecond=int(stamp[-6:]))
+        return (value, int(pk))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor: %r' % (cursor,))
+
+
+class WorkerPool(object):
+    """
+    A fixed number of daemon threads, started when first used, which run
+    functions for any thread of the process. Each thread keeps its database
+    connections from one function to the next, so that they are opened once
+    per thread rather than once per call.
+    
+    """
+    
+    def __init__(self, size):
+        self.size = size
+        self._tasks = Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    def _start(self):
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+    
+    def _work(self):
+        self._local.is_worker = True
+        while True:
+            (i, function, finished) = self._tasks.get()
+            try:
+                finished.put((i, function(), None))
+            except Exception:
+                finished.put((i, None, sys.exc_info()))
+    
+    def map(self, functions):
+        """
+        Calls each function in the pool's threads, returning their results in
+        order. If any function raises an exception, the first one is raised
+        again once all have finished. Functions are called in the current
+        thread if it belongs to the pool, which would otherwise wait on
+        itself.
+        
+        """
+        
+        if getattr(self._local, 'is_worker', False):
+            return [function() for function in functions]
+        self._start()
+        finished = Queue()
+        for (i, function) in enumerate(functions):
+            self._tasks.put((i, function, finished))
+        results = [None] * len(functions)
+        errors = []
+        for n in range(len(functions)):
+            (i, result, error) = finished.get()
+            results[i] = result
+            if error is not None:
+                errors.append((i, error))
+        if errors:
+            (type, value, traceback) = min(errors)[1]
+            raise type, value, traceback
+        return results
+
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """
+    Returns the pool of threads used by `GenericQuerySet.parallel_generic`,
+    of the size given by the `GEYSER_GENERIC_WORKERS` setting (4 by
+    default).
+    
+    """
+    
+    global _worker_pool
+    _worker_pool_lock.acquire()
+    try:
+        if _worker_pool is None:
+            _worker_pool = WorkerPool(getattr(settings,
+                'GEYSER_GENERIC_WORKERS', 4))
+        return _worker_pool
+    finally:
+        _worker_pool_lock.release()
+
 
 class GenericQuerySet(QuerySet):
     """
@@ -14,7 +150,9 @@ class GenericQuerySet(QuerySet):
     cause performance issues if the queryset is large.
     
     The `iterator()` method behaves as it does in a normal `QuerySet`, thus
-    bypassing the caching of related objects entirely.
+    bypassing the caching of related objects entirely. For large querysets,
+    `iterator_generic()` fetches related objects chunk by chunk without
+    caching the queryset.
     
     """
     
@@ -22,22 +160,47 @@ class GenericQuerySet(QuerySet):
         super(GenericQuerySet, self).__init__(*args, **kwargs)
         self._model_generic_fields = []
         self._select_related_fields = []
+        self._generic_options = {}
+        self._generic_parallel = False
+        self._generic_db = None
+        self._dangling = None
+        self.generic_timings = {}
     
     def _clone(self, *args, **kwargs):
         clone = super(GenericQuerySet, self)._clone(*args, **kwargs)
         clone._model_generic_fields = self._model_generic_fields
         clone._select_related_fields = self._select_related_fields
+        clone._generic_options = self._generic_options
+        clone._generic_parallel = self._generic_parallel
+        clone._generic_db = self._generic_db
+        clone._dangling = self._dangling
         return clone
     
-    def select_related_generic(self):
+    def select_related_generic(self, **options):
         """
         Returns a new `GenericQuerySet` instance that will fetch and cache
         generically related objects when evaluated.
         
+        Keyword arguments, named after generic foreign keys, give options for
+        the bulk query for each content type. Each is a dictionary mapping
+        ``'app_name.model_name'`` strings (or model classes) to a list of
+        fields to pass to `select_related`, or to a dictionary with any of
+        the keys ``'select_related'``, ``'only'`` and ``'defer'``::
+        
+            Droplet.objects.get_list().select_related_generic(
+                publishable={
+                    'blog.entry': ['author'],
+                    'links.link': {'only': ['url', 'title']},
+                })
+        
+        These override the ``'only'`` and ``'defer'`` options for the type in
+        `GEYSER_PUBLISHABLES`. Objects fetched with options bypass the object
+        cache.
+        
         """
         
         if self._model_generic_fields:
-            return self
+            clone = options and self._clone() or self
         else:
             model_generic_fields = []
             for field in self.model._meta.virtual_fields:
@@ -45,14 +208,87 @@ class GenericQuerySet(QuerySet):
                     model_generic_fields.append(field)
             if self.query.select_related is True:
                 clone = self._clone()
-                clone._model_generic_fields = model_generic_fields
-                return clone
             else:
                 fields = self._select_related_fields + \
                     [f.ct_field for f in model_generic_fields]
                 clone = super(GenericQuerySet, self).select_related(*fields)
-                clone._model_generic_fields = model_generic_fields
-                return clone
+            clone._model_generic_fields = model_generic_fields
+        if options:
+            field_names = [f.name for f in clone._model_generic_fields]
+            generic_options = dict(clone._generic_options)
+            for (name, by_model) in options.items():
+                if name not in field_names:
+                    raise FieldError('%s is not a generic foreign key of %s' %
+                        (name, self.model._meta.object_name))
+                by_app_model = dict(generic_options.get(name, {}))
+                for (model, model_options) in by_model.items():
+                    if not isinstance(model, basestring):
+                        model = _app_model(model)
+                    if not isinstance(model_options, dict):
+                        model_options = {'select_related': model_options}
+                    by_app_model[model.lower()] = model_options
+                generic_options[name] = by_app_model
+            clone._generic_options = generic_options
+        return clone
+    
+    def parallel_generic(self):
+        """
+        Returns a new `GenericQuerySet` instance that fetches the generically
+        related objects of each content type concurrently, in the threads of
+        the process's worker pool (see `get_worker_pool`), which keep a
+        database connection each.
+        
+        The fetches are still made one after another when the connection is
+        in a transaction with uncommitted changes, which other connections
+        could not see, or uses an in-memory SQLite database.
+        
+        """
+        
+        clone = self._clone()
+        clone._generic_parallel = True
+        return clone
+    
+    def using(self, alias):
+        # generically related objects are fetched from the same database, if
+        # one is chosen explicitly
+        clone = super(GenericQuerySet, self).using(alias)
+        clone._generic_db = alias
+        return clone
+    
+    def using_generic(self, alias):
+        """
+        Returns a new `GenericQuerySet` instance that fetches generically
+        related objects from the given database. Otherwise, they are fetched
+        from the database given to `using()`, or the one chosen by the
+        database routers for reading each related model (with the first item
+        as the ``instance`` hint).
+        
+        """
+        
+        clone = self._clone()
+        clone._generic_db = alias
+        return clone
+    
+    def on_dangling(self, policy):
+        """
+        Returns a new `GenericQuerySet` instance that handles generic foreign
+        keys to objects which no longer exist according to `policy`:
+        
+        * ``'raise'``: Raises the related model's `DoesNotExist` exception.
+        * ``'skip'``: Leaves out the rows with missing objects.
+        * ``'none'``: Sets the missing objects to `None`.
+        
+        The default is given by the `GEYSER_DANGLING_REFERENCES` setting, or
+        ``'raise'``. Whatever the policy, the `dangling_references` signal is
+        sent once for each batch of rows with missing objects.
+        
+        """
+        
+        if policy not in DANGLING_POLICIES:
+            raise ValueError('Unknown dangling reference policy: %r' % policy)
+        clone = self._clone()
+        clone._dangling = policy
+        return clone
     
     def select_related(self, *fields, **kwargs):
         #  guarantees that content type fields for generic foreign keys are
@@ -66,6 +302,274 @@ class GenericQuerySet(QuerySet):
         clone._select_related_fields = fields
         return clone
     
+    def _attach_generic(self, items):
+        """
+        Fetches the generically related objects for the given items in one
+        bulk query per content type, and caches them on each item. The time
+        taken by each content type's fetches is recorded in `generic_timings`,
+        a dictionary of seconds by content type.
+        
+        Returns the list of items, less any left out by the dangling reference
+        policy (see `on_dangling`).
+        
+        """
+        
+        ids_by_type = {}
+        for item in items:
+            for field in self._model_generic_fields:
+                content_type = getattr(item, field.ct_field)
+                key = (content_type, self._get_fetch_options(field, content_type))
+                ids_for_type = ids_by_type.setdefault(key, set())
+                ids_for_type.add(getattr(item, field.fk_field))
+        
+        groups = ids_by_type.items()
+        # databases are chosen here, since reads may be pinned in this thread
+        hints = items and {'instance': items[0]} or {}
+        aliases = [self._get_generic_db(type.model_class(), **hints)
+            for ((type, options), ids) in groups]
+        fetches = [(type, ids, options, alias)
+            for (((type, options), ids), alias) in zip(groups, aliases)]
+        if self._can_fetch_in_parallel(aliases):
+            results = get_worker_pool().map([
+                self._make_fetch(in_thread=True, *fetch) for fetch in fetches])
+        else:
+            results = [self._make_fetch(*fetch)() for fetch in fetches]
+        
+        objects_by_type = {}
+        self.generic_timings = {}
+        for (((type, options), ids), (objects, seconds)) in zip(groups, results):
+            objects_by_type[(type, options)] = objects
+            self.generic_timings[type] = \
+                self.generic_timings.get(type, 0) + seconds
+        
+        kept = []
+        missing = {}
+        for item in items:
+            dangling = False
+            for field in self._model_generic_fields:
+                content_type = getattr(item, field.ct_field)
+                key = (content_type, self._get_fetch_options(field, content_type))
+                object_id = getattr(item, field.fk_field)
+                related_object = objects_by_type[key].get(object_id)
+                if related_object is None:
+                    missing.setdefault(content_type, set()).add(object_id)
+                    dangling = True
+                setattr(item, field.cache_attr, related_object)
+            if not dangling:
+                kept.append(item)
+        
+        if missing:
+            dangling_references.send(sender=self.model, references=missing)
+            policy = self._dangling or getattr(settings,
+                'GEYSER_DANGLING_REFERENCES', 'raise')
+            if policy == 'raise':
+                (content_type, ids) = missing.items()[0]
+                raise content_type.model_class().DoesNotExist(
+                    '%s matching ids %s do not exist.' %
+                        (content_type.model_class().__name__, sorted(ids)))
+            if policy == 'none':
+                return items
+        return kept
+    
+    def _get_generic_db(self, Model, **hints):
+        """Returns the database alias to fetch related objects of a model from."""
+        return self._generic_db or get_read_db(Model, **hints)
+    
+    def _can_fetch_in_parallel(self, aliases):
+        if not self._generic_parallel or len(aliases) <= 1:
+            return False
+        for alias in aliases:
+            settings_dict = connections[alias].settings_dict
+            if transaction.is_dirty(using=alias):
+                return False
+            if settings_dict['ENGINE'].endswith('sqlite3') and \
+                    settings_dict['NAME'] in ('', ':memory:'):
+                return False
+        return True
+    
+    def _make_fetch(self, type, ids, options, using, in_thread=False):
+        """
+        Returns a function which fetches the objects of one content type and
+        returns them with the time taken. In a worker thread, the transaction
+        begun by the reads is ended afterwards, leaving the connection open
+        for the thread's next fetch.
+        
+        """
+        
+        def fetch():
+            started = time()
+            try:
+                objects = self._fetch_generic(type, ids, options, using)
+            finally:
+                if in_thread:
+                    transaction.commit_unless_managed(using=using)
+            return (objects, time() - started)
+        return fetch
+    
+    def _get_fetch_options(self, field, type):
+        """
+        Returns the `(select_related, only, defer)` tuples of field names for
+        fetching objects of a content type through a generic foreign key, or
+        `None` if there are no options. Options given to
+        `select_related_generic` take precedence over the ``'only'`` and
+        ``'defer'`` options for the type in `GEYSER_PUBLISHABLES`.
+        
+        """
+        
+        options = {}
+        registered = get_registry().get_for_content_type(type)
+        if registered is not None:
+            if registered.only:
+                options['only'] = registered.only
+            if registered.defer:
+                options['defer'] = registered.defer
+        options.update(self._generic_options.get(field.name, {}).get(
+            '%s.%s' % (type.app_label, type.model), {}))
+        if not options:
+            return None
+        return tuple([tuple(options.get(key, ()))
+            for key in ('select_related', 'only', 'defer')])
+    
+    def _fetch_generic(self, type, ids, options=None, using=None):
+        """
+        Returns a dictionary of objects of the given content type by id, from
+        the `using` database if given. With `(select_related, only, defer)`
+        options, these are applied to the query; otherwise the object cache
+        (if configured) is used before the database.
+        
+        """
+        
+        Model = type.model_class()
+        queryset = Model.objects.using(using or self._get_generic_db(Model))
+        if options is not None:
+            (select_related, only, defer) = options
+            if select_related:
+                queryset = queryset.select_related(*select_related)
+            if only:
+                queryset = queryset.only(*only)
+            if defer:
+                queryset = queryset.defer(*defer)
+            return queryset.in_bulk(ids)
+        object_cache = get_object_cache()
+        if object_cache is None or not is_cached_model(Model):
+            return queryset.in_bulk(ids)
+        objects = object_cache.get_many(type.id, ids)
+        missing = [id for id in ids if id not in objects]
+        if missing:
+            fetched = queryset.in_bulk(missing)
+            object_cache.set_many(type.id, fetched)
+            objects.update(fetched)
+        return objects
+    
+    def iterator_generic(self, chunk_size=100):
+        """
+        Iterates over the queryset without caching it, fetching generically
+        related objects for each chunk of `chunk_size` rows at a time.
+        
+        Each chunk is fetched with its own query (see `_chunks`), since some
+        database drivers load a whole result set into memory, so that memory
+        use stays flat for large querysets. This costs one query per chunk,
+        plus one bulk query per content type per chunk if
+        `select_related_generic` has been called.
+        
+        """
+        
+        for chunk in self._chunks(chunk_size):
+            if self._model_generic_fields:
+                chunk = self._attach_generic(chunk)
+            for item in chunk:
+                yield item
+    
+    def _chunks(self, chunk_size):
+        """
+        Yields lists of at most `chunk_size` results, in order. Querysets
+        ordered by descending publish date (as droplets are by default) are
+        paged through with `seek`, and others with offsets, ordered by
+        primary key after any other ordering so that no result is repeated
+        or skipped between chunks.
+        
+        """
+        
+        query = self.query
+        if query.order_by:
+            ordering = list(query.order_by)
+        elif query.default_ordering:
+            ordering = list(self.model._meta.ordering)
+        else:
+            ordering = []
+        pk_names = ('pk', self.model._meta.pk.name)
+        pk_orderings = ([], ['-pk'], ['-%s' % self.model._meta.pk.name])
+        sliced = query.low_mark or query.high_mark is not None
+        if not sliced and query.standard_ordering and \
+                ordering[:1] == ['-published'] and \
+                ordering[1:] in pk_orderings:
+            position = None
+            while True:
+                chunk = list(self.seek(position)[:chunk_size].iterator())
+                if chunk:
+                    yield chunk
+                if len(chunk) < chunk_size:
+                    return
+                position = (chunk[-1].published, chunk[-1].pk)
+        else:
+            queryset = self._clone()
+            if not sliced and not [name for name in ordering
+                    if name.lstrip('-') in pk_names]:
+                queryset = queryset.order_by(*(ordering + ['pk']))
+            start = 0
+            while True:
+                chunk = list(queryset[start:start + chunk_size].iterator())
+                if chunk:
+                    yield chunk
+                if len(chunk) < chunk_size:
+                    return
+                start += chunk_size
+    
+    def seek(self, position=None, field='published'):
+        """
+        Returns a new `GenericQuerySet` ordered by `field` and then primary
+        key, both descending, containing only the results which come after
+        the given `(value, pk)` position (or all results if it is `None`).
+        
+        """
+        
+        queryset = self.order_by('-%s' % field, '-pk')
+        if position is not None:
+            (value, pk) = position
+            queryset = queryset.filter(Q(**{'%s__lt' % field: value}) |
+                Q(**{field: value, 'pk__lt': pk}))
+        return queryset
+    
+    def keyset_page(self, cursor=None, per_page=20, field='published'):
+        """
+        Returns a page of results and the cursor for the next page, as a
+        `(list, cursor)` tuple. The cursor is `None` on the last page.
+        
+        Results are ordered by `field` (a datetime field) and then primary
+        key, both descending, and each page is selected with a ``WHERE``
+        clause on the position encoded in the cursor rather than an
+        ``OFFSET``, so that later pages cost the same as the first. Pass the
+        cursor from one page to get the next, or `None` for the first page.
+        Generically related objects are fetched for the page only.
+        
+        Raises `ValueError` if the cursor is not valid.
+        
+        """
+        
+        if cursor is not None:
+            cursor = decode_cursor(cursor)
+        page = list(self.seek(cursor, field)[:per_page + 1].iterator())
+        # the extra row only shows whether there is a next page
+        if len(page) > per_page:
+            page = page[:per_page]
+            last = page[-1]
+            next_cursor = encode_cursor(getattr(last, field), last.pk)
+        else:
+            next_cursor = None
+        if self._model_generic_fields:
+            page = self._attach_generic(page)
+        return (page, next_cursor)
+    
     def __iter__(self):
         if self._model_generic_fields:
             # fill the cache completely before fetching related objects
@@ -84,23 +588,7 @@ class GenericQuerySet(QuerySet):
             
             # this is the select_related_generic part
             if attach_related:
-                ids_by_type = {}
-                for item in self._result_cache:
-                    for field in self._model_generic_fields:
-                        content_type = getattr(item, field.ct_field)
-                        ids_for_type = ids_by_type.setdefault(content_type, set())
-                        ids_for_type.add(getattr(item, field.fk_field))
-                
-                objects_by_type = {}
-                for (type, ids) in ids_by_type.items():
-                    objects_by_type[type] = type.model_class().objects.in_bulk(ids)
-                
-                for item in self._result_cache:
-                    for field in self._model_generic_fields:
-                        content_type = getattr(item, field.ct_field)
-                        object_id = getattr(item, field.fk_field)
-                        related_object = objects_by_type[content_type][object_id]
-                        setattr(item, field.cache_attr, related_object)
+                self._result_cache = self._attach_generic(self._result_cache)
             
             return iter(self._result_cache)
         else:
@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.db.models import get_model
+from django.contrib.contenttypes.models import ContentType
+
+
+def _concrete_model(model):
+    """Returns the concrete model for a model, instance, or deferred class."""
+    opts = model._meta
+    while opts.proxy:
+        model = opts.proxy_for_model
+        opts = model._meta
+    return model
+
+
+def _app_model(model):
+    opts = _concrete_model(model)._meta
+    return '%s.%s' % (opts.app_label, opts.module_name)
+
+
+class PublishableOptions(object):
+    """
+    The compiled `GEYSER_PUBLISHABLES` settings for one publishable type.
+    
+    Attributes:
+    
+    * `app_model`: The publishable type as an `'app_name.model_name'` string.
+    * `model`: The publishable model class.
+    * `publish_to`: A list of `(app_model, model)` pairs for the types to
+      which objects of this type can be published.
+    * `unique_for_date`: A tuple of field names from the setting.
+    * `auto_perms`: A tuple of field names from the setting.
+    * `only`, `defer`: Tuples of field names from the setting, used when
+      objects of this type are fetched by `GenericQuerySet`.
+    
+    Content types are looked up when first used, so that the registry can be
+    built before the database is available.
+    
+    """
+    
+    def __init__(self, app_model, options):
+        self.app_model = app_model
+        self.model = get_model(*app_model.split('.'))
+        self.publish_to = [(publication_str,
+                get_model(*publication_str.split('.')))
+            for publication_str in options['publish_to']]
+        self.unique_for_date = tuple(options.get('unique_for_date', ()))
+        self.auto_perms = tuple(options.get('auto_perms', ()))
+        self.only = tuple(options.get('only', ()))
+        self.defer = tuple(options.get('defer', ()))
+        self._content_type = None
+        self._publish_to_types = None
+    
+    @property
+    def content_type(self):
+        if self._content_type is None:
+            self._content_type = ContentType.objects.get_for_model(self.model)
+        return self._content_type
+    
+    @property
+    def publish_to_types(self):
+        """A list of `(app_model, model, content_type)` tuples."""
+        if self._publish_to_types is None:
+            self._publish_to_types = [(publication_str, Publication,
+                    ContentType.objects.get_for_model(Publication))
+                for (publication_str, Publication) in self.publish_to]
+        return self._publish_to_types
+
+
+class PublishableRegistry(object):
+    """
+    All publishable types from the `GEYSER_PUBLISHABLES` setting, indexed by
+    `'app_name.model_name'` string, model class and content type id.
+    
+    """
+    
+    def __init__(self, publishables):
+        self._by_app_model = {}
+        for (app_model, options) in publishables.items():
+            self._by_app_model[app_model] = PublishableOptions(
+                app_model, options)
+        self._publication_app_models = set()
+        for options in self._by_app_model.values():
+            for (publication_str, Publication) in options.publish_to:
+                self._publication_app_models.add(publication_str)
+        self._by_content_type_id = None
+    
+    def __iter__(self):
+        return iter(self._by_app_model.values())
+    
+    def __len__(self):
+        return len(self._by_app_model)
+    
+    def __contains__(self, model):
+        return self.get(model) is not None
+    
+    def get(self, model):
+        """
+        Returns the `PublishableOptions` for a publishable model or instance
+        (or an `'app_name.model_name'` string), or `None` if the type is not
+        publishable.
+        
+        """
+        
+        if not isinstance(model, basestring):
+            model = _app_model(model)
+        return self._by_app_model.get(model)
+    
+    def get_for_content_type(self, content_type):
+        """
+        Returns the `PublishableOptions` for a content type (or its id), or
+        `None` if the type is not publishable.
+        
+        """
+        
+        if self._by_content_type_id is None:
+            self._by_content_type_id = dict((options.content_type.id, options)
+                for options in self)
+        if isinstance(content_type, ContentType):
+            content_type = content_type.id
+        return self._by_content_type_id.get(content_type)
+    
+    def is_publication(self, model):
+        """Returns whether objects of a model can be published to."""
+        return _app_model(model) in self._publication_app_models
+    
+    def is_registered(self, model):
+        """Returns whether a model is either publishable or a publication."""
+        app_model = _app_model(model)
+        return app_model in self._by_app_model or \
+            app_model in self._publication_app_models
+
+
+_registry = None
+
+
+def get_registry():
+    """
+    Returns the `PublishableRegistry` for the `GEYSER_PUBLISHABLES` setting,
+    building it on first use.
+    
+    """
+    
+    global _registry
+    if _registry is None:
+        _registry = PublishableRegistry(settings.GEYSER_PUBLISHABLES)
+    return _registry
+
+
+def reset_registry():
+    """
+    Discards the current registry, so that it is rebuilt from settings the
+    next time it is used. Tests which change `GEYSER_PUBLISHABLES` should
+    call this.
+    
+    """
+    
+    global _registry
+    _registry = None
@@ -0,0 +1,114 @@
+import threading
+from math import ceil
+from time import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import router
+from django.utils.functional import wraps
+
+
+PINNED_COOKIE = 'geyser_pinned_until'
+
+_state = threading.local()
+
+
+def pin_writes():
+    """
+    Sends reads in the current thread to the databases used for writing, for
+    the number of seconds given by the `GEYSER_READ_YOUR_WRITES` setting, so
+    that droplets which have just been published or unpublished are seen
+    even if replicas lag behind. Does nothing if the setting is not set.
+    
+    Pinning lasts until the end of the current request; with
+    `ReadYourWritesMiddleware` it carries over to the same user's later
+    requests.
+    
+    """
+    
+    seconds = getattr(settings, 'GEYSER_READ_YOUR_WRITES', None)
+    if seconds:
+        _state.pinned_until = time() + seconds
+
+
+def unpin_writes(**kwargs):
+    """Ends any pinning of reads in the current thread."""
+    _state.pinned_until = None
+
+request_finished.connect(unpin_writes)
+
+
+def is_pinned():
+    if getattr(_state, 'writing', 0):
+        return True
+    pinned_until = getattr(_state, 'pinned_until', None)
+    return pinned_until is not None and pinned_until > time()
+
+
+def writes(function):
+    """
+    Decorates a method which writes droplets, so that the reads it makes are
+    sent to the databases used for writing, and reads are pinned to them
+    afterwards (see `pin_writes`).
+    
+    """
+    
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        _state.writing = getattr(_state, 'writing', 0) + 1
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _state.writing -= 1
+            pin_writes()
+    return wrapper
+
+
+def get_pinned_db(Model, **hints):
+    """
+    Returns the database alias for writing a model if reads are pinned in the
+    current thread, or `None`.
+    
+    """
+    
+    if is_pinned():
+        return router.db_for_write(Model, **hints)
+    return None
+
+
+def get_read_db(Model, **hints):
+    """
+    Returns the database alias to read a model from: the router's choice for
+    reads, or for writes while reads are pinned.
+    
+    """
+    
+    return get_pinned_db(Model, **hints) or router.db_for_read(Model, **hints)
+
+
+class ReadYourWritesMiddleware(object):
+    """
+    Pins the reads of a user's requests to the databases used for writing
+    while the user's own writes may not have reached the replicas, by
+    keeping the end of the pinning in a cookie.
+    
+    """
+    
+    def process_request(self, request):
+        unpin_writes()
+        try:
+            pinned_until = float(request.COOKIES.get(PINNED_COOKIE, ''))
+        except ValueError:
+            return None
+        if pinned_until > time():
+            _state.pinned_until = pinned_until
+        return None
+    
+    def process_response(self, request, response):
+        pinned_until = getattr(_state, 'pinned_until', None)
+        if pinned_until is not None and pinned_until > time() and \
+                repr(pinned_until) != request.COOKIES.get(PINNED_COOKIE):
+            response.set_cookie(PINNED_COOKIE, repr(pinned_until),
+                max_age=int(ceil(pinned_until - time())))
+        unpin_writes()
+        return response
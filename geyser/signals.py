@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+
+# sent by DropletManager.promote_due with the pks of each batch of droplets
+# whose publish date has arrived, for invalidating caches of visible droplets
+droplets_promoted = Signal(providing_args=['pks'])
+
+# sent by GenericQuerySet with a dictionary of sets of ids by content type,
+# once for each batch of rows whose publishable or publication was missing
+dangling_references = Signal(providing_args=['references'])
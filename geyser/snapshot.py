@@ -0,0 +1,163 @@
+from django.db.models import get_model
+from django.contrib.auth import get_backends
+from django.contrib.contenttypes.models import ContentType
+
+from rubberstamp.backends import AppPermissionBackend
+from rubberstamp.models import AppPermission, AssignedPermission
+
+
+class PermissionSnapshot(object):
+    """
+    A user's geyser permissions, loaded in one query and then answered from
+    memory.
+    
+    A snapshot can be passed as `as_user` to the `DropletManager` methods in
+    place of the user. It answers `has_perm` and `get_permission_targets` for
+    the ``geyser.publish`` and ``geyser.publish_to`` permissions assigned to
+    the user, so it should only live as long as a request; use
+    `PermissionSnapshot.for_request` to share one within a request.
+    Permissions which are not assigned to the user are asked of the other
+    authentication backends, once each.
+    
+    """
+    
+    def __init__(self, user):
+        self.user = user
+        self._type_perms = None
+        self._object_perms = None
+        self._backend_perms = {}
+        self._targets = {}
+    
+    @classmethod
+    def for_request(cls, request):
+        """Returns the snapshot for the request's user, creating it once."""
+        snapshot = getattr(request, '_geyser_permissions', None)
+        if snapshot is None or snapshot.user != request.user:
+            snapshot = cls(request.user)
+            request._geyser_permissions = snapshot
+        return snapshot
+    
+    @property
+    def is_superuser(self):
+        return self.user.is_superuser
+    
+    @property
+    def is_active(self):
+        return self.user.is_active
+    
+    def _load(self):
+        if self._type_perms is not None:
+            return
+        self._type_perms = set()
+        self._object_perms = {}
+        if self.user.is_superuser or not self.user.is_active:
+            return
+        assigned = AssignedPermission.objects.filter(user=self.user,
+            permission__app_label='geyser').values_list(
+                'permission__codename', 'content_type', 'object_id')
+        for (codename, content_type_id, object_id) in assigned:
+            if object_id is None:
+                self._type_perms.add((codename, content_type_id))
+            else:
+                self._object_perms.setdefault((codename, content_type_id),
+                    set()).add(object_id)
+    
+    def _parse(self, perm):
+        """
+        Splits ``'geyser.<codename>[.<app>.<model>]'`` into the codename and
+        content type id (`None` if no type is given).
+        
+        """
+        
+        parts = perm.split('.')
+        if len(parts) == 4:
+            Model = get_model(parts[2], parts[3])
+            return (parts[1], ContentType.objects.get_for_model(Model).id)
+        return (parts[1], None)
+    
+    def has_perm(self, perm, obj=None):
+        """Works like `User.has_perm` for geyser permissions."""
+        if not self.user.is_active:
+            return False
+        if self.user.is_superuser:
+            return True
+        self._load()
+        (codename, content_type_id) = self._parse(perm)
+        if obj is not None:
+            content_type_id = ContentType.objects.get_for_model(obj).id
+            if (codename, content_type_id) in self._type_perms or \
+                    obj.pk in self._object_perms.get(
+                        (codename, content_type_id), ()):
+                return True
+        elif (codename, content_type_id) in self._type_perms:
+            return True
+        return self._has_backend_perm(perm, obj)
+    
+    def _has_backend_perm(self, perm, obj=None):
+        """
+        Works like `User.has_perm`, but skips the rubberstamp backend, whose
+        answers the snapshot already holds, and remembers the result.
+        
+        """
+        
+        if obj is None:
+            key = (perm, None, None)
+        else:
+            key = (perm, ContentType.objects.get_for_model(obj).id, obj.pk)
+        if key not in self._backend_perms:
+            allowed = False
+            for backend in get_backends():
+                if isinstance(backend, AppPermissionBackend) or \
+                        not hasattr(backend, 'has_perm'):
+                    continue
+                if obj is None:
+                    allowed = backend.has_perm(self.user, perm)
+                elif getattr(backend, 'supports_object_permissions', False):
+                    allowed = backend.has_perm(self.user, perm, obj)
+                if allowed:
+                    break
+            self._backend_perms[key] = allowed
+        return self._backend_perms[key]
+    
+    def get_permission_target_ids(self, perm):
+        """
+        Returns the set of ids of objects for which the user has been given
+        the permission individually.
+        
+        """
+        
+        self._load()
+        return self._object_perms.get(self._parse(perm), set())
+    
+    def get_permission_targets(self, perm):
+        """
+        Works like `AppPermission.objects.get_permission_targets`, loading the
+        objects once per permission.
+        
+        """
+        
+        if perm not in self._targets:
+            (codename, content_type_id) = self._parse(perm)
+            Model = ContentType.objects.get_for_id(content_type_id).model_class()
+            ids = self.get_permission_target_ids(perm)
+            self._targets[perm] = Model.objects.in_bulk(ids).values()
+        return self._targets[perm]
+
+
+def get_user(as_user):
+    """Returns the user for an `as_user` argument, which may be a snapshot."""
+    if isinstance(as_user, PermissionSnapshot):
+        return as_user.user
+    return as_user
+
+
+def get_permission_targets(perm, as_user):
+    """
+    Returns the objects for which `as_user` (a user or snapshot) has been
+    given the permission individually.
+    
+    """
+    
+    if isinstance(as_user, PermissionSnapshot):
+        return as_user.get_permission_targets(perm)
+    return AppPermission.objects.get_permission_targets(perm, as_user)
@@ -0,0 +1,2 @@
+CREATE INDEX geyser_currentdroplet_publication
+    ON geyser_currentdroplet (publication_type_id, publication_id, published);
@@ -0,0 +1,9 @@
+-- Composite indexes for the query shapes used by DropletManager.get_list,
+-- DropletManager.promote_due and the add_first and unpublish_previous signal
+-- handlers.
+CREATE INDEX geyser_droplet_publication_current
+    ON geyser_droplet (publication_type_id, publication_id, is_current, published);
+CREATE INDEX geyser_droplet_publishable_published
+    ON geyser_droplet (publishable_type_id, publishable_id, published);
+CREATE INDEX geyser_droplet_pending
+    ON geyser_droplet (is_pending, published);
@@ -3,3 +3,10 @@ from geyser.tests.models import *
 from geyser.tests.query import *
 from geyser.tests.managers import *
 from geyser.tests.views import *
+from geyser.tests.cache import *
+from geyser.tests.commands import *
+from geyser.tests.registry import *
+from geyser.tests.snapshot import *
+from geyser.tests.benchmark import *
+from geyser.tests.feeds import *
+from geyser.tests.routing import *
@@ -3,51 +3,88 @@ import os
 from django.conf import settings
 from django.core.management import call_command
 from django.db.models import loading
-from django.test import TestCase
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase, TransactionTestCase
+
+from geyser.registry import reset_registry
 
 NUM_RELATED_TYPES = 3
 
+TEST_PUBLISHABLES = {
+    'testapp.testmodel1': {
+        'publish_to': ('testapp.testmodel2', 'testapp.testmodel3'),
+        'auto_perms': ('owner',),
+    },
+    'testapp.testmodel2': {
+        'publish_to': ('testapp.testmodel3',),
+        'unique_for_date': ('name',),
+    }
+}
+
+
+def install_test_app():
+    """
+    Adds the test app, templates, fixtures and publishables to the settings
+    and syncs the database. Returns the original settings, to be passed to
+    `uninstall_test_app`.
+    
+    """
+    
+    originals = {}
+    for name in ('TEMPLATE_DIRS', 'FIXTURE_DIRS', 'INSTALLED_APPS',
+            'AUTHENTICATION_BACKENDS'):
+        originals[name] = getattr(settings, name)
+        setattr(settings, name, list(originals[name]))
+    originals['GEYSER_PUBLISHABLES'] = getattr(settings, 'GEYSER_PUBLISHABLES', {})
+    
+    settings.TEMPLATE_DIRS.append(os.path.join(os.path.dirname(__file__), 'templates'))
+    settings.FIXTURE_DIRS.append(os.path.join(os.path.dirname(__file__), 'fixtures'))
+    
+    settings.INSTALLED_APPS.append('geyser.tests.testapp')
+    loading.cache.loaded = False
+    call_command('syncdb', interactive=False, verbosity=0)
+    
+    settings.AUTHENTICATION_BACKENDS.append('rubberstamp.backends.AppPermissionBackend')
+    
+    settings.GEYSER_PUBLISHABLES = TEST_PUBLISHABLES
+    reset_registry()
+    import rubberstamp
+    rubberstamp.autodiscover()
+    return originals
+
+
+def uninstall_test_app(originals):
+    for (name, value) in originals.items():
+        setattr(settings, name, value)
+    reset_registry()
+    loading.cache.loaded = False
+
+
 class GeyserTestCase(TestCase):
     def _pre_setup(self):
-        self._original_template_dirs = settings.TEMPLATE_DIRS
-        settings.TEMPLATE_DIRS = list(settings.TEMPLATE_DIRS)
-        settings.TEMPLATE_DIRS.append(os.path.join(os.path.dirname(__file__), 'templates'))
-        
-        self._original_fixture_dirs = settings.FIXTURE_DIRS
-        settings.FIXTURE_DIRS = list(settings.FIXTURE_DIRS)
-        settings.FIXTURE_DIRS.append(os.path.join(os.path.dirname(__file__), 'fixtures'))
-        
-        self._original_installed_apps = settings.INSTALLED_APPS
-        settings.INSTALLED_APPS = list(settings.INSTALLED_APPS)
-        settings.INSTALLED_APPS.append('geyser.tests.testapp')
-        loading.cache.loaded = False
-        call_command('syncdb', interactive=False, verbosity=0)
-        
-        self._original_auth_backends = settings.AUTHENTICATION_BACKENDS
-        settings.AUTHENTICATION_BACKENDS = list(settings.AUTHENTICATION_BACKENDS)
-        settings.AUTHENTICATION_BACKENDS.append('rubberstamp.backends.AppPermissionBackend')
-        
-        self._original_geyser = getattr(settings, 'GEYSER_PUBLISHABLES', {})
-        settings.GEYSER_PUBLISHABLES = {
-            'testapp.testmodel1': {
-                'publish_to': ('testapp.testmodel2', 'testapp.testmodel3'),
-                'auto_perms': ('owner',),
-            },
-            'testapp.testmodel2': {
-                'publish_to': ('testapp.testmodel3',),
-                'unique_for_date': ('name',),
-            }
-        }
-        import rubberstamp
-        rubberstamp.autodiscover()
-        
+        self._original_settings = install_test_app()
         super(TestCase, self)._pre_setup()
     
     def _post_teardown(self):
         super(TestCase, self)._post_teardown()
-        settings.GEYSER_PUBLISHABLES = self._original_geyser
-        settings.AUTHENTICATION_BACKENDS = self._original_auth_backends
-        settings.INSTALLED_APPS = self._original_installed_apps
-        settings.FIXTURE_DIRS = self._original_fixture_dirs
-        settings.TEMPLATE_DIRS = self._original_template_dirs
-        loading.cache.loaded = False
+        uninstall_test_app(self._original_settings)
+
+
+class GeyserTransactionTestCase(TransactionTestCase):
+    def _fixture_setup(self):
+        # flushing removes rubberstamp's permissions, which are needed to
+        # save publishables with automatic permissions
+        call_command('flush', verbosity=0, interactive=False)
+        ContentType.objects.clear_cache()
+        import rubberstamp
+        rubberstamp.autodiscover()
+        if hasattr(self, 'fixtures'):
+            call_command('loaddata', *self.fixtures, **{'verbosity': 0})
+    
+    def _pre_setup(self):
+        self._original_settings = install_test_app()
+        super(GeyserTransactionTestCase, self)._pre_setup()
+    
+    def _post_teardown(self):
+        super(GeyserTransactionTestCase, self)._post_teardown()
+        uninstall_test_app(self._original_settings)
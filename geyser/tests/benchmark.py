@@ -0,0 +1,25 @@
+from django.utils import simplejson
+
+from geyser.benchmark import run_benchmark
+from geyser.models import Droplet
+from geyser.tests.base import GeyserTestCase
+
+
+class BenchmarkTest(GeyserTestCase):
+    def test_run_benchmark(self):
+        result = run_benchmark(200, repeat=1, num_publications=5)
+        simplejson.dumps(result)
+        
+        self.assertEqual(result['droplets'], 200)
+        self.assertEqual(result['publications'], 10)
+        self.assertTrue(Droplet.objects.count() >= 200)
+        names = [benchmark['name'] for benchmark in result['benchmarks']]
+        self.assertTrue('get_list publications' in names)
+        self.assertTrue('publish_many' in names)
+        self.assertTrue('PublishObject POST' in names)
+        for benchmark in result['benchmarks']:
+            self.assertTrue(benchmark['queries'] > 0, benchmark['name'])
+            self.assertTrue(benchmark['seconds_min'] >= 0)
+
+
+__all__ = ('BenchmarkTest',)
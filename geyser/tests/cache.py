@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db import connection, reset_queries
+from django.contrib.contenttypes.models import ContentType
+
+from geyser.cache import get_object_cache, reset_object_cache, \
+    LocalObjectCache
+from geyser.models import Droplet
+from geyser.query import WorkerPool
+from geyser.tests.base import GeyserTestCase, NUM_RELATED_TYPES
+from geyser.tests.testapp.models import TestModel3
+
+
+class ObjectCacheTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'droplets.json']
+    
+    def setUp(self):
+        self._original_cache = getattr(settings, 'GEYSER_OBJECT_CACHE', None)
+        settings.GEYSER_OBJECT_CACHE = {'backend': 'local', 'max_size': 100}
+        reset_object_cache()
+        settings.DEBUG = True
+        reset_queries()
+    
+    def tearDown(self):
+        settings.DEBUG = False
+        settings.GEYSER_OBJECT_CACHE = self._original_cache
+        reset_object_cache()
+    
+    def test_cached_fetch(self):
+        list(Droplet.objects.all())
+        self.assertEqual(len(connection.queries), NUM_RELATED_TYPES + 1)
+        object_cache = get_object_cache()
+        self.assertEqual(object_cache.hits, 0)
+        self.assertTrue(object_cache.misses > 0)
+        
+        reset_queries()
+        droplets = list(Droplet.objects.all())
+        self.assertEqual(len(connection.queries), 1)
+        self.assertEqual(object_cache.misses, object_cache.hits)
+        for droplet in droplets:
+            droplet.publishable
+            droplet.publication
+        self.assertEqual(len(connection.queries), 1)
+    
+    def test_invalidation(self):
+        list(Droplet.objects.all())
+        t3a = TestModel3.objects.get(pk=1)
+        t3a.name = 'renamed'
+        t3a.save()
+        droplets = Droplet.objects.get_list(publications=t3a)
+        self.assertTrue(all(d.publication.name == 'renamed' for d in droplets))
+    
+    def test_copies(self):
+        object_cache = get_object_cache()
+        t3a = TestModel3.objects.get(pk=1)
+        type_id = ContentType.objects.get_for_model(TestModel3).id
+        object_cache.set_many(type_id, {t3a.pk: t3a})
+        t3a.name = 'changed'
+        cached = object_cache.get_many(type_id, [t3a.pk])[t3a.pk]
+        self.assertNotEqual(cached.name, 'changed')
+        cached.name = 'changed again'
+        self.assertNotEqual(object_cache.get_many(type_id, [t3a.pk])[t3a.pk].name,
+            'changed again')
+    
+    def test_max_size(self):
+        settings.GEYSER_OBJECT_CACHE = {'backend': 'local', 'max_size': 1}
+        reset_object_cache()
+        list(Droplet.objects.all())
+        self.assertEqual(len(get_object_cache()._objects), 1)
+    
+    def test_threads(self):
+        object_cache = LocalObjectCache(max_size=10)
+        def use_cache(n):
+            for i in range(200):
+                object_cache.set_many(n, {i: i})
+                object_cache.get_many(n, range(i - 5, i + 1))
+                object_cache.delete(n, i - 1)
+        WorkerPool(8).map([lambda n=n: use_cache(n) for n in range(8)])
+        self.assertTrue(len(object_cache._objects) <= 10)
+        self.assertEqual(object_cache.hits + object_cache.misses,
+            8 * 200 * 6)
+
+
+__all__ = ('ObjectCacheTest',)
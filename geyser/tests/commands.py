@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from geyser.management.commands.geyser_explain import explain_query_shapes
+from geyser.management.commands.geyser_promote import \
+    Command as PromoteCommand
+from geyser.management.commands.geyser_orphans import \
+    Command as OrphansCommand
+from geyser.models import Droplet
+from geyser.tests.base import GeyserTestCase
+from geyser.tests.testapp.models import TestModel3
+
+
+class ExplainCommandTest(GeyserTestCase):
+    # no fixtures, since sqlite commits the test transaction before EXPLAIN
+    
+    def test_explain(self):
+        results = explain_query_shapes()
+        self.assertTrue(results)
+        for (name, plan, scans) in results:
+            self.assertTrue(plan)
+            if name.startswith('by publication') or \
+                    name.startswith('first droplet') or \
+                    name.startswith('previous'):
+                self.assertEqual(scans, [], name)
+    
+    def test_command(self):
+        call_command('geyser_explain', verbosity=0)
+
+
+class PromoteCommandTest(GeyserTestCase):
+    def setUp(self):
+        self._original_scheduling = getattr(settings,
+            'GEYSER_SCHEDULED_PUBLISHING', False)
+    
+    def tearDown(self):
+        settings.GEYSER_SCHEDULED_PUBLISHING = self._original_scheduling
+    
+    def test_command(self):
+        settings.GEYSER_SCHEDULED_PUBLISHING = False
+        self.assertRaises(CommandError, PromoteCommand().handle_noargs,
+            batch_size=10, interval=None, verbosity=0)
+        settings.GEYSER_SCHEDULED_PUBLISHING = True
+        call_command('geyser_promote', verbosity=0)
+        call_command('geyser_promote', init=True, verbosity=0)
+
+
+class OrphansCommandTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'droplets.json']
+    
+    def test_command(self):
+        TestModel3.objects.get(pk=1).delete()
+        call_command('geyser_orphans', verbosity=0)
+        self.assertEqual(Droplet.objects.filter(is_current=True).count(), 5)
+        call_command('geyser_orphans', unpublish=True, verbosity=0)
+        self.assertEqual(Droplet.objects.filter(is_current=True).count(), 3)
+        self.assertRaises(CommandError, OrphansCommand().handle_noargs,
+            unpublish=True, delete=True, batch_size=10, verbosity=0)
+
+
+__all__ = ('ExplainCommandTest', 'PromoteCommandTest', 'OrphansCommandTest',)
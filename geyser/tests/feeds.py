@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+from itertools import islice
+from time import sleep
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, reset_queries
+from django.contrib.contenttypes.models import ContentType
+
+from geyser.feeds import Feed, get_feed_snapshots, reset_feed_snapshots
+from geyser.models import Droplet
+from geyser.tests.base import GeyserTestCase, NUM_RELATED_TYPES
+from geyser.tests.testapp.models import TestModel1, TestModel2, TestModel3
+
+
+class FeedTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'droplets.json']
+    
+    def setUp(self):
+        self.t2a = TestModel2.objects.get(pk=1)
+        self.t3a = TestModel3.objects.get(pk=1)
+        self.t3b = TestModel3.objects.get(pk=2)
+        self.publications = [self.t2a, self.t3a, self.t3b]
+    
+    def test_merge(self):
+        expected = list(Droplet.objects.get_list(publications=self.publications))
+        self.assertEqual(list(Droplet.objects.get_feed(self.publications,
+            per_source=1, dedupe=False)), expected)
+        self.assertEqual(list(Feed(self.publications, include_future=True,
+                dedupe=False)),
+            list(Droplet.objects.get_list(publications=self.publications,
+                include_future=True)))
+        
+        querysets = [Droplet.objects.get_list(publications=publication)
+            for publication in self.publications]
+        self.assertEqual(list(Feed(querysets, dedupe=False)), expected)
+    
+    def test_lazy(self):
+        settings.DEBUG = True
+        reset_queries()
+        try:
+            feed = Droplet.objects.get_feed(self.publications, per_source=1,
+                chunk_size=1)
+            self.assertEqual(len(connection.queries), 0)
+            droplet = list(islice(feed, 1))[0]
+            # one query per source, one to read ahead in the source of the
+            # first droplet, plus its publishable and publication
+            self.assertEqual(len(connection.queries), len(self.publications) + 3)
+            query_count = len(connection.queries)
+            droplet.publishable
+            droplet.publication
+            self.assertEqual(len(connection.queries), query_count)
+        finally:
+            settings.DEBUG = False
+    
+    def test_dedupe(self):
+        # test object 1a is published to both 2a and 3a
+        publishable = TestModel1.objects.get(pk=1)
+        droplets = [droplet for droplet in Droplet.objects.get_feed(
+                self.publications)
+            if droplet.publishable == publishable]
+        self.assertEqual([droplet.pk for droplet in droplets], [3])
+        
+        droplets = [droplet for droplet in Droplet.objects.get_feed(
+                self.publications, dedupe=False)
+            if droplet.publishable == publishable]
+        self.assertEqual([droplet.pk for droplet in droplets], [3, 1])
+
+
+class FeedSnapshotsTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'droplets.json']
+    
+    def setUp(self):
+        self._original_snapshots = getattr(settings, 'GEYSER_FEED_SNAPSHOTS', None)
+        settings.GEYSER_FEED_SNAPSHOTS = {'size': 2}
+        reset_feed_snapshots()
+        cache.clear()
+        self.t1b = TestModel1.objects.get(pk=2)
+        self.t3a = TestModel3.objects.get(pk=1)
+    
+    def tearDown(self):
+        settings.GEYSER_FEED_SNAPSHOTS = self._original_snapshots
+        reset_feed_snapshots()
+        cache.clear()
+    
+    def assertRecent(self, publication):
+        self.assertEqual(Droplet.objects.get_recent(publication),
+            list(Droplet.objects.get_list(publications=publication)[:2]))
+    
+    def test_get_recent(self):
+        settings.DEBUG = True
+        reset_queries()
+        try:
+            self.assertRecent(self.t3a)
+            reset_queries()
+            droplets = Droplet.objects.get_recent(self.t3a)
+            # only the bulk fetch of the droplets and their related objects
+            self.assertEqual(len(connection.queries), NUM_RELATED_TYPES + 1)
+            self.assertEqual(len(droplets), 2)
+        finally:
+            settings.DEBUG = False
+    
+    def test_publish_unpublish(self):
+        self.assertRecent(self.t3a)
+        Droplet.objects.publish(self.t1b, [self.t3a])
+        self.assertEqual(get_feed_snapshots().get_ids(self.t3a)[0],
+            Droplet.objects.get_list(publications=self.t3a)[0].pk)
+        self.assertRecent(self.t3a)
+        
+        Droplet.objects.unpublish(self.t1b, [self.t3a])
+        self.assertRecent(self.t3a)
+        
+        Droplet.objects.publish_many([self.t1b], [self.t3a])
+        self.assertRecent(self.t3a)
+        Droplet.objects.unpublish_many([self.t1b], [self.t3a])
+        self.assertRecent(self.t3a)
+    
+    def test_discard(self):
+        snapshots = get_feed_snapshots()
+        key = snapshots._key(
+            ContentType.objects.get_for_model(TestModel3).id, self.t3a.pk)
+        snapshots.get_ids(self.t3a)
+        self.assertNotEqual(cache.get(key), None)
+        Droplet.objects.publish_many([self.t1b], [self.t3a])
+        self.assertEqual(cache.get(key), None)
+        snapshots.get_ids(self.t3a)
+        Droplet.objects.unpublish(self.t1b, [self.t3a])
+        self.assertEqual(cache.get(key), None)
+    
+    def test_stale(self):
+        self.assertRecent(self.t3a)
+        droplet = Droplet.objects.get_recent(self.t3a)[0]
+        Droplet.objects.filter(pk=droplet.pk).update(is_current=False)
+        self.assertFalse(droplet in Droplet.objects.get_recent(self.t3a))
+        self.assertRecent(self.t3a)
+        self.assertFalse(droplet.pk in get_feed_snapshots().get_ids(self.t3a))
+    
+    def test_future(self):
+        self.assertRecent(self.t3a)
+        droplet = Droplet.objects.publish(self.t1b, [self.t3a],
+            published=datetime.now() + timedelta(seconds=1))[0]
+        self.assertFalse(droplet in Droplet.objects.get_recent(self.t3a))
+        sleep(1)
+        self.assertEqual(Droplet.objects.get_recent(self.t3a)[0], droplet)
+        self.assertRecent(self.t3a)
+
+
+__all__ = ('FeedTest', 'FeedSnapshotsTest',)
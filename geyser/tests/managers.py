@@ -1,14 +1,20 @@
-from datetime import datetime
+from datetime import datetime, date, timedelta
 
 from django.core.exceptions import ValidationError, ImproperlyConfigured
 
 from django.conf import settings
 from django.db import connection, reset_queries
 from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
 
 from geyser.tests.base import GeyserTestCase
 from geyser.tests.testapp.models import TestModel1, TestModel2, TestModel3
-from geyser.models import Droplet
+from geyser import managers
+from geyser.managers import published_range
+from geyser.registry import reset_registry
+from geyser.models import Droplet, CurrentDroplet, ArchiveCount
+from geyser.signals import droplets_promoted
+from geyser.snapshot import PermissionSnapshot
 
 
 class ManagerGetListTest(GeyserTestCase):
@@ -107,6 +113,16 @@ class ManagerGetListTest(GeyserTestCase):
         day_27 = Droplet.objects.get_list(day=27)
         self.assertTrue(self.t2a_t3a in day_27)
         self.assertEqual(len(day_27), 1)
+        
+        #by date ranges
+        self.assertEqual(len(Droplet.objects.get_list(year=2010, month=6)), 2)
+        self.assertEqual(len(Droplet.objects.get_list(year=2010, month=6,
+            day=27)), 1)
+        self.assertEqual(len(Droplet.objects.get_list(year=2010, day=27)), 1)
+        self.assertEqual(len(Droplet.objects.get_list(year=2010, month=2,
+            day=30)), 0)
+        self.assertEqual(published_range(2009, 12),
+            (datetime(2009, 12, 1), datetime(2010, 1, 1)))
     
     def test_publishable_filter(self):
         #by pk
@@ -127,6 +143,265 @@ class ManagerGetListTest(GeyserTestCase):
         self.assertTrue(all(d.publishable.owner == user for d in user_pubs))
 
 
+class ManagerCurrentIndexTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'droplets.json']
+    
+    def setUp(self):
+        self._original_index = getattr(settings, 'GEYSER_CURRENT_INDEX', False)
+        settings.GEYSER_CURRENT_INDEX = True
+        CurrentDroplet.objects.rebuild()
+        self.t1a = TestModel1.objects.get(pk=1)
+        self.t2a = TestModel2.objects.get(pk=1)
+        self.t3a = TestModel3.objects.get(pk=1)
+        self.t3b = TestModel3.objects.get(pk=2)
+    
+    def tearDown(self):
+        settings.GEYSER_CURRENT_INDEX = self._original_index
+    
+    def test_rebuild(self):
+        self.assertEqual(CurrentDroplet.objects.count(),
+            Droplet.objects.filter(is_current=True).count())
+    
+    def test_get_list(self):
+        to_3a = Droplet.objects.get_list(publications=self.t3a)
+        self.assertEqual(len(to_3a), 2)
+        to_3b = Droplet.objects.get_list(publications=self.t3b)
+        self.assertEqual(len(to_3b), 0)
+        to_3b_future = Droplet.objects.get_list(publications=self.t3b,
+            include_future=True)
+        self.assertEqual(len(to_3b_future), 1)
+    
+    def test_publish_and_unpublish(self):
+        Droplet.objects.publish(self.t1a, self.t3a)
+        to_3a = Droplet.objects.get_list(publications=self.t3a)
+        self.assertEqual(len(to_3a), 2)
+        self.assertEqual(CurrentDroplet.objects.count(),
+            Droplet.objects.filter(is_current=True).count())
+        
+        Droplet.objects.unpublish(self.t1a, self.t3a)
+        to_3a = Droplet.objects.get_list(publications=self.t3a)
+        self.assertEqual(len(to_3a), 1)
+        self.assertEqual(CurrentDroplet.objects.count(),
+            Droplet.objects.filter(is_current=True).count())
+
+
+class ManagerSchedulingTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json']
+    
+    def setUp(self):
+        self._original_scheduling = getattr(settings,
+            'GEYSER_SCHEDULED_PUBLISHING', False)
+        settings.GEYSER_SCHEDULED_PUBLISHING = True
+        self._original_index = getattr(settings, 'GEYSER_CURRENT_INDEX', False)
+        self.t1a = TestModel1.objects.get(pk=1)
+        self.t1b = TestModel1.objects.get(pk=2)
+        self.t3a = TestModel3.objects.get(pk=1)
+        self.promoted = []
+        droplets_promoted.connect(self.record_promoted)
+    
+    def tearDown(self):
+        droplets_promoted.disconnect(self.record_promoted)
+        settings.GEYSER_SCHEDULED_PUBLISHING = self._original_scheduling
+        settings.GEYSER_CURRENT_INDEX = self._original_index
+    
+    def record_promoted(self, sender, **kwargs):
+        self.promoted.extend(kwargs['pks'])
+    
+    def assertPromotion(self):
+        future = datetime.now() + timedelta(days=1)
+        droplet = Droplet.objects.publish(self.t1a, self.t3a,
+            published=future)[0]
+        self.assertTrue(droplet.is_pending)
+        pending = Droplet.objects.publish_many([self.t1b], self.t3a,
+            published=future)[0]
+        self.assertTrue(pending.is_pending)
+        self.assertEqual(len(Droplet.objects.get_list(publications=self.t3a)), 0)
+        self.assertEqual(len(Droplet.objects.get_list(publications=self.t3a,
+            include_future=True)), 2)
+        
+        Droplet.objects.filter(pk__in=[droplet.pk, pending.pk]).update(
+            published=datetime.now() - timedelta(minutes=1))
+        self.assertEqual(len(Droplet.objects.get_list(publications=self.t3a)), 0)
+        self.assertEqual(Droplet.objects.promote_due(batch_size=1), 2)
+        self.assertEqual(sorted(self.promoted), sorted([droplet.pk, pending.pk]))
+        self.assertEqual(len(Droplet.objects.get_list(publications=self.t3a)), 2)
+        self.assertEqual(Droplet.objects.promote_due(), 0)
+    
+    def test_promote_due(self):
+        self.assertPromotion()
+    
+    def test_mark_pending(self):
+        settings.GEYSER_SCHEDULED_PUBLISHING = False
+        droplet = Droplet.objects.publish(self.t1a, self.t3a,
+            published=datetime.now() + timedelta(days=1))[0]
+        Droplet.objects.publish(self.t1b, self.t3a)
+        settings.GEYSER_SCHEDULED_PUBLISHING = True
+        self.assertEqual(len(Droplet.objects.get_list(publications=self.t3a)), 2)
+        self.assertEqual(Droplet.objects.mark_pending(batch_size=1), 1)
+        self.assertTrue(Droplet.objects.get(pk=droplet.pk).is_pending)
+        self.assertEqual(len(Droplet.objects.get_list(publications=self.t3a)), 1)
+        self.assertEqual(Droplet.objects.mark_pending(), 0)
+    
+    def test_promote_due_with_index(self):
+        settings.GEYSER_CURRENT_INDEX = True
+        self.assertPromotion()
+        self.assertEqual(CurrentDroplet.objects.count(), 2)
+
+
+class ManagerArchiveTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'droplets.json']
+    
+    def setUp(self):
+        self._original_archive = getattr(settings, 'GEYSER_ARCHIVE_COUNTS', False)
+        settings.GEYSER_ARCHIVE_COUNTS = True
+        ArchiveCount.objects.rebuild()
+        self.t1b = TestModel1.objects.get(pk=2)
+        self.t3a = TestModel3.objects.get(pk=1)
+        self.type1 = ContentType.objects.get_for_model(TestModel1)
+        self.type3 = ContentType.objects.get_for_model(TestModel3)
+    
+    def tearDown(self):
+        settings.GEYSER_ARCHIVE_COUNTS = self._original_archive
+    
+    def test_get_archive(self):
+        # the droplet published in 2112 is pending, so it is not counted
+        self.assertEqual(Droplet.objects.get_archive('year'), [
+            (date(2010, 1, 1), 3), (date(2009, 1, 1), 1)])
+        self.assertEqual(Droplet.objects.get_archive('month', year=2010), [
+            (date(2010, 6, 1), 2), (date(2010, 5, 1), 1)])
+        self.assertEqual(Droplet.objects.get_archive('day',
+                publications=self.t3a, year=2010, month=6),
+            [(date(2010, 6, 27), 1), (date(2010, 6, 5), 1)])
+        self.assertEqual(Droplet.objects.get_archive('day',
+                publications=self.t3a, publishable_models=TestModel1),
+            [(date(2010, 6, 5), 1)])
+        self.assertRaises(ValueError, Droplet.objects.get_archive, 'week')
+        self.assertRaises(ValueError, Droplet.objects.get_archive, 'm')
+        
+        settings.GEYSER_ARCHIVE_COUNTS = False
+        self.assertRaises(ImproperlyConfigured, Droplet.objects.get_archive)
+    
+    def test_publish_and_unpublish(self):
+        today = datetime.now().date()
+        this_month = [(date(today.year, today.month, 1), 1)]
+        Droplet.objects.publish(self.t1b, self.t3a)
+        self.assertEqual(Droplet.objects.get_archive(publications=self.t3a,
+            year=today.year), this_month)
+        Droplet.objects.unpublish(self.t1b, self.t3a)
+        self.assertEqual(Droplet.objects.get_archive(publications=self.t3a,
+            year=today.year), [])
+        
+        Droplet.objects.publish_many([self.t1b], self.t3a)
+        self.assertEqual(Droplet.objects.get_archive(publications=self.t3a,
+            year=today.year), this_month)
+        Droplet.objects.publish(self.t1b, self.t3a)
+        # the previous droplet is unpublished
+        self.assertEqual(Droplet.objects.get_archive(publications=self.t3a,
+            year=today.year), this_month)
+        Droplet.objects.unpublish_many([self.t1b], self.t3a)
+        self.assertEqual(Droplet.objects.get_archive(publications=self.t3a,
+            year=today.year), [])
+    
+    def test_future(self):
+        future = datetime.now() + timedelta(days=1)
+        droplet = Droplet.objects.publish(self.t1b, self.t3a,
+            published=future)[0]
+        self.assertTrue(droplet.is_pending)
+        self.assertEqual(Droplet.objects.get_archive(publications=self.t3a,
+            year=future.year, month=future.month), [])
+        
+        Droplet.objects.filter(pk=droplet.pk).update(
+            published=datetime.now() - timedelta(minutes=1))
+        Droplet.objects.promote_due()
+        today = datetime.now().date()
+        self.assertEqual(Droplet.objects.get_archive(publications=self.t3a,
+            year=today.year), [(date(today.year, today.month, 1), 1)])
+        Droplet.objects.unpublish(self.t1b, self.t3a)
+        self.assertEqual(Droplet.objects.get_archive(publications=self.t3a,
+            year=today.year), [])
+        
+        Droplet.objects.publish_many([self.t1b], self.t3a, published=future)
+        Droplet.objects.unpublish(self.t1b, self.t3a)
+        self.assertEqual(Droplet.objects.get_archive(publications=self.t3a,
+            year=future.year), [])
+    
+    def test_with_index(self):
+        # droplet 7, published in 2112, is pending and so is not indexed
+        original_index = getattr(settings, 'GEYSER_CURRENT_INDEX', False)
+        settings.GEYSER_CURRENT_INDEX = True
+        CurrentDroplet.objects.rebuild()
+        try:
+            t3b = TestModel3.objects.get(pk=2)
+            self.assertEqual(len(Droplet.objects.get_list(publications=t3b)), 0)
+            self.assertEqual(len(Droplet.objects.get_list(publications=t3b,
+                include_future=True)), 1)
+            Droplet.objects.filter(is_pending=True).update(
+                published=datetime.now() - timedelta(minutes=1))
+            self.assertEqual(len(Droplet.objects.get_list(publications=t3b)), 1)
+        finally:
+            settings.GEYSER_CURRENT_INDEX = original_index
+    
+    def test_record_concurrently(self):
+        # a count created elsewhere between the update and the insert is
+        # updated instead
+        filter = ArchiveCount.objects.filter
+        missed = set()
+        def filter_missing(**lookup):
+            key = tuple(sorted(lookup.items()))
+            if key in missed:
+                return filter(**lookup)
+            missed.add(key)
+            return filter(pk__isnull=True)
+        entry = (self.type3.id, self.t3a.pk, self.type1.id,
+            datetime(2001, 1, 1))
+        ArchiveCount.objects.record([entry], 1)
+        ArchiveCount.objects.filter = filter_missing
+        try:
+            ArchiveCount.objects.record([entry], 1)
+        finally:
+            del ArchiveCount.objects.filter
+        self.assertEqual(Droplet.objects.get_archive('day', year=2001),
+            [(date(2001, 1, 1), 2)])
+
+
+class ManagerOrphansTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'droplets.json']
+    
+    def setUp(self):
+        TestModel3.objects.get(pk=1).delete()
+        self.t3_type = ContentType.objects.get_for_model(TestModel3)
+    
+    def test_get_orphans(self):
+        orphans = dict([((field_name, content_type),
+                list(droplets.order_by('pk')))
+            for (field_name, content_type, droplets)
+            in Droplet.objects.get_orphans()])
+        self.assertEqual([droplet.pk for droplet in
+            orphans[('publication', self.t3_type)]], [3, 4])
+        self.assertEqual(sum(orphans.values(), []),
+            list(Droplet.objects.filter(pk__in=[3, 4]).order_by('pk')
+                .on_dangling('none')))
+    
+    def test_unpublish(self):
+        results = Droplet.objects.remove_orphans()
+        self.assertTrue(('publication', self.t3_type, 2) in results)
+        self.assertEqual(Droplet.objects.filter(pk__in=[3, 4],
+            is_current=True).count(), 0)
+        self.assertEqual(Droplet.objects.count(), 7)
+        # the droplets are no longer current, so none are un-published again
+        self.assertTrue(('publication', self.t3_type, 0) in
+            Droplet.objects.remove_orphans())
+    
+    def test_delete(self):
+        Droplet.objects.remove_orphans(delete=True, batch_size=1)
+        self.assertEqual(list(Droplet.objects.values_list('pk', flat=True)
+            .order_by('pk')), [1, 2, 5, 6, 7])
+        # droplet 4 was the first publishing of 5, 6 and 7
+        self.assertEqual(list(Droplet.objects.filter(pk__in=[5, 6, 7])
+            .values_list('first', flat=True)), [5, 5, 5])
+        self.assertEqual(Droplet.objects.get_orphans()[0][2].count(), 0)
+
+
 class ManagerSelectRelatedTest(GeyserTestCase):
     fixtures = ['users.json', 'objects.json', 'droplets.json']
     
@@ -145,6 +420,14 @@ class ManagerSelectRelatedTest(GeyserTestCase):
             droplet.publishable
             droplet.publication
         self.assertEqual(len(connection.queries), query_count)
+    
+    def test_lean(self):
+        t1_pubs = list(Droplet.objects.get_list(publishable_models=TestModel1,
+            lean=True))
+        self.assertEqual(len(connection.queries), 1)
+        self.assertFalse('JOIN' in connection.queries[0]['sql'])
+        self.assertEqual(t1_pubs,
+            list(Droplet.objects.get_list(publishable_models=TestModel1)))
 
 
 class ManagerPermissionsTest(GeyserTestCase):
@@ -209,6 +492,43 @@ class ManagerPermissionsTest(GeyserTestCase):
         self.assertEqual(len(allowed), 1)
 
 
+class ManagerAllowedKeysTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'permissions.json']
+    
+    def setUp(self):
+        self.t1a = TestModel1.objects.get(pk=1)
+        self.t2a = TestModel2.objects.get(pk=1)
+        self.t3a = TestModel3.objects.get(pk=1)
+        self.t3b = TestModel3.objects.get(pk=2)
+    
+    def test_lazy(self):
+        settings.DEBUG = True
+        reset_queries()
+        allowed = Droplet.objects.get_allowed_publication_keys(self.t1a)
+        self.assertTrue(self.t2a in allowed)
+        self.assertTrue(self.t3b in allowed)
+        type3 = ContentType.objects.get_for_model(TestModel3)
+        self.assertTrue((type3.id, 2) in allowed)
+        self.assertFalse(self.t1a in allowed)
+        self.assertFalse(any('testmodel' in q['sql'] for q in connection.queries))
+        settings.DEBUG = False
+        self.assertEqual(list(allowed), [self.t2a, self.t3a, self.t3b])
+    
+    def test_with_publication_object(self):
+        user = User.objects.get(pk=10)
+        allowed = Droplet.objects.get_allowed_publication_keys(self.t1a, user)
+        self.assertTrue(self.t3a in allowed)
+        self.assertFalse(self.t3b in allowed)
+        self.assertFalse(self.t2a in allowed)
+        self.assertEqual(allowed.filter([self.t2a, self.t3a, self.t3b]),
+            [self.t3a])
+    
+    def test_no_perm(self):
+        user = User.objects.get(pk=4)
+        allowed = Droplet.objects.get_allowed_publication_keys(self.t1a, user)
+        self.assertEqual(allowed, None)
+
+
 class ManagerPublishTest(GeyserTestCase):
     fixtures = ['users.json', 'objects.json', 'permissions.json']
     
@@ -254,6 +574,108 @@ class ManagerPublishTest(GeyserTestCase):
         self.assertEqual(droplet.published, datetime(2010, 7, 1))
 
 
+class ManagerPublishManyTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'permissions.json']
+    
+    def setUp(self):
+        self.t1a = TestModel1.objects.get(pk=1)
+        self.t1b = TestModel1.objects.get(pk=2)
+        self.t2a = TestModel2.objects.get(pk=1)
+        self.t3a = TestModel3.objects.get(pk=1)
+        self.t3b = TestModel3.objects.get(pk=2)
+        self.user = User.objects.get(pk=2)
+    
+    def test_publish_many(self):
+        published = Droplet.objects.publish_many([self.t1a, self.t1b],
+            [self.t2a, self.t3a], published_by=self.user)
+        self.assertEqual(len(published), 4)
+        droplets = Droplet.objects.get_list()
+        self.assertEqual(len(droplets), 4)
+        for droplet in droplets:
+            self.assertTrue(droplet in published)
+            self.assertEqual(droplet.published_by, self.user)
+            self.assertEqual(droplet.first.publishable, droplet.publishable)
+            self.assertEqual(droplet.first.first, droplet.first)
+        self.assertEqual(len(set(d.first_id for d in droplets)), 2)
+    
+    def test_publish_many_again(self):
+        droplet = Droplet.objects.publish(self.t1a, self.t2a)[0]
+        Droplet.objects.publish_many([self.t1a, self.t1b], self.t2a)
+        droplets = Droplet.objects.get_list()
+        self.assertEqual(len(droplets), 2)
+        self.assertFalse(droplet in droplets)
+        self.assertFalse(Droplet.objects.get(pk=droplet.pk).is_current)
+        t1a_droplet = Droplet.objects.get_list(publishable=self.t1a)[0]
+        self.assertEqual(t1a_droplet.first, droplet)
+    
+    def test_publish_many_duplicates(self):
+        Droplet.objects.publish_many([self.t1a, self.t1a],
+            [self.t3a, self.t3a, self.t3b])
+        droplets = Droplet.objects.get_list()
+        self.assertEqual(sorted(d.publication_id for d in droplets), [1, 2])
+    
+    def test_publish_many_as_user(self):
+        Droplet.objects.publish_many([self.t1a, self.t1b], as_user=self.user)
+        droplets = Droplet.objects.all()
+        self.assertEqual(len(droplets), 4)
+        self.assertFalse(any(d.publication == self.t2a for d in droplets))
+        self.assertTrue(all(d.published_by == self.user for d in droplets))
+    
+    def test_publish_many_queries(self):
+        settings.DEBUG = True
+        reset_queries()
+        Droplet.objects.publish_many([self.t1a, self.t1b], [self.t2a, self.t3a])
+        query_count = len(connection.queries)
+        Droplet.objects.all().delete()
+        for i in range(5):
+            TestModel1.objects.create(name='t1 %s' % i, owner=self.user)
+        t1_all = list(TestModel1.objects.all())
+        reset_queries()
+        Droplet.objects.publish_many(t1_all, [self.t2a, self.t3a])
+        self.assertEqual(len(connection.queries), query_count)
+        settings.DEBUG = False
+    
+    def test_publish_many_queries_as_user(self):
+        settings.DEBUG = True
+        try:
+            counts = []
+            for i in range(2):
+                reset_queries()
+                Droplet.objects.publish_many(TestModel1.objects.all(),
+                    as_user=PermissionSnapshot(User.objects.get(pk=2)))
+                counts.append(len(connection.queries))
+                TestModel1.objects.create(name='t1 %s' % i, owner=self.user)
+        finally:
+            settings.DEBUG = False
+        self.assertEqual(counts[0], counts[1])
+    
+    def test_publish_many_concurrent(self):
+        # a droplet inserted by another publishing while publish_many runs
+        # must not be taken for one of the new droplets
+        other = Droplet(publishable=self.t1a, publication=self.t3b,
+            published=datetime(2010, 1, 1))
+        def insert_other(objs, using):
+            managers.bulk_insert = bulk_insert
+            bulk_insert([other], using)
+            bulk_insert(objs, using)
+        bulk_insert = managers.bulk_insert
+        managers.bulk_insert = insert_other
+        try:
+            published = Droplet.objects.publish_many([self.t1a], [self.t3a])
+        finally:
+            managers.bulk_insert = bulk_insert
+        self.assertEqual([d.publication for d in published], [self.t3a])
+        self.assertEqual(published[0].first, published[0])
+        other = Droplet.objects.get(publication_id=self.t3b.pk)
+        self.assertEqual(other.first_id, None)
+    
+    def test_publish_many_unique_for_date(self):
+        t2b = TestModel2.objects.create(name=self.t2a.name)
+        self.assertRaises(ValidationError, Droplet.objects.publish_many,
+            [self.t2a, t2b], self.t3a)
+        self.assertEqual(Droplet.objects.count(), 0)
+
+
 class ManagerUniquenessTest(GeyserTestCase):
     def setUp(self):
         self.t2a = TestModel2.objects.create(name='an object')
@@ -272,6 +694,53 @@ class ManagerUniquenessTest(GeyserTestCase):
         )
         da = Droplet.objects.publish(publishable=self.t2a)
         Droplet.objects.publish(publishable=self.t2b)
+    
+    def test_get_unique_conflicts(self):
+        Droplet.objects.create(publishable=self.t2a, publication=self.t3,
+            published=datetime(2010, 7, 21, 12))
+        t2c = TestModel2.objects.create(name='another object')
+        new = [Droplet(publishable=publishable, publication=self.t3,
+                published=published)
+            for (publishable, published) in [
+                (self.t2b, datetime(2010, 7, 21, 23, 59)),
+                (self.t2b, datetime(2010, 7, 22)),
+                (t2c, datetime(2010, 7, 20)),
+                (t2c, datetime(2010, 7, 20, 8)),
+            ]]
+        settings.DEBUG = True
+        reset_queries()
+        try:
+            conflicts = Droplet.objects.get_unique_conflicts(new)
+            # one query for the names and one for existing first publishings
+            self.assertEqual(len(connection.queries), 2)
+        finally:
+            settings.DEBUG = False
+        self.assertEqual(conflicts, [(new[0], 'name'), (new[3], 'name')])
+        self.assertRaises(ValidationError,
+            Droplet.objects.validate_unique_for_date, new)
+        Droplet.objects.validate_unique_for_date(new[1:3])
+    
+    def test_foreign_key(self):
+        options = settings.GEYSER_PUBLISHABLES['testapp.testmodel1']
+        options['unique_for_date'] = ('owner',)
+        reset_registry()
+        try:
+            owner = User.objects.create(username='owner')
+            t1a = TestModel1.objects.create(name='one', owner=owner)
+            t1b = TestModel1.objects.create(name='two', owner=owner)
+            Droplet.objects.publish(publishable=t1a)
+            # the owner of t1b is loaded from the database for the first
+            # droplet, and taken from the cached publishable for the second
+            new = [Droplet(publishable=t1b, publication=self.t3,
+                published=datetime.now()) for i in range(2)]
+            new[1].publishable = t1b
+            self.assertEqual(Droplet.objects.get_unique_conflicts(new[1:]),
+                [(new[1], 'owner')])
+            self.assertEqual(Droplet.objects.get_unique_conflicts(new[:1]),
+                [(new[0], 'owner')])
+        finally:
+            del options['unique_for_date']
+            reset_registry()
 
 
 class ManagerUnpublishTest(GeyserTestCase):
@@ -307,11 +776,57 @@ class ManagerUnpublishTest(GeyserTestCase):
         self.assertEqual(self.t1a_t3a.updated_by, self.user)
 
 
+class ManagerUnpublishManyTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'droplets.json', 'permissions.json']
+    
+    def setUp(self):
+        self.t1a = TestModel1.objects.get(pk=1)
+        self.t1b = TestModel1.objects.get(pk=2)
+        self.t2a = TestModel2.objects.get(pk=1)
+        self.t3a = TestModel3.objects.get(pk=1)
+        self.user = User.objects.get(pk=2)
+    
+    def test_unpublish_many(self):
+        count = Droplet.objects.unpublish_many([self.t1a, self.t1b, self.t2a])
+        self.assertEqual(count, 4)
+        self.assertEqual(len(Droplet.objects.get_list()), 0)
+        self.assertEqual(
+            len(Droplet.objects.get_list(include_future=True)), 1)
+    
+    def test_unpublish_many_queryset(self):
+        count = Droplet.objects.unpublish_many(TestModel1.objects.all(),
+            self.t2a)
+        self.assertEqual(count, 2)
+        droplets = Droplet.objects.get_list()
+        self.assertEqual(len(droplets), 2)
+        self.assertFalse(any(d.publication == self.t2a for d in droplets))
+    
+    def test_unpublish_many_as_user(self):
+        count = Droplet.objects.unpublish_many(TestModel1.objects.all(),
+            as_user=self.user)
+        self.assertEqual(count, 1)
+        self.assertEqual(Droplet.objects.get(pk=3).updated_by, self.user)
+        droplets = Droplet.objects.get_list(publishable_models=TestModel1)
+        self.assertEqual(len(droplets), 2)
+    
+    def test_unpublish_many_no_perm(self):
+        user = User.objects.get(pk=4)
+        count = Droplet.objects.unpublish_many([self.t1a], as_user=user)
+        self.assertEqual(count, 0)
+
+
 __all__ = (
     'ManagerGetListTest',
+    'ManagerCurrentIndexTest',
+    'ManagerArchiveTest',
+    'ManagerOrphansTest',
     'ManagerSelectRelatedTest',
     'ManagerPermissionsTest',
+    'ManagerAllowedKeysTest',
     'ManagerPublishTest',
+    'ManagerPublishManyTest',
+    'ManagerSchedulingTest',
     'ManagerUniquenessTest',
     'ManagerUnpublishTest',
+    'ManagerUnpublishManyTest',
 )
\ No newline at end of file
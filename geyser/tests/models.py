@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.db import connection, reset_queries
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
 
@@ -57,6 +59,25 @@ class ModelTest(GeyserTestCase):
         self.assertEqual(droplet2.first, droplet1.first)
         
         self.assertEqual(droplet2.first.published_by, self.user)
+    
+    def test_first_publish_queries(self):
+        droplet = Droplet(publishable=self.t1, publication=self.t2)
+        settings.DEBUG = True
+        reset_queries()
+        try:
+            droplet.save()
+            saves = [query['sql'] for query in connection.queries
+                if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        finally:
+            settings.DEBUG = False
+        # the INSERT, the UPDATE unpublishing previous droplets, and one
+        # UPDATE pointing the droplet to itself, rather than a second save
+        self.assertEqual(len(saves), 3)
+        self.assertTrue('first_id' in saves[-1])
+        self.assertFalse('publishable_id' in saves[-1])
+        self.assertEqual(Droplet.objects.get(pk=droplet.pk).first_id,
+            droplet.pk)
+        self.assertEqual(droplet.first, droplet)
 
 
 __all__ = ('ModelTest',)
\ No newline at end of file
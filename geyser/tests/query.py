@@ -1,11 +1,20 @@
+import os
+import sqlite3
+import tempfile
+import threading
 from timeit import default_timer as now
 
 from django.conf import settings
-from django.db import connection, reset_queries
+from django.db import connection, connections, reset_queries, \
+    DEFAULT_DB_ALIAS
+from django.core.exceptions import FieldError
 
-from geyser.query import GenericQuerySet
+from geyser.query import GenericQuerySet, WorkerPool, get_worker_pool
+from geyser.registry import reset_registry
 from geyser.models import Droplet
-from geyser.tests.base import GeyserTestCase, NUM_RELATED_TYPES
+from geyser.tests.base import GeyserTestCase, GeyserTransactionTestCase, \
+    NUM_RELATED_TYPES
+from geyser.signals import dangling_references
 from geyser.tests.testapp.models import TestModel1
 
 
@@ -77,6 +86,240 @@ class QuerySetTestCase(GeyserTestCase):
             droplet.publishable
             droplet.publication
         self.assertEqual(len(connection.queries), query_count)
+    
+    def test_iterator_generic(self):
+        all = GenericQuerySet(Droplet).select_related_generic()
+        droplets = list(all.iterator_generic(chunk_size=2))
+        self.assertEqual(len(droplets), Droplet.objects.count())
+        self.assertEqual(all._result_cache, None)
+        query_count = len(connection.queries)
+        
+        for droplet in droplets:
+            droplet.publishable
+            droplet.publication
+        self.assertEqual(len(connection.queries), query_count)
+    
+    def test_iterator_generic_chunks(self):
+        # each chunk is a separate query, by keyset for the default ordering
+        # and by offset for others, and the order is kept
+        for droplets in (GenericQuerySet(Droplet),
+                GenericQuerySet(Droplet).order_by('publication_id', 'pk'),
+                GenericQuerySet(Droplet).order_by('pk')[1:4],
+                GenericQuerySet(Droplet).reverse()):
+            reset_queries()
+            chunked = list(droplets.iterator_generic(chunk_size=2))
+            self.assertEqual(len(connection.queries),
+                len(chunked) // 2 + 1)
+            self.assertEqual(chunked, list(droplets))
+        
+        # without an ordering, offsets are taken in order of primary key
+        unordered = GenericQuerySet(Droplet).order_by()
+        self.assertEqual([droplet.pk for droplet
+                in unordered.iterator_generic(chunk_size=2)],
+            list(Droplet.objects.values_list('pk', flat=True).order_by('pk')))
+        self.assertTrue('ORDER BY' in connection.queries[-1]['sql'])
+    
+    def test_select_related_generic_options(self):
+        all = list(GenericQuerySet(Droplet).select_related_generic(
+            publishable={TestModel1: ['owner']}))
+        query_count = len(connection.queries)
+        for droplet in all:
+            if isinstance(droplet.publishable, TestModel1):
+                droplet.publishable.owner
+            droplet.publication
+        self.assertEqual(len(connection.queries), query_count)
+        
+        reset_queries()
+        all = list(GenericQuerySet(Droplet).select_related_generic(
+            publishable={'testapp.testmodel1': {'only': ['name']}},
+            publication={'testapp.testmodel2': {'defer': ['name']}}))
+        # testmodel2 is fetched separately as a publishable and a publication
+        self.assertEqual(len(connection.queries), NUM_RELATED_TYPES + 2)
+        query_count = len(connection.queries)
+        for droplet in all:
+            droplet.publishable.name
+        self.assertEqual(len(connection.queries), query_count)
+        
+        self.assertRaises(FieldError,
+            GenericQuerySet(Droplet).select_related_generic, first={})
+    
+    def test_registry_fetch_options(self):
+        settings.GEYSER_PUBLISHABLES['testapp.testmodel1']['defer'] = ('name',)
+        reset_registry()
+        try:
+            all = list(GenericQuerySet(Droplet).select_related_generic())
+            query_count = len(connection.queries)
+            for droplet in all:
+                if isinstance(droplet.publishable, TestModel1):
+                    self.assertEqual(droplet.publishable._meta.proxy_for_model,
+                        TestModel1)
+                    # deferred fields are loaded separately
+                    droplet.publishable.name
+            self.assertTrue(len(connection.queries) > query_count)
+            
+            reset_queries()
+            all = list(GenericQuerySet(Droplet).select_related_generic(
+                publishable={'testapp.testmodel1': {'defer': ()}}))
+            query_count = len(connection.queries)
+            for droplet in all:
+                droplet.publishable.name
+            self.assertEqual(len(connection.queries), query_count)
+        finally:
+            del settings.GEYSER_PUBLISHABLES['testapp.testmodel1']['defer']
+            reset_registry()
+    
+    def test_parallel_generic(self):
+        expected = [(droplet.publishable, droplet.publication) for droplet in
+            GenericQuerySet(Droplet).select_related_generic()]
+        reset_queries()
+        all = GenericQuerySet(Droplet).select_related_generic().all() \
+            .parallel_generic()
+        # the in-memory test database can't be shared, so this is serial (see
+        # ParallelGenericTest for the threaded fetch)
+        self.assertEqual([(droplet.publishable, droplet.publication)
+            for droplet in all], expected)
+        self.assertEqual(len(connection.queries), NUM_RELATED_TYPES + 1)
+        self.assertEqual(len(all.generic_timings), NUM_RELATED_TYPES)
+    
+    def test_worker_pool(self):
+        pool = WorkerPool(3)
+        threads = set()
+        def call(n):
+            def function():
+                threads.add(threading.current_thread())
+                return n * 2
+            return function
+        self.assertEqual(pool.map([call(n) for n in range(10)]),
+            [n * 2 for n in range(10)])
+        self.assertEqual(pool.map([call(n) for n in range(10)]),
+            [n * 2 for n in range(10)])
+        # the same threads are used for each call
+        self.assertTrue(len(threads) <= 3)
+        self.assertFalse(threading.current_thread() in threads)
+        
+        def fail():
+            raise KeyError('failed')
+        self.assertRaises(KeyError, pool.map, [call(1), fail])
+        # a function running in the pool can use it too
+        self.assertEqual(pool.map([lambda: pool.map([call(1), call(2)])]),
+            [[2, 4]])
+    
+    def test_dangling_references(self):
+        TestModel1.objects.get(pk=2).delete()
+        references = []
+        def record(sender, **kwargs):
+            references.append(kwargs['references'])
+        dangling_references.connect(record)
+        try:
+            all = GenericQuerySet(Droplet).select_related_generic()
+            self.assertRaises(TestModel1.DoesNotExist, list, all)
+            
+            droplets = list(all.on_dangling('skip'))
+            self.assertEqual(len(droplets), Droplet.objects.count() - 1)
+            self.assertFalse(2 in [droplet.pk for droplet in droplets])
+            
+            droplets = list(all.on_dangling('none').filter(pk__in=[1, 2])
+                .order_by('pk'))
+            self.assertEqual([droplet.publishable for droplet in droplets],
+                [TestModel1.objects.get(pk=1), None])
+            self.assertTrue(droplets[1].publication is not None)
+            
+            self.assertEqual(len(references), 3)
+            self.assertEqual(references[0].values(), [set([2])])
+        finally:
+            dangling_references.disconnect(record)
+        
+        self.assertRaises(ValueError, all.on_dangling, 'ignore')
+    
+    def test_keyset_page(self):
+        expected = list(Droplet.objects.order_by('-published', '-id'))
+        all = GenericQuerySet(Droplet).select_related_generic()
+        pages = []
+        cursor = None
+        while True:
+            reset_queries()
+            (page, cursor) = all.keyset_page(cursor, per_page=2)
+            self.assertTrue(len(page) <= 2)
+            for droplet in page:
+                droplet.publishable
+                droplet.publication
+            self.assertTrue(len(connection.queries) <= NUM_RELATED_TYPES + 1)
+            pages.append(page)
+            if cursor is None:
+                break
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(len(pages), (len(expected) + 1) // 2)
+        
+        self.assertRaises(ValueError, all.keyset_page, 'not a cursor')
+    
+    def test_get_page(self):
+        (page, cursor) = Droplet.objects.get_page(per_page=1)
+        self.assertEqual(page, list(Droplet.objects.get_list()[:1]))
+        (page, cursor) = Droplet.objects.get_page(cursor, per_page=100)
+        self.assertEqual(page, list(Droplet.objects.get_list()[1:]))
+        self.assertEqual(cursor, None)
+
+
+class ParallelGenericTest(GeyserTransactionTestCase):
+    """
+    Fetches generically related objects in threads. An in-memory SQLite test
+    database can't be shared between threads, so it is copied to a file.
+    
+    """
+    
+    fixtures = ['users.json', 'objects.json', 'droplets.json']
+    
+    def setUp(self):
+        self.alias = DEFAULT_DB_ALIAS
+        self.path = None
+        if connection.settings_dict['ENGINE'].endswith('sqlite3'):
+            (fd, self.path) = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+            connection.cursor()
+            copy = sqlite3.connect(self.path)
+            copy.executescript('\n'.join(connection.connection.iterdump()))
+            copy.close()
+            self.alias = 'geyser_parallel'
+            connections.databases[self.alias] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': self.path,
+            }
+    
+    def tearDown(self):
+        if self.path is not None:
+            connections[self.alias].close()
+            del connections._connections[self.alias]
+            del connections.databases[self.alias]
+            os.remove(self.path)
+    
+    def test_parallel_generic(self):
+        threads = []
+        fetch_generic = GenericQuerySet._fetch_generic
+        def record_thread(queryset, *args, **kwargs):
+            threads.append(threading.current_thread())
+            return fetch_generic(queryset, *args, **kwargs)
+        GenericQuerySet._fetch_generic = record_thread
+        try:
+            all = GenericQuerySet(Droplet).using(self.alias) \
+                .select_related_generic()
+            expected = [(droplet.publishable, droplet.publication)
+                for droplet in all]
+            self.assertEqual(set(threads), set([threading.current_thread()]))
+            
+            del threads[:]
+            all = all.parallel_generic()
+            self.assertEqual([(droplet.publishable, droplet.publication)
+                for droplet in all], expected)
+            self.assertEqual([(droplet.publishable, droplet.publication)
+                for droplet in all.all()], expected)
+        finally:
+            GenericQuerySet._fetch_generic = fetch_generic
+        self.assertEqual(len(threads), NUM_RELATED_TYPES * 2)
+        # the fetches ran in the worker pool, which keeps its threads
+        self.assertTrue(set(threads) <= set(get_worker_pool()._threads))
+        self.assertEqual(len(all.generic_timings), NUM_RELATED_TYPES)
+        self.assertEqual(Droplet.objects.using(self.alias).count(),
+            len(expected))
 
 
 class QuerySetTimeTestCase(GeyserTestCase):
@@ -115,4 +358,4 @@ class QuerySetTimeTestCase(GeyserTestCase):
         self.assertTrue(ratio <= TARGET_RATIO)
 
 
-__all__ = ('QuerySetTestCase', 'QuerySetTimeTestCase',)
\ No newline at end of file
+__all__ = ('QuerySetTestCase', 'ParallelGenericTest', 'QuerySetTimeTestCase',)
\ No newline at end of file
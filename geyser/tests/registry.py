@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.db import connection, reset_queries
+from django.contrib.contenttypes.models import ContentType
+
+from geyser.registry import get_registry, reset_registry
+from geyser.tests.base import GeyserTestCase
+from geyser.tests.testapp.models import TestModel1, TestModel2, TestModel3
+
+
+class RegistryTest(GeyserTestCase):
+    def test_lookups(self):
+        registry = get_registry()
+        self.assertEqual(len(registry), 2)
+        options = registry.get(TestModel1)
+        self.assertEqual(options.app_model, 'testapp.testmodel1')
+        self.assertEqual(options.model, TestModel1)
+        self.assertEqual(options.auto_perms, ('owner',))
+        self.assertEqual(options.unique_for_date, ())
+        self.assertEqual([m for (s, m) in options.publish_to],
+            [TestModel2, TestModel3])
+        self.assertEqual(registry.get(TestModel2(name='x')).unique_for_date,
+            ('name',))
+        self.assertEqual(registry.get('testapp.testmodel2').model, TestModel2)
+        self.assertEqual(registry.get(TestModel3), None)
+        
+        t1_type = ContentType.objects.get_for_model(TestModel1)
+        self.assertEqual(registry.get_for_content_type(t1_type), options)
+        self.assertEqual(registry.get_for_content_type(t1_type.id), options)
+        
+        self.assertTrue(registry.is_publication(TestModel3))
+        self.assertFalse(registry.is_publication(TestModel1))
+        self.assertTrue(registry.is_registered(TestModel3))
+    
+    def test_no_queries(self):
+        registry = get_registry()
+        registry.get_for_content_type(1)
+        settings.DEBUG = True
+        reset_queries()
+        registry.get(TestModel1).publish_to_types
+        registry.get_for_content_type(1)
+        self.assertEqual(len(connection.queries), 0)
+        settings.DEBUG = False
+    
+    def test_reset(self):
+        registry = get_registry()
+        self.assertTrue(get_registry() is registry)
+        reset_registry()
+        self.assertFalse(get_registry() is registry)
+
+
+__all__ = ('RegistryTest',)
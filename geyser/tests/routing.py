@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import router, DEFAULT_DB_ALIAS
+from django.http import HttpRequest, HttpResponse
+
+from geyser.models import Droplet
+from geyser.routing import pin_writes, unpin_writes, is_pinned, get_read_db, \
+    ReadYourWritesMiddleware, PINNED_COOKIE
+from geyser.tests.base import GeyserTestCase
+from geyser.tests.testapp.models import TestModel1, TestModel2, TestModel3
+
+
+class RecordingRouter(object):
+    """Sends everything to the default database, recording each choice."""
+    
+    def __init__(self):
+        self.reads = []
+        self.writes = []
+    
+    def db_for_read(self, model, **hints):
+        self.reads.append((model, hints))
+        return DEFAULT_DB_ALIAS
+    
+    def db_for_write(self, model, **hints):
+        self.writes.append((model, hints))
+        return DEFAULT_DB_ALIAS
+
+
+class RoutingTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'droplets.json']
+    
+    def setUp(self):
+        self._original_routers = router.routers
+        self.router = RecordingRouter()
+        router.routers = [self.router]
+        self._original_pinning = getattr(settings, 'GEYSER_READ_YOUR_WRITES',
+            None)
+        settings.GEYSER_READ_YOUR_WRITES = 60
+        unpin_writes()
+    
+    def tearDown(self):
+        router.routers = self._original_routers
+        settings.GEYSER_READ_YOUR_WRITES = self._original_pinning
+        unpin_writes()
+    
+    def test_pinning(self):
+        get_read_db(TestModel1)
+        self.assertEqual(len(self.router.reads), 1)
+        pin_writes()
+        self.assertTrue(is_pinned())
+        get_read_db(TestModel1)
+        self.assertEqual(len(self.router.reads), 1)
+        self.assertEqual(self.router.writes, [(TestModel1, {})])
+        unpin_writes()
+        self.assertFalse(is_pinned())
+        
+        settings.GEYSER_READ_YOUR_WRITES = None
+        pin_writes()
+        self.assertFalse(is_pinned())
+    
+    def test_pinned_after_publishing(self):
+        t1 = TestModel1.objects.get(pk=1)
+        t2 = TestModel2.objects.get(pk=1)
+        self.assertFalse(is_pinned())
+        Droplet.objects.publish(t1, t2)
+        self.assertTrue(is_pinned())
+        unpin_writes()
+        Droplet.objects.unpublish_many([t1], t2)
+        self.assertTrue(is_pinned())
+        
+        settings.GEYSER_READ_YOUR_WRITES = None
+        unpin_writes()
+        Droplet.objects.publish_many([t1], [t2])
+        self.assertFalse(is_pinned())
+    
+    def test_middleware(self):
+        middleware = ReadYourWritesMiddleware()
+        request = HttpRequest()
+        middleware.process_request(request)
+        self.assertFalse(is_pinned())
+        Droplet.objects.publish(TestModel1.objects.get(pk=1),
+            TestModel2.objects.get(pk=1))
+        response = middleware.process_response(request, HttpResponse())
+        self.assertFalse(is_pinned())
+        
+        # the user's next request is pinned, other users' are not
+        request = HttpRequest()
+        request.COOKIES[PINNED_COOKIE] = response.cookies[PINNED_COOKIE].value
+        middleware.process_request(request)
+        self.assertTrue(is_pinned())
+        response = middleware.process_response(request, HttpResponse())
+        self.assertFalse(PINNED_COOKIE in response.cookies)
+        middleware.process_request(HttpRequest())
+        self.assertFalse(is_pinned())
+    
+    def test_request_finished(self):
+        pin_writes()
+        request_finished.send(sender=self.__class__)
+        self.assertFalse(is_pinned())
+    
+    def test_related_routing(self):
+        droplets = list(Droplet.objects.all())
+        routed = [(model, hints['instance']) for (model, hints)
+            in self.router.reads if 'instance' in hints]
+        self.assertEqual(set([model for (model, instance) in routed]),
+            set([TestModel1, TestModel2, TestModel3]))
+        self.assertTrue(routed[0][1] in droplets)
+        
+        self.router.reads = []
+        list(Droplet.objects.all().using_generic(DEFAULT_DB_ALIAS))
+        self.assertEqual([model for (model, hints) in self.router.reads],
+            [Droplet])
+        
+        pin_writes()
+        self.router.reads = []
+        list(Droplet.objects.all())
+        self.assertEqual(self.router.reads, [])
+
+
+__all__ = ('RoutingTest',)
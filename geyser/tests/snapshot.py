@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.db import connection, reset_queries
+from django.contrib.auth.models import User
+
+from geyser.models import Droplet
+from geyser.snapshot import PermissionSnapshot
+from geyser.tests.base import GeyserTestCase
+from geyser.tests.testapp.models import TestModel1, TestModel2, TestModel3
+
+
+class PublishToBackend(object):
+    """Grants every user publishing to `TestModel2` and of `TestModel3`."""
+    
+    supports_object_permissions = True
+    
+    def authenticate(self, **kwargs):
+        return None
+    
+    def has_perm(self, user, perm, obj=None):
+        if obj is not None:
+            return isinstance(obj, TestModel3)
+        return perm == 'geyser.publish_to.testapp.testmodel2'
+
+
+class PermissionSnapshotTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json', 'permissions.json']
+    
+    def setUp(self):
+        self.t1a = TestModel1.objects.get(pk=1)
+        self.t1b = TestModel1.objects.get(pk=2)
+        self.t3a = TestModel3.objects.get(pk=1)
+        self.t3b = TestModel3.objects.get(pk=2)
+    
+    def test_has_perm(self):
+        for pk in (1, 2, 3, 4, 6, 9, 10):
+            user = User.objects.get(pk=pk)
+            perms = PermissionSnapshot(user)
+            for perm in ('geyser.publish.testapp.testmodel1',
+                    'geyser.publish_to.testapp.testmodel3',
+                    'geyser.publish_to.testapp.testmodel2'):
+                self.assertEqual(perms.has_perm(perm), user.has_perm(perm))
+            self.assertEqual(perms.has_perm('geyser.publish', obj=self.t1a),
+                user.has_perm('geyser.publish.testapp.testmodel1') or
+                user.has_perm('geyser.publish', obj=self.t1a))
+    
+    def test_same_results(self):
+        for pk in (1, 2, 3, 4, 6, 7, 9, 10):
+            user = User.objects.get(pk=pk)
+            perms = PermissionSnapshot(user)
+            for publishable in (self.t1a, self.t1b):
+                self.assertEqual(
+                    Droplet.objects.get_allowed_publications(publishable, perms),
+                    Droplet.objects.get_allowed_publications(publishable, user))
+    
+    def test_one_query(self):
+        user = User.objects.get(pk=10)
+        perms = PermissionSnapshot(user)
+        settings.DEBUG = True
+        reset_queries()
+        for i in range(5):
+            for publishable in (self.t1a, self.t1b):
+                allowed = Droplet.objects.get_allowed_publication_keys(
+                    publishable, perms)
+                self.assertTrue(self.t3a in allowed)
+                self.assertFalse(self.t3b in allowed)
+        self.assertEqual(len(connection.queries), 4)
+        # the assigned permissions, the publication allowed by object, and
+        # the user and group permissions from ModelBackend, which are asked
+        # about permissions not assigned with rubberstamp
+        settings.DEBUG = False
+    
+    def test_other_backends(self):
+        user = User.objects.get(pk=10)
+        perm = 'geyser.publish_to.testapp.testmodel2'
+        self.assertFalse(PermissionSnapshot(user).has_perm(perm))
+        backends = settings.AUTHENTICATION_BACKENDS
+        settings.AUTHENTICATION_BACKENDS = list(backends) + [
+            'geyser.tests.snapshot.PublishToBackend']
+        try:
+            perms = PermissionSnapshot(user)
+            self.assertTrue(perms.has_perm(perm))
+            self.assertTrue(perms.has_perm('geyser.publish', obj=self.t3a))
+            self.assertFalse(perms.has_perm('geyser.publish',
+                obj=TestModel2.objects.get(pk=1)))
+        finally:
+            settings.AUTHENTICATION_BACKENDS = backends
+    
+    def test_publish_as_snapshot(self):
+        user = User.objects.get(pk=2)
+        Droplet.objects.publish(self.t1a, as_user=PermissionSnapshot(user))
+        droplets = Droplet.objects.all()
+        self.assertEqual(len(droplets), 2)
+        self.assertTrue(all(d.published_by == user for d in droplets))
+
+
+__all__ = ('PermissionSnapshotTest',)
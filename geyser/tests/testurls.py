@@ -9,4 +9,6 @@ urlpatterns = patterns('',
     (r'^t1/(\d+)/$', PublishObject(TestModel1)),
     (r'^t1d/(\d+)/$', PublishObject(TestModel1, with_date=True)),
     (r'^t2d/(\d+)/$', PublishObject(TestModel2, with_date=True)),
+    (r'^t1p/(\d+)/$', PublishObject(TestModel1, per_page=2,
+        search_fields=('name',))),
 )
\ No newline at end of file
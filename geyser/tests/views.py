@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from django.conf import settings
+from django.db import connection, reset_queries
 from django.forms.formsets import BaseFormSet, Form
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
@@ -200,6 +202,153 @@ class PublishViewTest(GeyserTestCase):
         self.assertEqual(droplet.updated_by, self.user)
 
 
+class PublishViewQueriesTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json']
+    urls = 'geyser.tests.testurls'
+    
+    def setUp(self):
+        self.client.login(username='superuser', password='')
+        settings.DEBUG = True
+    
+    def tearDown(self):
+        settings.DEBUG = False
+    
+    def request(self, path, data=None):
+        reset_queries()
+        if data is None:
+            response = self.client.get(path)
+        else:
+            response = self.client.post(path, data)
+        return (len(connection.queries), response)
+    
+    def get_form_dict(self, response, publish):
+        forms = response.context['publication_formset'].forms
+        form_dict = {
+            'form-TOTAL_FORMS': len(forms),
+            'form-INITIAL_FORMS': len(forms),
+        }
+        for (n, form) in enumerate(forms):
+            form_dict['form-%s-type' % n] = form.initial['type']
+            form_dict['form-%s-id' % n] = form.initial['id']
+            if publish:
+                form_dict['form-%s-publish' % n] = 'on'
+        return form_dict
+    
+    def test_query_count(self):
+        counts = []
+        for publishable in TestModel1.objects.all()[:2]:
+            path = '/t1/%s/' % publishable.pk
+            (get_count, response) = self.request(path)
+            (publish_count, response) = self.request(path,
+                self.get_form_dict(response, True))
+            published = Droplet.objects.get_list(publishable=publishable)
+            self.assertEqual(len(published),
+                len(response.context['publication_formset'].forms))
+            (unpublish_count, response) = self.request(path,
+                self.get_form_dict(response, False))
+            self.assertEqual(len(Droplet.objects.get_list(
+                publishable=publishable)), 0)
+            counts.append((get_count, publish_count, unpublish_count))
+            
+            # the counts must not depend on the number of publications
+            for i in range(5):
+                TestModel2.objects.create(name='more %s' % i)
+                TestModel3.objects.create(name='more %s' % i)
+        self.assertEqual(counts[0], counts[1])
+
+
+class PublishViewPaginatedTest(GeyserTestCase):
+    fixtures = ['users.json', 'objects.json']
+    urls = 'geyser.tests.testurls'
+    
+    def setUp(self):
+        self.client.login(username='superuser', password='')
+        self.t1a = TestModel1.objects.get(pk=1)
+        self.t2a = TestModel2.objects.get(pk=1)
+        self.t3a = TestModel3.objects.get(pk=1)
+        self.t3b = TestModel3.objects.get(pk=2)
+        self.type2 = ContentType.objects.get_for_model(TestModel2)
+        self.type3 = ContentType.objects.get_for_model(TestModel3)
+    
+    def get_publications(self, response):
+        return [form.publication
+            for form in response.context['publication_formset'].forms]
+    
+    def key(self, publication):
+        publication_type = ContentType.objects.get_for_model(publication)
+        return '%s-%s' % (publication_type.id, publication.pk)
+    
+    def test_pages(self):
+        response = self.client.get('/t1p/1/')
+        self.assertEqual(response.context['page'].paginator.count, 3)
+        forms = response.context['publication_formset'].forms
+        self.assertEqual([form.publication for form in forms],
+            [self.t2a, self.t3a])
+        self.assertEqual(forms[1].key, self.key(self.t3a))
+        
+        response = self.client.get('/t1p/1/', {'page': 2})
+        self.assertEqual(self.get_publications(response), [self.t3b])
+        self.assertEqual(self.client.get('/t1p/1/', {'page': 3}).status_code,
+            404)
+    
+    def test_search(self):
+        response = self.client.get('/t1p/1/', {'q': 'OBJECT 3'})
+        self.assertEqual(response.context['search'], 'OBJECT 3')
+        self.assertEqual(self.get_publications(response),
+            [self.t3a, self.t3b])
+        response = self.client.get('/t1p/1/', {'q': 'nothing'})
+        self.assertEqual(self.get_publications(response), [])
+    
+    def test_changes(self):
+        response = self.client.post('/t1p/1/', {
+            'publish': [self.key(self.t2a), self.key(self.t3b)]})
+        self.assertFalse(response.context['publish_error'])
+        self.assertEqual(set(Droplet.objects.get_list(publishable=self.t1a)
+            .values_list('publication_type', 'publication_id')),
+            set([(self.type2.id, 1), (self.type3.id, 2)]))
+        forms = response.context['publication_formset'].forms
+        self.assertEqual([form.initial['publish'] for form in forms],
+            [True, False])
+        
+        response = self.client.post('/t1p/1/?page=2', {
+            'publish': [self.key(self.t3a)],
+            'unpublish': [self.key(self.t3b)]})
+        self.assertEqual(set(Droplet.objects.get_list(publishable=self.t1a)
+            .values_list('publication_type', 'publication_id')),
+            set([(self.type2.id, 1), (self.type3.id, 1)]))
+        forms = response.context['publication_formset'].forms
+        self.assertEqual([form.initial['publish'] for form in forms], [False])
+    
+    def test_invalid_changes(self):
+        for data in [
+            {'publish': [self.key(self.t1a)]},
+            {'publish': ['%s-x' % self.type3.id]},
+            {'publish': [self.key(self.t3a)],
+                'unpublish': [self.key(self.t3a)]},
+        ]:
+            response = self.client.post('/t1p/1/', data)
+            self.assertFalse(response.context['changes_form'].is_valid())
+        self.assertEqual(len(Droplet.objects.get_list()), 0)
+    
+    def test_query_count(self):
+        settings.DEBUG = True
+        try:
+            counts = []
+            for round in range(2):
+                reset_queries()
+                self.client.post('/t1p/1/', {
+                    'publish': [self.key(self.t3a)],
+                    'unpublish': [self.key(self.t2a)]})
+                counts.append(len(connection.queries))
+                
+                # the count must not depend on the number of publications
+                for i in range(5):
+                    TestModel3.objects.create(name='more %s' % i)
+        finally:
+            settings.DEBUG = False
+        self.assertEqual(counts[0], counts[1])
+
+
 class PublishViewUniquenessTest(GeyserTestCase):
     fixtures = ['users.json', 'permissions.json']
     urls = 'geyser.tests.testurls'
@@ -230,4 +379,5 @@ class PublishViewUniquenessTest(GeyserTestCase):
         self.assertTrue(post_response.context['publish_error'])
 
 
-__all__ = ('PublishViewTest', 'PublishViewUniquenessTest')
\ No newline at end of file
+__all__ = ('PublishViewTest', 'PublishViewQueriesTest',
+    'PublishViewPaginatedTest', 'PublishViewUniquenessTest')
\ No newline at end of file
@@ -3,10 +3,14 @@ from datetime import datetime
 from django.http import Http404
 from django.shortcuts import render_to_response, get_object_or_404
 from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, InvalidPage
+from django.db.models import Q
 from django.contrib.contenttypes.models import ContentType
 
-from geyser.forms import PublishFormSet, PublishDateTimeForm
+from geyser.forms import PublishFormSet, PublishDateTimeForm, \
+    PublishChangesForm
 from geyser.models import Droplet
+from geyser.snapshot import PermissionSnapshot
 
 
 class PublishObject(object):
@@ -53,34 +57,45 @@ class PublishObject(object):
     Here, `BlogPost` is the `Model` class to be published, and the id of the
     post to be published is captured by the regular expression.
     
+    
+    For objects which can be published to many publications, pass a number
+    of publications per page as the `per_page` keyword argument. The formset
+    then holds only one page of publications, chosen by the ``page`` query
+    parameter, and the context also includes:
+    
+    * `page`: The `Page` of `(content_type, publication)` pairs shown.
+    * `search`: The ``q`` query parameter, which narrows the publications to
+      those with any of the fields named in the `search_fields` keyword
+      argument containing it.
+    * `changes_form`: The form which is posted, with the fields `publish` and
+      `unpublish`, each a list of publications given as
+      ``'<content type id>-<id>'``. Only these publications are loaded and
+      checked. Each form in the formset has this key as `form.key`.
+    
     """
     
     def __init__(self, Model, **kwargs):
         self.Model = Model
         self.with_date = kwargs.get('with_date', False)
         self.template = kwargs.get('template', 'geyser/publish.html')
+        self.per_page = kwargs.get('per_page', None)
+        self.search_fields = kwargs.get('search_fields', ())
     
     def __call__(self, request, object_pk):
         publishable = get_object_or_404(self.Model, pk=object_pk)
         
-        allowed = Droplet.objects.get_allowed_publications(publishable, request.user)
+        perms = PermissionSnapshot.for_request(request)
+        allowed = Droplet.objects.get_allowed_publication_keys(
+            publishable, perms)
         if allowed is None:
             raise Http404
-        allowed_pairs = []
-        for publication in allowed:
-            allowed_pairs.append(
-                (ContentType.objects.get_for_model(publication), publication))
-        
-        current_droplets = Droplet.objects.get_list(publishable=publishable, include_future=True)
-        current_id_pairs = current_droplets.values_list('publication_type_id', 'publication_id')
+        if self.per_page:
+            return self.paginated(request, publishable, perms, allowed)
+        allowed_pairs = list(allowed.pairs())
         
-        formset_data = []
-        for (type, publication) in allowed_pairs:
-            formset_data.append({
-                'type': type.id,
-                'id': publication.id,
-                'publish': (type.id, publication.id) in current_id_pairs
-            })
+        # one query for where the object is published, checked in memory
+        current_pairs = self.get_current_pairs(publishable)
+        formset_data = self.get_formset_data(allowed_pairs, current_pairs)
         
         if request.method == 'POST':
             publication_formset = PublishFormSet(request.POST, initial=formset_data)
@@ -109,28 +124,82 @@ class PublishObject(object):
                     publish_datetime = datetime_form.cleaned_data['publish_datetime']
                     if not publish_datetime:
                         publish_datetime = datetime.now()
-                    try:
-                        Droplet.objects.publish(publishable, to_publish,
-                            request.user, published=publish_datetime)
-                    except ValidationError, exception:
-                        publish_error = str(exception)
-                    else:
-                        Droplet.objects.unpublish(publishable, to_unpublish,
-                            request.user)
+                    publish_error = self.update_droplets(publishable,
+                        to_publish, to_unpublish, perms,
+                        published=publish_datetime)
+                    if not publish_error:
                         datetime_form = PublishDateTimeForm()
             else:
-                try:
-                    Droplet.objects.publish(publishable, to_publish,
-                        request.user)
-                except ValidationError, exception:
-                    publish_error = str(exception)
-                else:
-                    Droplet.objects.unpublish(publishable, to_unpublish,
-                        request.user)
+                publish_error = self.update_droplets(publishable, to_publish,
+                    to_unpublish, perms)
+        
+        context_dict = {
+            'object': publishable,
+            'publication_formset': publication_formset,
+            'publish_error': publish_error
+        }
+        if self.with_date:
+            context_dict['datetime_form'] = datetime_form
+        
+        return render_to_response(
+            self.template,
+            context_dict
+        )
+    
+    def paginated(self, request, publishable, perms, allowed):
+        """
+        Handles a request when `per_page` is given, loading only the page of
+        publications shown and those named in the posted changes.
+        
+        """
+        
+        publish_error = None
+        if request.method == 'POST':
+            changes_form = PublishChangesForm(request.POST, allowed=allowed)
+            if self.with_date:
+                datetime_form = PublishDateTimeForm(request.POST)
+            if changes_form.is_valid() and (
+                    not self.with_date or datetime_form.is_valid()):
+                droplet_dict = {}
+                if self.with_date:
+                    droplet_dict['published'] = (
+                        datetime_form.cleaned_data['publish_datetime'] or
+                        datetime.now())
+                publish_error = self.update_droplets(publishable,
+                    allowed.load(changes_form.cleaned_data['publish']),
+                    allowed.load(changes_form.cleaned_data['unpublish']),
+                    perms, **droplet_dict)
+                if not publish_error:
+                    changes_form = PublishChangesForm(allowed=allowed)
+                    if self.with_date:
+                        datetime_form = PublishDateTimeForm()
+        else:
+            changes_form = PublishChangesForm(allowed=allowed)
+            if self.with_date:
+                datetime_form = PublishDateTimeForm()
+        
+        search = request.GET.get('q', '')
+        paginator = Paginator(
+            AllowedPairs(allowed, search, self.search_fields), self.per_page)
+        try:
+            page = paginator.page(request.GET.get('page', 1))
+        except InvalidPage:
+            raise Http404
+        page_pairs = list(page.object_list)
+        
+        current_pairs = self.get_current_pairs(publishable, page_pairs)
+        publication_formset = PublishFormSet(
+            initial=self.get_formset_data(page_pairs, current_pairs))
+        for (form, pair) in zip(publication_formset.forms, page_pairs):
+            (form.publication_type, form.publication) = pair
+            form.key = '%s-%s' % (pair[0].id, pair[1].pk)
         
         context_dict = {
             'object': publishable,
             'publication_formset': publication_formset,
+            'changes_form': changes_form,
+            'page': page,
+            'search': search,
             'publish_error': publish_error
         }
         if self.with_date:
@@ -139,4 +208,142 @@ class PublishObject(object):
         return render_to_response(
             self.template,
             context_dict
-        )
\ No newline at end of file
+        )
+    
+    def get_current_pairs(self, publishable, pairs=None):
+        """
+        Returns a set of `(content_type_id, pk)` pairs for the publications to
+        which the object is published, with one query. If `pairs` of
+        `(content_type, publication)` are given, only those are checked.
+        
+        """
+        
+        droplets = Droplet.objects.get_list(filters={
+            'publishable_type': ContentType.objects.get_for_model(publishable),
+            'publishable_id': publishable.pk,
+        }, include_future=True, lean=True)
+        if pairs is not None:
+            if not pairs:
+                return set()
+            ids_by_type = {}
+            for (type, publication) in pairs:
+                ids_by_type.setdefault(type, []).append(publication.pk)
+            q = Q(pk__isnull=True)
+            for (type, ids) in ids_by_type.items():
+                q = q | Q(publication_type=type, publication_id__in=ids)
+            droplets = droplets.filter(q)
+        return set(droplets.values_list(
+            'publication_type_id', 'publication_id'))
+    
+    def get_formset_data(self, pairs, current_pairs):
+        formset_data = []
+        for (type, publication) in pairs:
+            formset_data.append({
+                'type': type.id,
+                'id': publication.id,
+                'publish': (type.id, publication.id) in current_pairs
+            })
+        return formset_data
+    
+    def update_droplets(self, publishable, to_publish, to_unpublish, as_user,
+            **droplet_dict):
+        """
+        Publishes and unpublishes the object with the bulk `DropletManager`
+        methods, so that the number of queries does not grow with the number
+        of publications. Returns the error message if publishing fails
+        validation, in which case nothing is unpublished, or else `None`.
+        
+        """
+        
+        if to_publish:
+            try:
+                Droplet.objects.publish_many([publishable], to_publish,
+                    as_user, **droplet_dict)
+            except ValidationError, exception:
+                return str(exception)
+        if to_unpublish:
+            Droplet.objects.unpublish_many([publishable], to_unpublish,
+                as_user)
+        return None
+
+
+class AllowedPairs(object):
+    """
+    The `(content_type, publication)` pairs for `AllowedPublications`, in
+    order of content type and primary key, optionally narrowed to those with
+    any of `search_fields` containing `search`. Supports `len()` and slicing,
+    so that a `Paginator` loads only the publications on one page.
+    
+    """
+    
+    def __init__(self, allowed, search='', search_fields=()):
+        self.allowed = allowed
+        self.search = search
+        self.search_fields = search_fields
+        self._querysets = None
+        self._counts = None
+    
+    def _matches(self, publication, field_names):
+        search = self.search.lower()
+        for name in field_names:
+            value = getattr(publication, name)
+            if value is not None and search in unicode(value).lower():
+                return True
+        return False
+    
+    def querysets(self):
+        """Returns `(content_type, publications)` pairs for each type."""
+        if self._querysets is None:
+            self._querysets = []
+            types = sorted(self.allowed.allowed_to, key=lambda t: t.id)
+            for publication_type in types:
+                Model = publication_type.model_class()
+                field_names = [name for name in self.search_fields
+                    if name in [f.name for f in Model._meta.fields]]
+                publications = self.allowed.queryset(publication_type)
+                if isinstance(publications, list):
+                    if self.search:
+                        publications = [p for p in publications
+                            if self._matches(p, field_names)]
+                    publications.sort(key=lambda p: p.pk)
+                else:
+                    if self.search:
+                        q = Q(pk__isnull=True)
+                        for name in field_names:
+                            q = q | Q(**{'%s__icontains' % name: self.search})
+                        publications = publications.filter(q)
+                    publications = publications.order_by('pk')
+                self._querysets.append((publication_type, publications))
+        return self._querysets
+    
+    def counts(self):
+        if self._counts is None:
+            self._counts = []
+            for (publication_type, publications) in self.querysets():
+                if isinstance(publications, list):
+                    self._counts.append(len(publications))
+                else:
+                    self._counts.append(publications.count())
+        return self._counts
+    
+    def count(self):
+        return sum(self.counts())
+    
+    def __len__(self):
+        return self.count()
+    
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            return self[k:k + 1][0]
+        (start, stop, step) = k.indices(self.count())
+        pairs = []
+        offset = 0
+        for ((publication_type, publications), count) in zip(
+                self.querysets(), self.counts()):
+            if start < offset + count and stop > offset:
+                type_start = max(start - offset, 0)
+                type_stop = min(stop - offset, count)
+                pairs.extend((publication_type, publication) for publication
+                    in publications[type_start:type_stop])
+            offset += count
+        return pairs
@@ -9,5 +9,8 @@ setup(
     author='James Lecker Jr',
     author_email='james@jameslecker.com',
     url='http://github.com/jlecker/django-geyser',
-    packages=['geyser']
+    packages=['geyser', 'geyser.management', 'geyser.management.commands',
+        'geyser.tests', 'geyser.tests.testapp'],
+    package_data={'geyser': ['sql/*.sql', 'tests/fixtures/*.json',
+        'tests/templates/*.html', 'tests/templates/geyser/*.html']}
 )
\ No newline at end of file